@@ -0,0 +1 @@
+"""Benchmarks of hot paths, run them as modules: `python -m benchmarks.*`."""
@@ -0,0 +1,134 @@
+"""Benchmark of reads of appointment csv file.
+
+Compares `pd.read_csv` with type inference, the schema read by the
+pyarrow engine and the memory-mapped Arrow cache: cold (cache is built)
+and warm (cache is mapped). Bytes copied by a warm read out of the mapped
+cache are measured too.
+
+Usage: python -m benchmarks.columnar [ROWS ...]
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+import pyarrow as pa
+from clinic_app.backend.columnar import cache_path, read_cached
+from clinic_app.backend.schema import CSVSchema
+
+DEFAULT_ROWS = (10_000, 100_000, 1_000_000)
+REPEATS = 5
+
+SCHEMA = CSVSchema(
+    dtypes={
+        "Телефон": "string",
+        "ИДВрач": "category",
+        "ИДФилиал": "category",
+        "Подтверждение": "Int8",
+        "Перезапись": "Int8",
+        "Отзыв": "string",
+    },
+    datetimes=("ДатаНачала",),
+)
+
+
+def make_csv(path: str, rows: int) -> None:
+    """Write appointment csv file with extra columns of the export."""
+    rnd = random.Random(rows)
+    pd.DataFrame(
+        {
+            "Телефон": [
+                f"+7(9{rnd.randrange(10**9):09d})" for _ in range(rows)
+            ],
+            "ДатаНачала": [
+                f"2024-05-{rnd.randrange(1, 29):02d} 10:00"
+                for _ in range(rows)
+            ],
+            "ИДВрач": [rnd.randrange(500) for _ in range(rows)],
+            "ИДФилиал": [rnd.randrange(20) for _ in range(rows)],
+            "Подтверждение": None,
+            "Перезапись": None,
+            "Отзыв": None,
+            "Пациент": ["Иванов Иван Иванович"] * rows,
+            "Комментарий": ["Первичный прием"] * rows,
+        }
+    ).to_csv(path, index=False)
+
+
+def measure(func: Callable[[], object], before: Callable[[], None]) -> float:
+    """Get best time of `func` in seconds."""
+    best = float("inf")
+    for _ in range(REPEATS):
+        before()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def copied(func: Callable[[], object]) -> int:
+    """Get bytes allocated by `func` and kept in its result."""
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        result = func()
+        python, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    arrow = pa.total_allocated_bytes() - arrow_before
+    del result
+    return python + arrow
+
+
+def run(rows: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "tomorrow.csv")
+        make_csv(path, rows)
+        cache = Path(cache_path(path))
+
+        def drop_cache() -> None:
+            cache.unlink(missing_ok=True)
+
+        def keep_cache() -> None:
+            pass
+
+        def read_schema() -> pd.DataFrame:
+            return SCHEMA.read(path)
+
+        results = {
+            "read_csv": measure(lambda: pd.read_csv(path), keep_cache),
+            "schema (pyarrow)": measure(read_schema, keep_cache),
+            "arrow cache cold": measure(
+                lambda: read_cached(path, SCHEMA), drop_cache
+            ),
+            "arrow cache warm": measure(
+                lambda: read_cached(path, SCHEMA), keep_cache
+            ),
+        }
+        mapped = os.path.getsize(cache)
+        copy = copied(lambda: read_cached(path, SCHEMA))
+
+    print(f"{rows} rows")
+    for name, seconds in results.items():
+        print(f"  {name:<18} {seconds * 1000:9.1f} ms")
+    print(
+        f"  warm read copies {copy / 2**20:.1f} MiB "
+        f"of {mapped / 2**20:.1f} MiB mapped"
+    )
+
+
+def main(argv: list[str]) -> None:
+    for rows in map(int, argv) if argv else DEFAULT_ROWS:
+        run(rows)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
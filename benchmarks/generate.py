@@ -0,0 +1,203 @@
+"""Generator of synthetic clinic csv files.
+
+Files are written in the layout of `CSVS` under the output directory:
+`db.csv` with registered patients and appointment files `tomorrow.csv`,
+`2hours.csv` and `Reviews.csv` with phones in formats of real exports,
+unregistered patients and duplicated rows.
+
+Usage: python -m benchmarks.generate OUT_DIR [PATIENTS [APPOINTMENTS]]
+"""
+
+from __future__ import annotations
+
+import random
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+from clinic_app.backend.utils import PHONE_KEY, format_phone
+from clinic_app.shared import CSVS
+from zoneinfo import ZoneInfo
+
+PHONE_FORMATS = (
+    "+7({a}){b}-{c}-{d}",
+    "8({a}){b}-{c}-{d}",
+    "+7{a}{b}{c}{d}",
+    "8{a}{b}{c}{d}",
+    "7-{a}-{b}-{c}-{d}",
+    "+7-{a}-{b}{c}{d}",
+)
+DATE_FORMATS = ("%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M")
+NAMES = ("Иванов", "Петрова", "Смирнов", "Кузнецова", "Попов", "Соколова")
+VISITS = ("Первичный прием", "Повторный прием", "Анализы", "УЗИ")
+
+
+@dataclass(frozen=True)
+class Scale:
+    """Size and shape of generated data.
+
+    Parameters
+    ----------
+    patients : int
+        Rows of `db.csv`.
+    appointments : int
+        Rows of `tomorrow.csv`, `Reviews.csv` has the same count and
+        `2hours.csv` a tenth of it.
+    registered_ratio : float
+        Share of appointments of registered patients.
+    telegram_ratio : float
+        Share of patients registered in Telegram, the rest are
+        registered in WhatsApp, `both_ratio` of them in both.
+    both_ratio : float
+        Share of patients registered in both bots.
+    duplicate_ratio : float
+        Share of duplicated rows in every file.
+    doctors : int
+        Count of doctor ids.
+    clinics : int
+        Count of clinic ids.
+    seed : int
+        Seed of random generator.
+
+    """
+
+    patients: int = 10_000
+    appointments: int = 5_000
+    registered_ratio: float = 0.6
+    telegram_ratio: float = 0.5
+    both_ratio: float = 0.1
+    duplicate_ratio: float = 0.03
+    doctors: int = 200
+    clinics: int = 10
+    seed: int = 0
+
+
+def _digits(number: int) -> tuple[str, str, str, str]:
+    digits = f"9{number:09d}"
+    return digits[:3], digits[3:6], digits[6:8], digits[8:]
+
+
+def raw_phone(rnd: random.Random, number: int) -> str:
+    """Get phone of `number` in random format of exports."""
+    a, b, c, d = _digits(number)
+    return rnd.choice(PHONE_FORMATS).format(a=a, b=b, c=c, d=d)
+
+
+def _duplicate(
+    rnd: random.Random, rows: list[dict], ratio: float
+) -> list[dict]:
+    count = int(len(rows) * ratio)
+    rows = rows + [dict(rnd.choice(rows)) for _ in range(count)]
+    rnd.shuffle(rows)
+    return rows
+
+
+def make_patients(rnd: random.Random, scale: Scale) -> pd.DataFrame:
+    """Get dataframe of `db.csv`."""
+    rows = []
+    for number in range(scale.patients):
+        # Bots save phones formatted
+        phone = format_phone(raw_phone(rnd, number))
+        choice = rnd.random()
+        telegram = choice < scale.telegram_ratio + scale.both_ratio
+        whatsapp = choice >= scale.telegram_ratio
+        chat_id = "7{}{}{}{}@c.us".format(*_digits(number))
+        rows.append(
+            {
+                "phone": phone,
+                "tg_user_id": 10**8 + number if telegram else None,
+                "tg_username": f"user{number}" if telegram else None,
+                "wh_user_id": chat_id if whatsapp else None,
+                PHONE_KEY: phone,
+            }
+        )
+    return pd.DataFrame(_duplicate(rnd, rows, scale.duplicate_ratio))
+
+
+def make_appointments(
+    rnd: random.Random, scale: Scale, rows: int, start: datetime
+) -> pd.DataFrame:
+    """Get dataframe of appointment file with starts around `start`."""
+    result = []
+    for _ in range(rows):
+        if rnd.random() < scale.registered_ratio:
+            number = rnd.randrange(scale.patients)
+        else:
+            # Numbers after registered ones aren't in `db.csv`
+            number = scale.patients + rnd.randrange(scale.patients)
+        visit = start + timedelta(minutes=15 * rnd.randrange(-8, 8))
+        result.append(
+            {
+                "Телефон": raw_phone(rnd, number),
+                "ДатаНачала": visit.strftime(rnd.choice(DATE_FORMATS)),
+                "ИДВрач": rnd.randrange(scale.doctors),
+                "ИДФилиал": rnd.randrange(scale.clinics),
+                "Пациент": rnd.choice(NAMES),
+                "Комментарий": rnd.choice(VISITS),
+                "Подтверждение": None,
+                "Перезапись": None,
+                "Отзыв": None,
+            }
+        )
+    return pd.DataFrame(_duplicate(rnd, result, scale.duplicate_ratio))
+
+
+def generate(
+    directory: str | Path, scale: Scale = Scale()
+) -> dict[str, Path]:
+    """Write csv files of `CSVS` under `directory`.
+
+    Parameters
+    ----------
+    directory : str | Path
+        output directory, paths of `CSVS` are relative to it.
+    scale : Scale, optional
+        size and shape of data, by default `Scale()`.
+
+    Returns
+    -------
+    dict[str, Path]
+        key of `CSVS` to path of written file.
+    """
+    rnd = random.Random(scale.seed)
+    now = datetime.now(ZoneInfo("Europe/Moscow")).replace(
+        tzinfo=None, second=0, microsecond=0
+    )
+    frames = {
+        "db": make_patients(rnd, scale),
+        "tommorow": make_appointments(
+            rnd, scale, scale.appointments, now + timedelta(days=1)
+        ),
+        "2hours": make_appointments(
+            rnd,
+            scale,
+            max(scale.appointments // 10, 1),
+            now + timedelta(hours=4),
+        ),
+        "reviews": make_appointments(
+            rnd, scale, scale.appointments, now - timedelta(days=1)
+        ),
+    }
+
+    paths = {}
+    for kind, df in frames.items():
+        path = Path(directory) / CSVS[kind]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(path, index=False)
+        paths[kind] = path
+    return paths
+
+
+def main(argv: list[str]) -> None:
+    if not argv:
+        sys.exit(__doc__)
+    sizes = list(map(int, argv[1:3]))
+    scale = Scale(*sizes)
+    for kind, path in generate(argv[0], scale).items():
+        print(f"{kind}: {path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
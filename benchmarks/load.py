@@ -0,0 +1,267 @@
+"""End-to-end load test of bots against local stand-in servers.
+
+Csv files are generated into a temporary working directory, bots are
+started as processes with config pointing at stand-ins of Telegram Bot
+API and Green API. Bots send reminders of the first tick, scripted
+patients confirm them and bots answer. The run ends after `--duration`
+seconds or `--idle` seconds without messages of bots, then throughput of
+messages, p50/p99 latency from reply of patient to answer of bot and
+peak memory of processes are reported as JSON. `--combined` runs both
+bots in one process, `--webhook` makes Telegram post updates to the
+webhook server of the telegram bot instead of polling, `--workers`
+routes telegram updates to worker processes.
+
+Usage: python -m benchmarks.load [--bots telegram whatsapp] [options]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import yaml
+from benchmarks.generate import Scale, generate
+from benchmarks.standins import (
+    Behaviour,
+    GreenApiStandIn,
+    StandIn,
+    TelegramStandIn,
+)
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = {
+    "telegram": "clinic_app.frontend.telegram_bot.main",
+    "whatsapp": "clinic_app.frontend.whatsapp_bot.main",
+}
+COMBINED_MODULE = "clinic_app.frontend.combined.main"
+ENV = {
+    "TELEGRAM_BOT_TOKEN": "123456:" + "A" * 35,
+    "WHATSAPP_BOT_ID_INSTANCE": "1101",
+    "WHATSAPP_BOT_API_TOKEN_INSTANCE": "token",
+}
+
+
+def prepare_workdir(
+    directory: Path,
+    scale: Scale,
+    urls: Optional[dict[str, str]] = None,
+    webhook_port: Optional[int] = None,
+    workers: int = 0,
+) -> None:
+    """Write generated csv files, config.yml and .env into `directory`.
+
+    Parameters
+    ----------
+    directory : Path
+        working directory of bots.
+    scale : Scale
+        size and shape of generated data.
+    urls : Optional[dict[str, str]], optional
+        `telegram` and `whatsapp` to url of stand-in server,
+        by default urls of config.yml are kept.
+    webhook_port : Optional[int], optional
+        local port of the webhook server of the telegram bot, by default
+        it polls updates.
+    workers : int, optional
+        worker processes handling telegram updates, by default 0.
+    """
+    config = yaml.safe_load((ROOT / "config.yml").read_text())
+    if urls is not None:
+        config["telegram_bot"]["api_url"] = urls["telegram"]
+        config["whatsapp_bot"]["api_url"] = urls["whatsapp"]
+    if webhook_port is not None:
+        config["telegram_bot"]["webhook"].update(
+            url=f"http://127.0.0.1:{webhook_port}",
+            host="127.0.0.1",
+            port=webhook_port,
+        )
+    config["telegram_bot"]["supervisor"]["workers"] = workers
+    # Ticks are triggered by the first check and benchmarks only
+    config["watcher"]["enabled"] = False
+
+    (directory / "config.yml").write_text(
+        yaml.safe_dump(config, allow_unicode=True)
+    )
+    (directory / ".env").write_text(
+        "".join(f"{key}={value}\n" for key, value in ENV.items())
+    )
+    generate(directory, scale)
+
+
+def free_port() -> int:
+    """Get a local port nobody listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_idle(
+    standins: list[StandIn], duration: float, idle: float
+) -> None:
+    """Wait until bots are idle for `idle` seconds or `duration` ends."""
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        await asyncio.sleep(0.5)
+        last = [s.last_sent for s in standins if s.last_sent is not None]
+        if len(last) == len(standins) and time.monotonic() - max(last) > idle:
+            return
+
+
+def peak_memory(pid: int) -> Optional[int]:
+    """Get peak resident memory of process in KiB, None if unknown.
+
+    Peaks of child processes, e.g. workers of the telegram bot, are
+    added.
+    """
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmHWM:"):
+            peak = int(line.split()[1])
+            break
+    else:
+        return None
+    for child in children.split():
+        peak += peak_memory(int(child)) or 0
+    return peak
+
+
+async def stop_process(process: asyncio.subprocess.Process) -> None:
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), 10)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    """Run bots against stand-ins and get stats of stand-ins."""
+    workdir = Path(tempfile.mkdtemp(prefix="clinic-load-"))
+    behaviour = Behaviour(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        reply_delay=args.reply_delay,
+    )
+    standins = {
+        "telegram": TelegramStandIn(behaviour),
+        "whatsapp": GreenApiStandIn(behaviour),
+    }
+    urls = {name: await s.start() for name, s in standins.items()}
+    prepare_workdir(
+        workdir,
+        Scale(args.patients, args.appointments),
+        urls,
+        webhook_port=free_port() if args.webhook else None,
+        workers=args.workers,
+    )
+
+    bots = list(MODULES) if args.combined else args.bots
+    modules = {name: MODULES[name] for name in bots}
+    if args.combined:
+        modules = {"combined": COMBINED_MODULE}
+
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    processes = {}
+    memory = {}
+    try:
+        for name, module in modules.items():
+            log = open(workdir / f"{name}.log", "wb")
+            processes[name] = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                module,
+                cwd=workdir,
+                env=env,
+                stdout=log,
+                stderr=log,
+            )
+            log.close()
+        await wait_idle(
+            [standins[name] for name in bots], args.duration, args.idle
+        )
+    finally:
+        for name, process in processes.items():
+            memory[name] = peak_memory(process.pid)
+        await asyncio.gather(*map(stop_process, processes.values()))
+        for standin in standins.values():
+            await standin.stop()
+
+    report: dict[str, Any] = {"workdir": str(workdir), "peak_kib": memory}
+    for name in bots:
+        report[name] = standins[name].stats()
+    return report
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.load", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument(
+        "--bots", nargs="+", choices=list(MODULES), default=list(MODULES)
+    )
+    parser.add_argument(
+        "--combined",
+        action="store_true",
+        help="run both bots in one process",
+    )
+    parser.add_argument(
+        "--webhook",
+        action="store_true",
+        help="post telegram updates to the webhook instead of polling",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="worker processes handling telegram updates",
+    )
+    parser.add_argument("--patients", type=int, default=Scale.patients)
+    parser.add_argument(
+        "--appointments", type=int, default=Scale.appointments
+    )
+    parser.add_argument(
+        "--duration", type=float, default=300, help="max seconds of run"
+    )
+    parser.add_argument(
+        "--idle",
+        type=float,
+        default=10,
+        help="seconds without messages of bots which end the run",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per response"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="share of failed sends"
+    )
+    parser.add_argument(
+        "--rate-limit", type=int, default=0, help="sends per second, 0 is off"
+    )
+    parser.add_argument(
+        "--reply-delay",
+        type=float,
+        default=0.0,
+        help="seconds before reply of scripted patient",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    report = asyncio.run(run(parse_args(sys.argv[1:])))
+    print(json.dumps(report, indent=2))
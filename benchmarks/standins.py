@@ -0,0 +1,483 @@
+"""Local stand-in servers of Telegram Bot API and Green API.
+
+Only methods used by bots are implemented. Latency, error rate and rate
+limit of responses are configurable. Scripted patients reply to messages
+of bots containing a pattern, messages can be injected by `inject` or
+`POST /inject` too. The time from an injected message to the next
+message of a bot to the chat is recorded as end-to-end latency.
+
+Usage: python -m benchmarks.standins [TELEGRAM_PORT [GREEN_API_PORT]]
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import math
+import random
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+from loguru import logger
+
+DEFAULT_TELEGRAM_PORT = 8081
+DEFAULT_GREEN_API_PORT = 8082
+# Replies of scripted patients, pattern of message of bot to reply
+DEFAULT_REPLIES = {"подтверждаете запись?": "Да"}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Get nearest-rank percentile, 0 for empty values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+@dataclass
+class Behaviour:
+    """Responses of a stand-in server.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds added to every response.
+    error_rate : float
+        Share of sent messages answered by server error.
+    rate_limit : int
+        Sent messages per second, the rest are answered by 429,
+        0 disables the limit.
+    reply_delay : float
+        Seconds scripted patients think before reply.
+    replies : dict[str, str]
+        Pattern in message of bot to reply of scripted patient.
+    seed : int
+        Seed of random errors.
+
+    """
+
+    latency: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: int = 0
+    reply_delay: float = 0.0
+    replies: dict[str, str] = field(
+        default_factory=lambda: dict(DEFAULT_REPLIES)
+    )
+    seed: int = 0
+
+
+class StandIn:
+    """Common part of stand-in servers: behaviour, scripts and stats."""
+
+    def __init__(self, behaviour: Optional[Behaviour] = None) -> None:
+        self.behaviour = behaviour or Behaviour()
+        self.app = web.Application()
+        self.app.router.add_post("/inject", self._inject)
+
+        self.sent = 0
+        self.injected = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.latencies: list[float] = []
+        self.first_sent: Optional[float] = None
+        self.last_sent: Optional[float] = None
+
+        self._random = random.Random(self.behaviour.seed)
+        self._injected_at: dict[str, float] = {}
+        self._window_start = 0.0
+        self._window_count = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start server and return its url."""
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def inject(
+        self, chat_id: Any, text: str, phone: Optional[str] = None
+    ) -> None:
+        """Put message of patient into updates of the bot."""
+        self.injected += 1
+        self._injected_at[str(chat_id)] = time.monotonic()
+        self._deliver(chat_id, text, phone)
+
+    def _deliver(
+        self, chat_id: Any, text: str, phone: Optional[str]
+    ) -> None:
+        raise NotImplementedError
+
+    async def _inject(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.inject(data["chat_id"], data.get("text", ""), data.get("phone"))
+        return web.json_response({"ok": True})
+
+    async def _delay(self) -> None:
+        if self.behaviour.latency:
+            await asyncio.sleep(self.behaviour.latency)
+
+    def _fault(self) -> Optional[int]:
+        """Get status of failed send or None if message is accepted."""
+        if self.behaviour.rate_limit:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self.behaviour.rate_limit:
+                self.rate_limited += 1
+                return 429
+
+        if self._random.random() < self.behaviour.error_rate:
+            self.errors += 1
+            return 500
+        return None
+
+    def _on_sent(self, chat_id: Any, text: str) -> None:
+        """Record message of bot and start reply of scripted patient."""
+        now = time.monotonic()
+        self.sent += 1
+        self.first_sent = self.first_sent or now
+        self.last_sent = now
+
+        injected_at = self._injected_at.pop(str(chat_id), None)
+        if injected_at is not None:
+            self.latencies.append(now - injected_at)
+
+        for pattern, reply in self.behaviour.replies.items():
+            if pattern in text:
+                asyncio.get_running_loop().call_later(
+                    self.behaviour.reply_delay,
+                    self.inject,
+                    chat_id,
+                    reply,
+                )
+                break
+
+    def stats(self) -> dict[str, Any]:
+        """Get counters, throughput and end-to-end latencies."""
+        duration = 0.0
+        if self.first_sent is not None:
+            duration = self.last_sent - self.first_sent
+        return {
+            "sent": self.sent,
+            "injected": self.injected,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "throughput": self.sent / duration if duration else 0.0,
+            "replies": len(self.latencies),
+            "p50": percentile(self.latencies, 50),
+            "p99": percentile(self.latencies, 99),
+        }
+
+
+class TelegramStandIn(StandIn):
+    """Telegram Bot API: `getMe`, `sendMessage`, `getUpdates` and webhooks.
+
+    Other methods are answered by `true`. Updates are delivered by
+    `getUpdates` or posted to the url of `setWebhook`.
+    """
+
+    def __init__(self, behaviour: Optional[Behaviour] = None) -> None:
+        super().__init__(behaviour)
+        self.app.router.add_post("/bot{token}/{method}", self._call)
+        self.app.router.add_get("/bot{token}/{method}", self._call)
+
+        self.updates: deque[dict] = deque()
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.webhook_errors = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._webhook_tasks: set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def stats(self) -> dict[str, Any]:
+        return {**super().stats(), "webhook_errors": self.webhook_errors}
+
+    async def stop(self) -> None:
+        for task in self._webhook_tasks:
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+        await super().stop()
+
+    def _deliver(
+        self, chat_id: Any, text: str, phone: Optional[str]
+    ) -> None:
+        user = {
+            "id": int(chat_id),
+            "is_bot": False,
+            "first_name": "Пациент",
+            "username": f"user{chat_id}",
+        }
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+            "from": user,
+            "text": text,
+        }
+        if phone is not None:
+            del message["text"]
+            message["contact"] = {
+                "phone_number": phone,
+                "first_name": "Пациент",
+                "user_id": int(chat_id),
+            }
+        update = {"update_id": next(self._update_ids), "message": message}
+
+        if self.webhook_url:
+            self._post_later(update)
+        else:
+            self.updates.append(update)
+            self._new_updates.set()
+
+    def _post_later(self, update: dict) -> None:
+        task = asyncio.create_task(self._post_update(update))
+        self._webhook_tasks.add(task)
+        task.add_done_callback(self._webhook_tasks.discard)
+
+    async def _post_update(self, update: dict) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        headers = {}
+        if self.webhook_secret:
+            headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+        try:
+            async with self._session.post(
+                self.webhook_url, json=update, headers=headers
+            ) as response:
+                if response.status >= 400:
+                    self.webhook_errors += 1
+        except aiohttp.ClientError:
+            self.webhook_errors += 1
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(status: int, description: str, **extra: Any) -> web.Response:
+        body = {
+            "ok": False,
+            "error_code": status,
+            "description": description,
+            **extra,
+        }
+        return web.json_response(body, status=status)
+
+    async def _call(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+            params.update(request.query)
+        await self._delay()
+
+        if method == "getMe":
+            token = request.match_info["token"]
+            return self._ok(
+                {
+                    "id": int(token.split(":")[0]),
+                    "is_bot": True,
+                    "first_name": "Clinic",
+                    "username": "clinic_bot",
+                }
+            )
+        if method == "sendMessage":
+            return self._send_message(params)
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+            self.webhook_secret = params.get("secret_token", "")
+            # Pending updates go to the webhook unless they're dropped
+            if str(params.get("drop_pending_updates")).lower() != "true":
+                for update in self.updates:
+                    self._post_later(update)
+            self.updates.clear()
+            return self._ok(True)
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            return self._ok(True)
+        return self._ok(True)
+
+    def _send_message(self, params: dict[str, Any]) -> web.Response:
+        status = self._fault()
+        if status == 429:
+            return self._error(
+                429,
+                "Too Many Requests: retry after 1",
+                parameters={"retry_after": 1},
+            )
+        if status is not None:
+            return self._error(status, "Internal Server Error")
+
+        chat_id = int(params["chat_id"])
+        text = params.get("text", "")
+        self._on_sent(chat_id, text)
+        return self._ok(
+            {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+        )
+
+    async def _get_updates(self, params: dict[str, Any]) -> web.Response:
+        if self.webhook_url:
+            return self._error(
+                409, "Conflict: can't use getUpdates while webhook is active"
+            )
+
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Updates before offset are confirmed by the bot
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._ok(list(itertools.islice(self.updates, limit)))
+
+
+class GreenApiStandIn(StandIn):
+    """Green API: `sendMessage`, `receiveNotification`,
+    `deleteNotification` and `setSettings`.
+
+    As Green API does, `receiveNotification` returns the head of the
+    queue until it's deleted.
+    """
+
+    def __init__(self, behaviour: Optional[Behaviour] = None) -> None:
+        super().__init__(behaviour)
+        prefix = "/waInstance{instance}"
+        router = self.app.router
+        router.add_post(f"{prefix}/sendMessage/{{token}}", self._send)
+        router.add_get(
+            f"{prefix}/receiveNotification/{{token}}", self._receive
+        )
+        router.add_delete(
+            f"{prefix}/deleteNotification/{{token}}/{{receipt}}",
+            self._delete,
+        )
+        router.add_post(f"{prefix}/setSettings/{{token}}", self._settings)
+
+        self.notifications: deque[dict] = deque()
+        self.settings: dict[str, Any] = {}
+        self._receipt_ids = itertools.count(1)
+        self._new_notifications = asyncio.Event()
+
+    def _deliver(
+        self, chat_id: Any, text: str, phone: Optional[str]
+    ) -> None:
+        chat_id = str(chat_id)
+        body = {
+            "typeWebhook": "incomingMessageReceived",
+            "timestamp": int(time.time()),
+            "senderData": {
+                "chatId": chat_id,
+                "sender": chat_id,
+                "senderName": "Пациент",
+            },
+            "messageData": {
+                "typeMessage": "textMessage",
+                "textMessageData": {"textMessage": text},
+            },
+        }
+        self.notifications.append(
+            {"receiptId": next(self._receipt_ids), "body": body}
+        )
+        self._new_notifications.set()
+
+    async def _send(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await self._delay()
+
+        status = self._fault()
+        if status is not None:
+            return web.Response(status=status, text="stand-in fault")
+
+        self._on_sent(data["chatId"], data.get("message", ""))
+        return web.json_response({"idMessage": f"{self.sent:020X}"})
+
+    async def _receive(self, request: web.Request) -> web.Response:
+        await self._delay()
+        timeout = float(request.query.get("receiveTimeout") or 0)
+        if not self.notifications and timeout:
+            self._new_notifications.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_notifications.wait(), timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+        if not self.notifications:
+            return web.Response(text="null", content_type="application/json")
+        return web.json_response(self.notifications[0])
+
+    async def _delete(self, request: web.Request) -> web.Response:
+        await self._delay()
+        receipt = int(request.match_info["receipt"])
+        head = self.notifications[0] if self.notifications else None
+        if head is not None and head["receiptId"] == receipt:
+            self.notifications.popleft()
+            return web.json_response({"result": True})
+        return web.json_response({"result": False})
+
+    async def _settings(self, request: web.Request) -> web.Response:
+        self.settings.update(await request.json())
+        await self._delay()
+        return web.json_response({"saveSettings": True})
+
+
+async def serve(telegram_port: int, green_api_port: int) -> None:
+    """Run both stand-ins and log their stats until cancelled."""
+    telegram = TelegramStandIn()
+    green_api = GreenApiStandIn()
+    urls = (
+        await telegram.start(port=telegram_port),
+        await green_api.start(port=green_api_port),
+    )
+    logger.info(f"Telegram Bot API: {urls[0]}, Green API: {urls[1]}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            stats = {
+                "telegram": telegram.stats(),
+                "green_api": green_api.stats(),
+            }
+            logger.info(json.dumps(stats))
+    finally:
+        await telegram.stop()
+        await green_api.stop()
+
+
+if __name__ == "__main__":
+    ports = list(map(int, sys.argv[1:3]))
+    ports += [DEFAULT_TELEGRAM_PORT, DEFAULT_GREEN_API_PORT][len(ports) :]
+    asyncio.run(serve(*ports))
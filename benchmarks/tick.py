@@ -0,0 +1,87 @@
+"""Benchmark of the appointment-to-patient join of the scheduler tick.
+
+Compares per-row `iterrows` + `format_phone` + directory lookup with the
+vectorized `match_appointments`.
+
+Usage: python -m benchmarks.tick [ROWS ...]
+"""
+
+from __future__ import annotations
+
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from clinic_app.backend.appointments import match_appointments
+from clinic_app.backend.directory import get_directory
+from clinic_app.backend.utils import format_phone
+
+DEFAULT_ROWS = (10_000, 100_000)
+
+
+def _phone(number: int) -> str:
+    digits = f"{9000000000 + number:010d}"
+    return f"+7({digits[:3]}){digits[3:6]}-{digits[6:8]}-{digits[8:]}"
+
+
+def make_data(rows: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Get appointments and patients dataframes, half of them matched."""
+    rnd = random.Random(rows)
+    appointments = pd.DataFrame(
+        {
+            "Телефон": [_phone(rnd.randrange(rows * 2)) for _ in range(rows)],
+            "ДатаНачала": ["2024-05-01 10:00"] * rows,
+            "ИДВрач": [rnd.randrange(50) for _ in range(rows)],
+            "ИДФилиал": [rnd.randrange(5) for _ in range(rows)],
+        }
+    )
+    patients = pd.DataFrame(
+        {
+            "phone": [format_phone(_phone(i)) for i in range(rows)],
+            "tg_user_id": range(rows),
+            "tg_username": None,
+            "wh_user_id": None,
+        }
+    )
+    return appointments, patients
+
+
+def tick_iterrows(df: pd.DataFrame, db_path: str) -> int:
+    directory = get_directory(db_path)
+    matched = 0
+    for _, row in df.iterrows():
+        phone = format_phone(row["Телефон"])
+        user_id = directory.get_value(("phone", phone), "tg_user_id")
+        if user_id is not None and not pd.isnull(user_id):
+            matched += 1
+    return matched
+
+
+def tick_vectorized(df: pd.DataFrame, db_path: str) -> int:
+    patients = get_directory(db_path).get_df()
+    return len(match_appointments(df, patients, "tg_user_id"))
+
+
+def main(sizes: tuple[int, ...]) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            appointments, patients = make_data(rows)
+            db_path = str(Path(tmp, f"db_{rows}.csv"))
+            patients.to_csv(db_path, index=False)
+            get_directory(db_path).refresh()
+
+            for name, tick in (
+                ("iterrows", tick_iterrows),
+                ("vectorized", tick_vectorized),
+            ):
+                start = time.perf_counter()
+                matched = tick(appointments, db_path)
+                elapsed = time.perf_counter() - start
+                print(f"{rows:>8} rows {name:>10}: {elapsed:8.3f}s {matched}")
+
+
+if __name__ == "__main__":
+    main(tuple(map(int, sys.argv[1:])) or DEFAULT_ROWS)
@@ -0,0 +1,240 @@
+"""Join of appointment csv files with registered patients.
+
+`Appointment` is used by handlers, so pandas and schemas of csv files
+are imported by the functions which read and join csv files.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Optional
+
+from clinic_app.backend.storage import get_database
+from clinic_app.backend.utils import (
+    PHONE_KEY,
+    appointment_key,
+    fill_phone_keys,
+    format_phones,
+    parse_start,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from clinic_app.backend.csv_files import CSVFile
+    from clinic_app.backend.sqlite import SQLiteTable
+
+START_FORMAT = "%d.%m.%Y %H:%M"
+
+
+@dataclass(frozen=True, slots=True)
+class Appointment:
+    """Row of appointment csv file matched with registered patient.
+
+    Parameters
+    ----------
+    index : int
+        Row index in the csv file.
+    user_id : int | str
+        Telegram user id or WhatsApp chat id of the patient.
+    phone : str
+        `Телефон` value as it is in the csv file.
+    start : Any
+        `ДатаНачала` value.
+    doctor_id : Any
+        `ИДВрач` value or None if file hasn't the column.
+    clinic_id : Any
+        `ИДФилиал` value or None if file hasn't the column.
+
+    """
+
+    index: int
+    user_id: int | str
+    phone: str
+    start: Any
+    doctor_id: Any = None
+    clinic_id: Any = None
+
+    @property
+    def start_text(self) -> str:
+        """`ДатаНачала` formatted for messages."""
+        start = parse_start(self.start)
+        if start is None:
+            return str(self.start)
+        return start.strftime(START_FORMAT)
+
+    @property
+    def key(self) -> Optional[tuple[str, str]]:
+        """Identity of the appointment which doesn't depend on its row."""
+        return appointment_key(self.phone, self.start)
+
+    def to_list(self) -> list[Any]:
+        """Get json serializable values to keep in FSM data."""
+        start = self.start
+        if isinstance(start, datetime):
+            start = start.isoformat()
+        elif start is not None and not isinstance(start, str):
+            import pandas as pd
+
+            if pd.isna(start):
+                start = None
+        return [
+            self.index,
+            self.user_id,
+            self.phone,
+            start,
+            self.doctor_id,
+            self.clinic_id,
+        ]
+
+    @classmethod
+    def from_list(cls, values: list[Any]) -> Appointment:
+        """Create appointment from values of `to_list`."""
+        return cls(*values)
+
+
+def _user_id(value: Any) -> int | str:
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _column(df: pd.DataFrame, name: str) -> list[Any]:
+    if name not in df.columns:
+        return [None] * len(df)
+    return df[name].tolist()
+
+
+def match_appointments(
+    df: pd.DataFrame, patients: pd.DataFrame, user_column: str
+) -> list[Appointment]:
+    """Join appointments with patients by normalized phone.
+
+    `PHONE_KEY` columns are used when dataframes have them. Rows of
+    patients without `user_column` are dropped before join, so only
+    appointments which can be notified are returned.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe of appointment csv file.
+    patients : pd.DataFrame
+        dataframe of database csv file.
+    user_column : str
+        `tg_user_id` or `wh_user_id`.
+
+    Returns
+    -------
+    list[Appointment]
+        matched appointments in order of the csv file.
+    """
+    import pandas as pd
+
+    if df.empty or patients.empty or user_column not in patients.columns:
+        return []
+
+    if PHONE_KEY in df.columns:
+        phones = df[PHONE_KEY]
+    else:
+        phones = format_phones(df["Телефон"])
+
+    if PHONE_KEY in patients.columns:
+        patient_phones = patients[PHONE_KEY]
+    else:
+        patient_phones = format_phones(patients["phone"])
+
+    registered = (
+        pd.DataFrame(
+            {PHONE_KEY: patient_phones, user_column: patients[user_column]}
+        )
+        .dropna()
+        .drop_duplicates(PHONE_KEY)
+    )
+    keys = pd.DataFrame(
+        {PHONE_KEY: phones.to_numpy(), "position": range(len(df))}
+    ).dropna(subset=[PHONE_KEY])
+
+    matched = keys.merge(registered, on=PHONE_KEY, how="inner")
+    if matched.empty:
+        return []
+
+    matched = matched.sort_values("position")
+    rows = df.iloc[matched["position"].to_numpy()]
+
+    return [
+        Appointment(
+            index=index,
+            user_id=_user_id(user_id),
+            phone=phone,
+            start=start,
+            doctor_id=doctor_id,
+            clinic_id=clinic_id,
+        )
+        for index, user_id, phone, start, doctor_id, clinic_id in zip(
+            rows.index.tolist(),
+            matched[user_column].tolist(),
+            _column(rows, "Телефон"),
+            _column(rows, "ДатаНачала"),
+            _column(rows, "ИДВрач"),
+            _column(rows, "ИДФилиал"),
+        )
+    ]
+
+
+def load_appointments_by_column(
+    csv: CSVFile | SQLiteTable, user_columns: list[str]
+) -> dict[str, list[Appointment]]:
+    """Read appointment csv file once and join it for every channel.
+
+    Parameters
+    ----------
+    csv : CSVFile | SQLiteTable
+        appointment csv file.
+    user_columns : list[str]
+        `tg_user_id` and/or `wh_user_id`.
+
+    Returns
+    -------
+    dict[str, list[Appointment]]
+        user column to appointments of patients registered in it.
+    """
+    from clinic_app.backend.schema import get_schema
+
+    patients = get_database().get_patients()
+    matched: dict[str, list[Appointment]] = {
+        column: [] for column in user_columns
+    }
+
+    schema = get_schema(csv.path)
+    if schema is not None and schema.chunksize:
+        for chunk in csv.iter_chunks():
+            # Keys of streamed chunks aren't persisted, it needs a rewrite
+            fill_phone_keys(chunk, "Телефон")
+            for column in user_columns:
+                matched[column] += match_appointments(chunk, patients, column)
+        return matched
+
+    df = csv.ensure_phone_key("Телефон", csv.read())
+    for column in user_columns:
+        matched[column] = match_appointments(df, patients, column)
+    return matched
+
+
+def load_appointments(
+    csv: CSVFile | SQLiteTable, user_column: str
+) -> list[Appointment]:
+    """Read appointment csv file and join it with registered patients.
+
+    Parameters
+    ----------
+    csv : CSVFile | SQLiteTable
+        appointment csv file.
+    user_column : str
+        `tg_user_id` or `wh_user_id`.
+
+    Returns
+    -------
+    list[Appointment]
+        appointments of patients registered in the channel.
+    """
+    return load_appointments_by_column(csv, [user_column])[user_column]
@@ -0,0 +1,109 @@
+"""Columnar sidecar cache of csv files.
+
+Typed dataframe of a csv file is saved to `<path>.arrow` (Arrow IPC
+file) with signature of the source csv file and of its schema in its
+metadata. Readers memory-map the cache and the csv file is parsed again
+only when it or its schema in config.yml changes. Columns of dates and
+numbers without nulls, and strings stored by pyarrow (the `string` dtype
+of pandas 3) stay views of the mapped pages, which processes of both
+bots share through the OS page cache. Nullable integers and category
+codes are copied to each process, and so are strings stored as python
+objects.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import pandas as pd
+import pyarrow as pa
+from clinic_app.shared.config import get_config
+
+if TYPE_CHECKING:
+    from clinic_app.backend.schema import CSVSchema
+
+SIGNATURE_KEY = b"clinic_app.source"
+
+
+def cache_path(path: str) -> str:
+    """Get path of the cache of csv file."""
+    return f"{path}.arrow"
+
+
+def cache_enabled() -> bool:
+    """Return True if columnar cache is enabled in config."""
+    cfg = get_config()["database"].get("csv") or {}
+    return bool(cfg.get("columnar_cache", False))
+
+
+def _signature(path: str, schema: CSVSchema) -> bytes:
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}:{schema.fingerprint}".encode()
+
+
+def _load(path: str, signature: bytes) -> Optional[pd.DataFrame]:
+    try:
+        with pa.memory_map(cache_path(path)) as source:
+            reader = pa.ipc.open_file(source)
+            metadata = reader.schema.metadata or {}
+            if metadata.get(SIGNATURE_KEY) != signature:
+                return None
+            # Columns aren't consolidated into 2D blocks, which copies them
+            return reader.read_all().to_pandas(
+                split_blocks=True, self_destruct=False
+            )
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+
+def _save(path: str, df: pd.DataFrame, signature: bytes) -> None:
+    table = pa.Table.from_pandas(df)
+    metadata = {**(table.schema.metadata or {}), SIGNATURE_KEY: signature}
+    table = table.replace_schema_metadata(metadata)
+
+    target = Path(cache_path(path))
+    fd, tmp = tempfile.mkstemp(
+        dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, target)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def read_cached(path: str, schema: CSVSchema) -> pd.DataFrame:
+    """Read dataframe from cache or by schema and cache it.
+
+    Parameters
+    ----------
+    path : str
+        Path to source csv file.
+    schema : CSVSchema
+        declared schema of the csv file.
+
+    Returns
+    -------
+    pd.DataFrame
+        dataframe of the current version of the csv file.
+    """
+    # Signature is taken before read, so a change of the file during
+    # read makes the saved cache stale instead of wrong
+    signature = _signature(path, schema)
+    df = _load(path, signature)
+    if df is not None:
+        return df
+
+    df = schema.read(path)
+    try:
+        _save(path, df, signature)
+    except (OSError, pa.ArrowException):
+        # Cache is an optimization, e.g. directory may be read only
+        pass
+    return df
@@ -2,12 +2,47 @@
 
 from __future__ import annotations
 
+import os
+import random
+import time
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Iterator, Optional
 
 import pandas as pd
+from clinic_app.backend.columnar import cache_enabled, read_cached
+from clinic_app.backend.directory import (
+    INDEXED_COLUMNS,
+    PatientDirectory,
+    get_directory,
+)
+from clinic_app.backend.locks import (
+    StaleVersionError,
+    bump_version,
+    file_lock,
+    read_version,
+    save_csv,
+    write_csv_atomic,
+)
+from clinic_app.backend.metrics import (
+    CSV_READ_BYTES,
+    CSV_READ_SECONDS,
+    DB_LOOKUP_SECONDS,
+    DB_LOOKUPS,
+)
+from clinic_app.backend.schema import CSVSchema, get_schema
+from clinic_app.backend.utils import (
+    PHONE_KEY,
+    appointment_keys,
+    fill_phone_keys,
+    format_phone,
+)
+from clinic_app.backend.write_behind import WriteBehindEngine, get_engine
 from clinic_app.shared import CSVS
 from clinic_app.shared.config import get_config
+from loguru import logger
+
+MODIFY_RETRIES = 5
+MODIFY_BACKOFF = 0.05
 
 
 class CSVFile:
@@ -28,11 +63,68 @@ class CSVFile:
 
         self.path = path
 
+    @property
+    def write_behind(self) -> WriteBehindEngine:
+        """Write-behind engine of the csv file."""
+        return get_engine(self.path)
+
+    def version(self) -> int:
+        """Get count of writes to the csv file."""
+        return read_version(self.path)
+
+    def modify(
+        self,
+        func: Callable[[pd.DataFrame], None],
+        retries: int = MODIFY_RETRIES,
+    ) -> pd.DataFrame:
+        """Read dataframe, modify it in place by `func` and save it.
+
+        If the file was written by another process or thread between
+        read and write, the cycle is retried on fresh data. The last
+        attempt holds the file lock for the whole cycle.
+
+        Parameters
+        ----------
+        func : Callable[[pd.DataFrame], None]
+            function which modifies dataframe in place.
+        retries : int, optional
+            max count of attempts, by default `MODIFY_RETRIES`.
+
+        Returns
+        -------
+        pd.DataFrame
+            Saved dataframe.
+        """
+        for attempt in range(retries - 1):
+            if attempt:
+                time.sleep(random.uniform(0, MODIFY_BACKOFF * attempt))
+
+            version = self.version()
+            df = self.get_df()
+            func(df)
+            try:
+                save_csv(df, self.path, expected_version=version)
+            except StaleVersionError:
+                continue
+            return df
+
+        # A new engine replays its journal under the file lock, so it's
+        # created before the lock is held, flock would block on it
+        get_engine(self.path)
+        with file_lock(self.path):
+            df = self.get_df()
+            func(df)
+            write_csv_atomic(df, self.path)
+            bump_version(self.path)
+        return df
+
     def create_column(self, column_name: str) -> None:
         """Create column with empty rows in csv file."""
-        df = self.get_df()
-        df[column_name] = [None] * len(df)
-        df.to_csv(self.path, index=False)
+
+        def create(df: pd.DataFrame) -> None:
+            df[column_name] = [None] * len(df)
+
+        self.modify(create)
 
     def get_df(self) -> pd.DataFrame:
         """Get `pd.DataFrame` from csv.
@@ -40,9 +132,108 @@ class CSVFile:
         Returns
         -------
         pd.DataFrame
-            dataframe.
+            dataframe with pending cell updates applied.
+        """
+        name = os.path.basename(self.path)
+        with CSV_READ_SECONDS.time(file=name, method="get_df"):
+            df = pd.read_csv(self.path)
+        size = os.path.getsize(self.path)
+        CSV_READ_BYTES.inc(size, file=name, method="get_df")
+        return self.write_behind.apply(df)
+
+    @property
+    def schema(self) -> Optional[CSVSchema]:
+        """Declared schema of the csv file, None if it isn't declared."""
+        return get_schema(self.path)
+
+    def read(self) -> pd.DataFrame:
+        """Get dataframe of declared columns for lookups.
+
+        Don't save it, only `get_df` returns all columns as they are.
+
+        Returns
+        -------
+        pd.DataFrame
+            typed dataframe with pending cell updates applied.
+        """
+        schema = self.schema
+        if schema is None:
+            return self.get_df()
+        name = os.path.basename(self.path)
+        with CSV_READ_SECONDS.time(file=name, method="read"):
+            if cache_enabled():
+                df = read_cached(self.path, schema)
+            else:
+                df = schema.read(self.path)
+        size = os.path.getsize(self.path)
+        CSV_READ_BYTES.inc(size, file=name, method="read")
+        return self.write_behind.apply(df)
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """Stream declared columns by chunks of the schema.
+
+        Yields
+        ------
+        pd.DataFrame
+            typed chunk with pending cell updates applied.
+        """
+        schema = self.schema
+        if schema is None:
+            yield self.get_df()
+            return
+        for chunk in schema.iter_chunks(self.path):
+            yield self.write_behind.apply(chunk)
+
+    def update_cells(
+        self,
+        index: int,
+        values: dict[str, Any],
+        key: Optional[tuple[str, str]] = None,
+    ) -> None:
+        """Update cells of one row through the write-behind engine.
+
+        Parameters
+        ----------
+        index : int
+            Row index in the csv file.
+        values : dict[str, Any]
+            Column name to new value mapping.
+        key : Optional[tuple[str, str]], optional
+            `appointment_key` of the row, the row is found by it if the
+            file was exported again since it was read, by default None.
+        """
+        self.write_behind.update(index, values, key)
+
+    def flush(self) -> None:
+        """Write pending cell updates to the csv file."""
+        self.write_behind.flush()
+
+    def ensure_phone_key(
+        self, phone_column: str, df: Optional[pd.DataFrame] = None
+    ) -> pd.DataFrame:
+        """Persist normalized phone column `PHONE_KEY` of the csv file.
+
+        Keys are computed once for new rows, lookups compare them instead
+        of formatting phones again.
+
+        Parameters
+        ----------
+        phone_column : str
+            column with source phones.
+        df : Optional[pd.DataFrame], optional
+            already read dataframe of the file, by default None.
+
+        Returns
+        -------
+        pd.DataFrame
+            dataframe with `PHONE_KEY` column.
         """
-        return pd.read_csv(self.path)
+        if df is None:
+            df = self.get_df()
+
+        if fill_phone_keys(df, phone_column):
+            self.modify(lambda df: fill_phone_keys(df, phone_column))
+        return df
 
     def value_exists(self, value: Any, column_name: str) -> bool:
         """Return True if value exists, otherwise False.
@@ -84,34 +275,102 @@ class CSVFile:
         new_value : str
             New value.
         save : bool, optional
-            If True it DataFrame will saved to .csv, by default False.
+            If True the update will be saved to .csv through the
+            write-behind engine, by default False.
 
         Returns
         -------
         pd.DataFrame
-            Updated DataFrame.
+            Updated DataFrame, not changed if the value isn't found.
         """
-        df = self.get_df()
-        # Get a row index
-        index = df.loc[df[search_value_column_name] == search_value].index[0]
-        df.at[index, new_value_column_name] = new_value
+        df = self.read()
+        found = df.loc[df[search_value_column_name] == search_value].index
+        if found.empty:
+            logger.warning(
+                f"{search_value_column_name} {search_value!r} isn't found "
+                f"in {self.path}"
+            )
+            return df
+
+        index = found[0]
         if save:
-            df.to_csv(self.path, index=False)
+            key = appointment_keys(df.loc[[index]]).iloc[0]
+            self.update_cells(index, {new_value_column_name: new_value}, key)
+            return self.write_behind.apply(df)
+
+        df.at[index, new_value_column_name] = new_value
         return df
 
 
 class Database(CSVFile):
+    """Interface to interact with database csv file.
+
+    Lookups by indexed columns (see `INDEXED_COLUMNS`) are served by the
+    process-wide `PatientDirectory` and don't read the file.
+
+    Parameters
+    ----------
+    path : Optional[str], optional
+        Path to database csv file, by default `CSVS["db"]`.
+
+    """
+
     def __init__(self, path: Optional[str] = None) -> None:
         if not path:
             path = CSVS["db"]
         if not Path(path).exists():
             cfg = get_config()
             df = pd.DataFrame(columns=cfg["database"]["csv"]["columns"])
-            df.to_csv(path, index=False)
+            with file_lock(path):
+                if not Path(path).exists():
+                    write_csv_atomic(df, path)
 
         super().__init__(path=path)
 
+    @property
+    def directory(self) -> PatientDirectory:
+        """Index of the database file."""
+        return get_directory(self.path)
+
+    def get_patients(self) -> pd.DataFrame:
+        """Get cached dataframe of all patients, don't modify it."""
+        return self.directory.get_df()
+
+    @staticmethod
+    def _lookup_kv(column: str, value: Any) -> tuple[str, Any]:
+        """Replace phone lookup by lookup of normalized phone key."""
+        if column == "phone":
+            key = format_phone(value)
+            if key is not None:
+                return PHONE_KEY, key
+        return column, value
+
+    def value_exists(self, value: Any, column_name: str) -> bool:
+        with DB_LOOKUP_SECONDS.time(column=column_name):
+            if column_name in INDEXED_COLUMNS:
+                kv = self._lookup_kv(column_name, value)
+                exists = self.directory.exists(*kv)
+            else:
+                exists = super().value_exists(value, column_name)
+
+        result = "hit" if exists else "miss"
+        DB_LOOKUPS.inc(column=column_name, result=result)
+        return exists
+
     def get_value_by_kv(self, kv: tuple[str, Any], column: str) -> Any | None:
+        with DB_LOOKUP_SECONDS.time(column=kv[0]):
+            value = self._get_value_by_kv(kv, column)
+
+        result = "miss" if value is None or pd.isnull(value) else "hit"
+        DB_LOOKUPS.inc(column=kv[0], result=result)
+        return value
+
+    def _get_value_by_kv(
+        self, kv: tuple[str, Any], column: str
+    ) -> Any | None:
+        if kv[0] in INDEXED_COLUMNS:
+            return self.directory.get_value(self._lookup_kv(*kv), column)
+
         df = self.get_df()
         filtered = df.loc[df[kv[0]] == kv[1], column]
 
@@ -119,3 +378,38 @@ class Database(CSVFile):
             return None
 
         return filtered.iloc[0]
+
+    def add_row(self, row: dict[str, Any]) -> bool:
+        """Append row of a patient unless the phone is registered.
+
+        The phone is checked and the row is appended under the file lock,
+        so concurrent registrations in other processes don't duplicate it.
+
+        Parameters
+        ----------
+        row : dict[str, Any]
+            column name to value mapping, missing columns stay empty.
+
+        Returns
+        -------
+        bool
+            True if row is added, False if the phone is registered.
+        """
+        key = None
+        if row.get("phone") is not None:
+            key = format_phone(row["phone"])
+            row = {**row, PHONE_KEY: key}
+
+        # See `modify`, the engine isn't created under the lock
+        get_engine(self.path)
+        with file_lock(self.path):
+            df = self.get_df()
+            fill_phone_keys(df, "phone")
+            if key is not None and (df[PHONE_KEY] == key).any():
+                return False
+            df.loc[len(df)] = row
+            write_csv_atomic(df, self.path)
+            bump_version(self.path)
+
+        self.directory.invalidate()
+        return True
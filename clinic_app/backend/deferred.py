@@ -0,0 +1,263 @@
+"""Persistent service for deferred messages.
+
+Pending jobs are rows of a SQLite table with channel, chat id and
+template id only, and an in-memory heap ordered by run time. One asyncio
+task per process sleeps until the nearest job, so a pending job costs a
+row and a heap entry instead of a scheduler per user. Jobs which weren't
+sent before a restart are loaded from the table by `start`. A job is
+deleted once it's sent, failed sends are retried with exponential
+backoff up to `max_attempts` times.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+DEFAULT_DEFERRED_PATH = "src_csvs/deferred.sqlite3"
+DEFAULT_MAX_ATTEMPTS = 5
+# Seconds before the first retry, doubled by every next one
+DEFAULT_RETRY_DELAY = 30
+
+TEMPLATES = {
+    "rescheduling_phone": (
+        "Если у вас не получилось записаться онлайн вы можете "
+        "записаться по номеру телефона: 123456"
+    ),
+    "review_thanks": "Спасибо вам большое за отзыв!",
+}
+
+Sender = Callable[[str, str], Awaitable[Any]]
+
+_service: Optional[DeferredSender] = None
+_service_lock = threading.Lock()
+
+
+class DeferredSender:
+    """Send template messages to chats after a delay.
+
+    Every bot registers a sender of its channel, only jobs of registered
+    channels are loaded and sent by the process, so both bots can share
+    one job store.
+
+    Parameters
+    ----------
+    path : str
+        Path to SQLite database of pending jobs.
+    max_attempts : int, optional
+        Sends of a job before it's dropped, by default
+        `DEFAULT_MAX_ATTEMPTS`.
+    retry_delay : float, optional
+        Seconds before the first retry, by default `DEFAULT_RETRY_DELAY`.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+    ) -> None:
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.senders: dict[str, Sender] = {}
+        self._heap: list[tuple[float, int, str, str, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set[asyncio.Task] = set()
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "run_at REAL NOT NULL, channel TEXT NOT NULL, "
+            "chat_id TEXT NOT NULL, template TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = [
+            row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")
+        ]
+        if "attempts" not in columns:
+            self._conn.execute(
+                "ALTER TABLE jobs "
+                "ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+            )
+
+    def register(self, channel: str, sender: Sender) -> None:
+        """Register coroutine function sending text to chat of channel."""
+        self.senders[channel] = sender
+
+    def schedule(
+        self, channel: str, chat_id: Any, template: str, delay: float
+    ) -> int:
+        """Save job and send template to chat after `delay` seconds.
+
+        Parameters
+        ----------
+        channel : str
+            `telegram` or `whatsapp`.
+        chat_id : Any
+            chat id of recipient.
+        template : str
+            key of the message in `TEMPLATES`.
+        delay : float
+            delay in seconds.
+
+        Returns
+        -------
+        int
+            id of the job.
+        """
+        if template not in TEMPLATES:
+            raise KeyError(f"Unknown template: {template}")
+
+        run_at = time.time() + delay
+        cursor = self._conn.execute(
+            "INSERT INTO jobs (run_at, channel, chat_id, template) "
+            "VALUES (?, ?, ?, ?)",
+            (run_at, channel, str(chat_id), template),
+        )
+        job_id = cursor.lastrowid
+        # Jobs of other channels are sent by the process owning them
+        if channel in self.senders:
+            self._push(run_at, job_id, channel, str(chat_id), template)
+        return job_id
+
+    def _push(
+        self,
+        run_at: float,
+        job_id: int,
+        channel: str,
+        chat_id: str,
+        template: str,
+    ) -> None:
+        job = (run_at, job_id, channel, chat_id, template)
+        heapq.heappush(self._heap, job)
+        if self._wakeup is not None and self._heap[0][1] == job_id:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        """Get count of jobs waiting in this process."""
+        return len(self._heap)
+
+    def start(self, owns: Optional[Callable[[str], bool]] = None) -> None:
+        """Load pending jobs of registered channels and start sending.
+
+        Parameters
+        ----------
+        owns : Optional[Callable[[str], bool]], optional
+            Check of chat id whether its jobs are sent by this process,
+            e.g. by a worker of the supervisor, by default all of them.
+        """
+        if self._task is not None and not self._task.done():
+            return
+
+        channels = list(self.senders)
+        if channels:
+            placeholders = ", ".join("?" * len(channels))
+            rows = self._conn.execute(
+                "SELECT run_at, id, channel, chat_id, template FROM jobs "
+                f"WHERE channel IN ({placeholders})",
+                channels,
+            ).fetchall()
+            loaded = {job[1] for job in self._heap}
+            self._heap += [
+                row
+                for row in rows
+                if row[1] not in loaded and (owns is None or owns(row[3]))
+            ]
+            heapq.heapify(self._heap)
+
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop sending, pending jobs stay in the store."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            timeout = self._heap[0][0] - time.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, job_id, channel, chat_id, template = heapq.heappop(self._heap)
+            task = asyncio.create_task(
+                self._send(job_id, channel, chat_id, template)
+            )
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(
+        self, job_id: int, channel: str, chat_id: str, template: str
+    ) -> None:
+        try:
+            await self.senders[channel](chat_id, TEMPLATES[template])
+        except Exception as e:
+            logger.opt(exception=e).error(
+                f"Deferred message {template} to {chat_id} wasn't sent"
+            )
+            self._retry(job_id, channel, chat_id, template)
+            return
+        self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _retry(
+        self, job_id: int, channel: str, chat_id: str, template: str
+    ) -> None:
+        row = self._conn.execute(
+            "SELECT attempts FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        if attempts >= self.max_attempts:
+            logger.error(
+                f"Deferred message {template} to {chat_id} is dropped "
+                f"after {attempts} attempts"
+            )
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return
+
+        run_at = time.time() + self.retry_delay * 2 ** (attempts - 1)
+        self._conn.execute(
+            "UPDATE jobs SET attempts = ?, run_at = ? WHERE id = ?",
+            (attempts, run_at, job_id),
+        )
+        self._push(run_at, job_id, channel, chat_id, template)
+
+
+def get_deferred() -> DeferredSender:
+    """Get process-wide service for deferred messages."""
+    global _service
+
+    with _service_lock:
+        if _service is None:
+            cfg = get_config().get("deferred") or {}
+            _service = DeferredSender(
+                cfg.get("path", DEFAULT_DEFERRED_PATH),
+                max_attempts=cfg.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+                retry_delay=cfg.get("retry_delay", DEFAULT_RETRY_DELAY),
+            )
+    return _service
@@ -0,0 +1,151 @@
+"""Process-wide in-memory index of registered patients."""
+
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Final, Optional
+
+import pandas as pd
+from clinic_app.backend.utils import PHONE_KEY, fill_phone_keys
+
+INDEXED_COLUMNS: Final = ("phone", PHONE_KEY, "tg_user_id", "wh_user_id")
+
+_directories: dict[str, PatientDirectory] = {}
+_directories_lock = threading.Lock()
+
+
+def index_key(value: Any) -> Optional[str]:
+    """Return hashable key for value stored in indexed column.
+
+    Telegram ids are read from csv as floats when the column has empty
+    cells, so `123.0` and `123` must produce the same key.
+
+    Parameters
+    ----------
+    value : Any
+        cell value or value to lookup.
+
+    Returns
+    -------
+    Optional[str]
+        key or None if value is empty.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class PatientDirectory:
+    """Hash index over the patients database csv file.
+
+    The file is parsed only when its mtime or size changes, every lookup
+    after that is a dict access.
+
+    Parameters
+    ----------
+    path : str
+        Path to database csv file.
+
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature: Optional[tuple[int, int]] = None
+        self._df = pd.DataFrame()
+        self._rows: list[dict[str, Any]] = []
+        self._index: dict[str, dict[str, int]] = {}
+
+    def _stat(self) -> tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self) -> None:
+        """Reload index if database file was changed."""
+        signature = self._stat()
+        if signature == self._signature:
+            return
+
+        with self._lock:
+            if signature == self._signature:
+                return
+
+            df = pd.read_csv(self.path)
+            if "phone" in df.columns:
+                # Rows written before the key column existed
+                fill_phone_keys(df, "phone")
+            rows = df.to_dict("records")
+            index = {col: {} for col in INDEXED_COLUMNS if col in df.columns}
+            for column, mapping in index.items():
+                for position, value in enumerate(df[column].tolist()):
+                    key = index_key(value)
+                    if key is not None:
+                        mapping.setdefault(key, position)
+
+            self._df, self._rows, self._index = df, rows, index
+            self._signature = signature
+
+    def get_df(self) -> pd.DataFrame:
+        """Get cached dataframe of the database file.
+
+        The dataframe is shared, don't modify it.
+        """
+        self.refresh()
+        return self._df
+
+    def invalidate(self) -> None:
+        """Force reload on next lookup."""
+        self._signature = None
+
+    def get_row(self, column: str, value: Any) -> Optional[dict[str, Any]]:
+        """Get first row where `column` equals `value`.
+
+        Parameters
+        ----------
+        column : str
+            indexed column name.
+        value : Any
+            value to find.
+
+        Returns
+        -------
+        Optional[dict[str, Any]]
+            row as dict or None if not found.
+        """
+        if column not in INDEXED_COLUMNS:
+            raise KeyError(column)
+
+        self.refresh()
+        position = self._index.get(column, {}).get(index_key(value))
+        if position is None:
+            return None
+        return self._rows[position]
+
+    def exists(self, column: str, value: Any) -> bool:
+        """Return True if value exists in indexed column."""
+        return self.get_row(column, value) is not None
+
+    def get_value(self, kv: tuple[str, Any], column: str) -> Any | None:
+        """Get value of `column` from row found by key-value pair."""
+        row = self.get_row(*kv)
+        if row is None:
+            return None
+        return row.get(column)
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self._rows)
+
+
+def get_directory(path: str) -> PatientDirectory:
+    """Get process-wide directory for database csv file."""
+    key = str(Path(path).resolve())
+    with _directories_lock:
+        directory = _directories.get(key)
+        if directory is None:
+            directory = _directories[key] = PatientDirectory(path)
+    return directory
@@ -0,0 +1,270 @@
+"""Durable ledger of notifications which were already sent.
+
+Every line of the ledger file is `<expiration date> <key hash>`, the
+file is append-only and compacted when entries expire. A notification is
+claimed before it's sent, so concurrent senders don't send it twice, and
+a claim of a failed send is released by `-<key hash>` line.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Iterator,
+    Optional,
+)
+
+from clinic_app.backend.locks import file_lock, write_atomic
+from clinic_app.backend.utils import parse_start
+from clinic_app.shared.config import get_config
+from zoneinfo import ZoneInfo
+
+if TYPE_CHECKING:
+    from clinic_app.backend.appointments import Appointment
+
+DEFAULT_LEDGER_PATH = "src_csvs/sent.ledger"
+DEFAULT_KEEP_DAYS = 3
+
+_ledger: Optional[SentLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def _today() -> date:
+    return datetime.now().astimezone(ZoneInfo("Europe/Moscow")).date()
+
+
+def appointment_date(start: Any) -> Optional[date]:
+    """Parse date of appointment from `ДатаНачала` value."""
+    dt = parse_start(start)
+    if dt is None:
+        return None
+    return dt.date()
+
+
+class SentLedger:
+    """Set of sent notifications persisted to append-only file.
+
+    Notification is identified by channel, file kind, appointment (phone
+    and start date, see `Appointment.key`) and recipient. Entries expire
+    `keep_days` after the appointment date.
+
+    Parameters
+    ----------
+    path : str
+        Path to ledger file.
+    keep_days : int, optional
+        Days to keep entry after appointment date,
+        by default `DEFAULT_KEEP_DAYS`.
+
+    """
+
+    def __init__(self, path: str, keep_days: int = DEFAULT_KEEP_DAYS) -> None:
+        self.path = path
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._entries: dict[str, date] = {}
+
+        self.load()
+
+    @staticmethod
+    def make_key(
+        channel: str, kind: str, appointment: tuple[Any, Any], recipient: Any
+    ) -> str:
+        """Get compact hash of notification identity."""
+        phone, start = appointment
+        raw = f"{channel}\x1f{kind}\x1f{phone}\x1f{start}\x1f{recipient}"
+        return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+    def was_sent(
+        self,
+        channel: str,
+        kind: str,
+        appointment: tuple[Any, Any],
+        recipient: Any,
+    ) -> bool:
+        """Return True if notification was already sent."""
+        key = self.make_key(channel, kind, appointment, recipient)
+        return key in self._entries
+
+    def try_mark(
+        self,
+        channel: str,
+        kind: str,
+        appointment: tuple[Any, Any],
+        recipient: Any,
+    ) -> bool:
+        """Record notification unless it's already recorded.
+
+        Parameters
+        ----------
+        channel : str
+            `telegram` or `whatsapp`.
+        kind : str
+            key of the csv file in `CSVS`.
+        appointment : tuple[Any, Any]
+            phone and start date of appointment.
+        recipient : Any
+            chat id of recipient.
+
+        Returns
+        -------
+        bool
+            True if it's recorded by this call, False if it was sent or
+            claimed by another sender.
+        """
+        key = self.make_key(channel, kind, appointment, recipient)
+        appointment_day = appointment_date(appointment[1]) or _today()
+        expires = appointment_day + timedelta(days=self.keep_days)
+
+        with self._lock:
+            if key in self._entries:
+                return False
+            self._entries[key] = expires
+            self._append(f"{expires.isoformat()} {key}")
+        return True
+
+    def mark_sent(
+        self,
+        channel: str,
+        kind: str,
+        appointment: tuple[Any, Any],
+        recipient: Any,
+    ) -> None:
+        """Record that notification was sent, see `try_mark`."""
+        self.try_mark(channel, kind, appointment, recipient)
+
+    def release(
+        self,
+        channel: str,
+        kind: str,
+        appointment: tuple[Any, Any],
+        recipient: Any,
+    ) -> None:
+        """Forget notification claimed by `try_mark` which wasn't sent."""
+        key = self.make_key(channel, kind, appointment, recipient)
+        with self._lock:
+            expires = self._entries.pop(key, None)
+            if expires is not None:
+                self._append(f"{expires.isoformat()} -{key}")
+
+    @contextmanager
+    def claim(
+        self,
+        channel: str,
+        kind: str,
+        appointment: tuple[Any, Any],
+        recipient: Any,
+    ) -> Iterator[bool]:
+        """Claim notification while it's sent.
+
+        Yields True if it's claimed by `try_mark`, the claim is released
+        if the block raises, e.g. when the message isn't sent.
+        """
+        claimed = self.try_mark(channel, kind, appointment, recipient)
+        try:
+            yield claimed
+        except BaseException:
+            if claimed:
+                self.release(channel, kind, appointment, recipient)
+            raise
+
+    def _append(self, line: str) -> None:
+        # A claim lost by a crash after the send would send it again
+        with file_lock(self.path), open(self.path, "a") as f:
+            f.write(f"{line}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> None:
+        """Read ledger file, compact it if entries expired or were released."""
+        if not Path(self.path).exists():
+            return
+
+        today = _today()
+        entries, dropped = {}, 0
+        with self._lock, file_lock(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        expires, key = line.split()
+                        expires = date.fromisoformat(expires)
+                    except ValueError:
+                        continue
+                    if key.startswith("-"):
+                        entries.pop(key[1:], None)
+                        dropped += 1
+                    elif expires < today:
+                        dropped += 1
+                    else:
+                        entries[key] = expires
+
+            if dropped:
+                content = "".join(
+                    f"{expires.isoformat()} {key}\n"
+                    for key, expires in entries.items()
+                )
+                write_atomic(self.path, content)
+
+            self._entries = entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+async def send_once(
+    channel: str,
+    kind: str,
+    appointment: Appointment,
+    send: Callable[[], Awaitable[Any]],
+) -> bool:
+    """Send notification of appointment unless it was already sent.
+
+    The notification is claimed in the process-wide ledger by identity
+    of the appointment, so it doesn't depend on format of the phone and
+    of the start in the csv file.
+
+    Parameters
+    ----------
+    channel : str
+        `telegram` or `whatsapp`.
+    kind : str
+        key of the csv file in `CSVS`.
+    appointment : Appointment
+        appointment of the notification.
+    send : Callable[[], Awaitable[Any]]
+        function sending the message, the claim is released if it raises.
+
+    Returns
+    -------
+    bool
+        True if the notification is sent by this call.
+    """
+    key = appointment.key or (appointment.phone, appointment.start)
+    ledger = get_ledger()
+    with ledger.claim(channel, kind, key, appointment.user_id) as claimed:
+        if claimed:
+            await send()
+    return claimed
+
+
+def get_ledger() -> SentLedger:
+    """Get process-wide ledger of sent notifications."""
+    global _ledger
+
+    with _ledger_lock:
+        if _ledger is None:
+            cfg = get_config().get("ledger") or {}
+            _ledger = SentLedger(
+                path=cfg.get("path", DEFAULT_LEDGER_PATH),
+                keep_days=cfg.get("keep_days", DEFAULT_KEEP_DAYS),
+            )
+    return _ledger
@@ -0,0 +1,145 @@
+"""Locks and atomic writes for csv files shared between processes.
+
+Writers take an advisory `flock` on `<file>.lock`, write the new content
+to a temporary file in the same directory and rename it over the source,
+so readers never see a half-written file. Every write increments the
+counter in `<file>.version` to detect stale read-modify-write cycles.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from clinic_app.backend.metrics import CSV_WRITE_BYTES, CSV_WRITE_SECONDS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Temporary files of atomic writes are `.<name>.<random>.tmp`
+TEMP_SUFFIX = ".tmp"
+
+
+class StaleVersionError(Exception):
+    """Csv file was changed since it was read."""
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False) -> Iterator[None]:
+    """Hold advisory lock of csv file.
+
+    Parameters
+    ----------
+    path : str
+        Path to csv file.
+    shared : bool, optional
+        Take shared lock instead of exclusive, by default False.
+    """
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def read_version(path: str) -> int:
+    """Get write counter of csv file."""
+    try:
+        with open(f"{path}.version") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_version(path: str) -> int:
+    """Increment write counter of csv file, call it under `file_lock`."""
+    version = read_version(path) + 1
+    write_atomic(f"{path}.version", str(version))
+    return version
+
+
+def write_atomic(path: str, content: str) -> None:
+    """Write text to temporary file and rename it over `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory,
+        prefix=f".{os.path.basename(path)}.",
+        suffix=TEMP_SUFFIX,
+    )
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def is_atomic_temp(name: str, target: str) -> bool:
+    """Return True if file `name` is a temporary file of `write_atomic`.
+
+    Parameters
+    ----------
+    name : str
+        name of the file.
+    target : str
+        name of the file written by `write_atomic`.
+    """
+    return name.startswith(f".{target}.") and name.endswith(TEMP_SUFFIX)
+
+
+def write_csv_atomic(df: pd.DataFrame, path: str) -> None:
+    """Write dataframe to csv file, call it under `file_lock`."""
+    name = os.path.basename(path)
+    with CSV_WRITE_SECONDS.time(file=name):
+        content = df.to_csv(index=False)
+        write_atomic(path, content)
+    CSV_WRITE_BYTES.inc(len(content.encode()), file=name)
+
+
+def save_csv(
+    df: pd.DataFrame, path: str, expected_version: Optional[int] = None
+) -> int:
+    """Lock csv file, write dataframe to it and increment its version.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe to save.
+    path : str
+        Path to csv file.
+    expected_version : Optional[int], optional
+        Version of the file when `df` was read, by default None.
+
+    Returns
+    -------
+    int
+        New version of the file.
+
+    Raises
+    ------
+    StaleVersionError
+        If file was written by somebody else after `expected_version`.
+    """
+    with file_lock(path):
+        if (
+            expected_version is not None
+            and read_version(path) != expected_version
+        ):
+            raise StaleVersionError(path)
+
+        write_csv_atomic(df, path)
+        return bump_version(path)
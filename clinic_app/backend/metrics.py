@@ -0,0 +1,417 @@
+"""Process-wide metrics exposed in Prometheus text format.
+
+Counters, gauges and histograms have fixed label names, values are kept
+per label values. Every bot process serves `REGISTRY` on `/metrics` of a
+local HTTP endpoint configured by `metrics` section of config.yml,
+aiohttp is imported only when the endpoint is started.
+"""
+
+from __future__ import annotations
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Optional
+
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORTS = {"combined": 9100, "telegram": 9101, "whatsapp": 9102}
+# Seconds, ticks may take minutes
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120,
+    300, 600,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[str, ...]
+Collector = Callable[[], dict[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return (
+        value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+    )
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base of metrics: name, help text and label names.
+
+    Parameters
+    ----------
+    name : str
+        Metric name.
+    documentation : str
+        Help text.
+    labelnames : tuple[str, ...], optional
+        Names of labels, values of all of them are required,
+        by default no labels.
+
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[LabelValues, Any] = {}
+
+    def _key(self, labels: dict[str, Any]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} has labels {self.labelnames}, got "
+                f"{tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        """Yield name suffix, labels and value of every sample."""
+        raise NotImplementedError
+
+    def _labels(self, key: LabelValues) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def render(self) -> str:
+        """Get metric in Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            text = ",".join(
+                f'{name}="{_escape(label)}"' for name, label in labels.items()
+            )
+            text = f"{{{text}}}" if text else ""
+            lines.append(f"{self.name}{suffix}{text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield "", self._labels(key), value
+
+
+class Gauge(Metric):
+    """Value which goes up and down.
+
+    Values can be set directly or computed by collectors at render.
+    """
+
+    type = "gauge"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._collectors: list[Collector] = []
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def add_collector(self, collector: Collector) -> None:
+        """Add function returning label values to value mapping."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = dict(self._values)
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                logger.warning(f"Collector of {self.name} failed: {e}")
+                continue
+            for key, value in collected.items():
+                values[tuple(map(str, key))] = value
+        for key, value in values.items():
+            yield "", self._labels(key), value
+
+
+class Histogram(Metric):
+    """Distribution of observed values by cumulative buckets.
+
+    Parameters
+    ----------
+    buckets : tuple[float, ...], optional
+        Upper bounds of buckets, by default `DEFAULT_BUCKETS`.
+
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or (
+                [0] * len(self.buckets),
+                0.0,
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe duration of the block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_value(bound)
+                yield "_bucket", {**labels, "le": le}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
+
+
+class Registry:
+    """Set of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add metric, the registered one is returned for a known name."""
+        with self._lock:
+            registered = self._metrics.get(metric.name)
+            if registered is None:
+                self._metrics[metric.name] = registered = metric
+            elif type(registered) is not type(metric):
+                raise ValueError(f"Metric {metric.name} is registered")
+        return registered
+
+    def counter(self, *args: Any, **kwargs: Any) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args: Any, **kwargs: Any) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args: Any, **kwargs: Any) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        """Get all metrics in Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+CSV_READ_SECONDS = REGISTRY.histogram(
+    "clinic_csv_read_seconds",
+    "Duration of reads of csv files.",
+    ("file", "method"),
+)
+CSV_READ_BYTES = REGISTRY.counter(
+    "clinic_csv_read_bytes_total",
+    "Size of read csv files.",
+    ("file", "method"),
+)
+CSV_WRITE_SECONDS = REGISTRY.histogram(
+    "clinic_csv_write_seconds",
+    "Duration of serialization and atomic write of csv files.",
+    ("file",),
+)
+CSV_WRITE_BYTES = REGISTRY.counter(
+    "clinic_csv_write_bytes_total",
+    "Size of written csv files.",
+    ("file",),
+)
+DB_LOOKUP_SECONDS = REGISTRY.histogram(
+    "clinic_db_lookup_seconds",
+    "Duration of lookups in the patients database.",
+    ("column",),
+)
+DB_LOOKUPS = REGISTRY.counter(
+    "clinic_db_lookups_total",
+    "Lookups in the patients database by result, hit or miss.",
+    ("column", "result"),
+)
+TICK_SECONDS = REGISTRY.histogram(
+    "clinic_tick_seconds",
+    "Duration of checks of csv files until notifications are sent.",
+    ("channel",),
+)
+TICK_LAST_SECONDS = REGISTRY.gauge(
+    "clinic_tick_last_seconds",
+    "Duration of the last finished check of csv files.",
+    ("channel",),
+)
+TICK_STARTED = REGISTRY.gauge(
+    "clinic_tick_started_timestamp_seconds",
+    "Unix time of start of the last check of csv files.",
+    ("channel",),
+)
+TICK_FINISHED = REGISTRY.gauge(
+    "clinic_tick_finished_timestamp_seconds",
+    "Unix time of end of the last check of csv files.",
+    ("channel",),
+)
+TICK_INTERVAL_SECONDS = REGISTRY.gauge(
+    "clinic_tick_interval_seconds",
+    "Interval of scheduled checks of csv files.",
+    ("channel",),
+)
+TICK_ROWS = REGISTRY.counter(
+    "clinic_tick_rows_total",
+    "Appointments of registered patients processed by checks.",
+    ("channel", "kind"),
+)
+SEND_SECONDS = REGISTRY.histogram(
+    "clinic_send_seconds",
+    "Duration of sending of messages, waiting of rate limits included.",
+    ("channel",),
+)
+SEND_ERRORS = REGISTRY.counter(
+    "clinic_send_errors_total",
+    "Messages which weren't sent.",
+    ("channel",),
+)
+SEND_RETRIES = REGISTRY.counter(
+    "clinic_send_retries_total",
+    "Retries of sending of messages.",
+    ("channel",),
+)
+OUTBOUND_NOTIFICATIONS = REGISTRY.counter(
+    "clinic_outbound_notifications_total",
+    "Notifications taken from the outbound queue by result: sent, "
+    "expired (deadline passed in the queue), failed or cancelled.",
+    ("channel", "kind", "result"),
+)
+FSM_STATES = REGISTRY.gauge(
+    "clinic_fsm_states",
+    "Dialogs by FSM state.",
+    ("channel", "state"),
+)
+INBOUND_LAG_SECONDS = REGISTRY.histogram(
+    "clinic_inbound_lag_seconds",
+    "Time from receive of a message to start of its handling.",
+    ("channel",),
+)
+INBOUND_QUEUE_DEPTH = REGISTRY.gauge(
+    "clinic_inbound_queue_depth",
+    "Received messages waiting for handlers.",
+    ("channel",),
+)
+WORKER_UPDATES = REGISTRY.counter(
+    "clinic_worker_updates_total",
+    "Telegram updates routed to worker processes.",
+    ("worker",),
+)
+WORKER_RESTARTS = REGISTRY.counter(
+    "clinic_worker_restarts_total",
+    "Restarts of exited worker processes.",
+    ("worker",),
+)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    from aiohttp import web
+
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": CONTENT_TYPE},
+    )
+
+
+async def start_metrics_server(channel: str) -> Optional[web.AppRunner]:
+    """Serve `/metrics` configured by `metrics` section of config.yml.
+
+    Parameters
+    ----------
+    channel : str
+        `telegram`, `whatsapp` or `combined` (both bots in one process),
+        selects port of the process.
+
+    Returns
+    -------
+    Optional[web.AppRunner]
+        runner of the server, None if it's disabled or can't start.
+    """
+    cfg = get_config().get("metrics") or {}
+    if not cfg.get("enabled", False):
+        return None
+
+    from aiohttp import web
+
+    ports = {**DEFAULT_PORTS, **(cfg.get("ports") or {})}
+    host = cfg.get("host") or DEFAULT_HOST
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, ports[channel]).start()
+    except OSError as e:
+        logger.warning(f"Metrics aren't served: {e}")
+        await runner.cleanup()
+        return None
+
+    logger.info(f"Metrics are served on http://{host}:{ports[channel]}")
+    return runner
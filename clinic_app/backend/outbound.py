@@ -0,0 +1,172 @@
+"""Outbound queue of notifications ordered by priority and deadline.
+
+Reminders of all kinds are put into one queue and sent by a fixed
+count of workers: time-critical reminders go first, and reminders whose
+deadline passed while they were waiting are dropped instead of sent.
+Results are counted by `OUTBOUND_NOTIFICATIONS` per channel and kind.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import math
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from clinic_app.backend.metrics import OUTBOUND_NOTIFICATIONS
+from clinic_app.backend.utils import parse_start
+from clinic_app.shared.config import get_config
+from loguru import logger
+from zoneinfo import ZoneInfo
+
+DEFAULT_WORKERS = 30
+
+# Lower value is sent first, keys are keys of `CSVS`
+PRIORITIES = {"2hours": 0, "tommorow": 1, "reviews": 2}
+# Time after `ДатаНачала` until notification makes sense
+DEADLINES = {
+    "2hours": timedelta(0),
+    "tommorow": timedelta(hours=-2),
+    "reviews": timedelta(days=2),
+}
+
+Send = Callable[[], Awaitable[Any]]
+
+_queue: Optional[OutboundQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_deadline(kind: str, start: Any) -> float:
+    """Get deadline of notification as unix time.
+
+    Parameters
+    ----------
+    kind : str
+        key of the csv file in `CSVS`.
+    start : Any
+        `ДатаНачала` value, naive dates are in Moscow time.
+
+    Returns
+    -------
+    float
+        unix time, `math.inf` if start isn't a date.
+    """
+    dt = parse_start(start)
+    if dt is None:
+        return math.inf
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=ZoneInfo("Europe/Moscow"))
+    return (dt + DEADLINES[kind]).timestamp()
+
+
+class OutboundQueue:
+    """Queue of notifications sent by a fixed count of workers.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Count of notifications sent concurrently,
+        by default `DEFAULT_WORKERS`.
+
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS) -> None:
+        self.workers = workers
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._tasks: list[asyncio.Task] = []
+
+        self.sent = 0
+        self.expired = 0
+        self.failed = 0
+
+    def put(self, channel: str, kind: str, start: Any, send: Send) -> None:
+        """Put notification into the queue.
+
+        Parameters
+        ----------
+        channel : str
+            `telegram` or `whatsapp`, label of metrics.
+        kind : str
+            key of the csv file in `CSVS`.
+        start : Any
+            `ДатаНачала` value.
+        send : Send
+            coroutine function sending the notification.
+        """
+        self._queue.put_nowait(
+            (
+                PRIORITIES[kind],
+                get_deadline(kind, start),
+                next(self._order),
+                channel,
+                kind,
+                send,
+            )
+        )
+        self.start()
+
+    def start(self) -> None:
+        """Start workers if they aren't running."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def join(self) -> None:
+        """Wait until every queued notification is sent or dropped."""
+        await self._queue.join()
+
+    async def stop(self) -> None:
+        """Cancel workers, queued notifications are lost."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict[str, int]:
+        """Get queue depth and counters."""
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "expired": self.expired,
+            "failed": self.failed,
+        }
+
+    async def _work(self) -> None:
+        while True:
+            _, deadline, _, channel, kind, send = await self._queue.get()
+            # Workers are cancelled while sending by `stop`
+            result = "cancelled"
+            try:
+                if deadline < time.time():
+                    self.expired += 1
+                    result = "expired"
+                    continue
+                await send()
+                self.sent += 1
+                result = "sent"
+            except Exception as e:
+                self.failed += 1
+                result = "failed"
+                logger.opt(exception=e).error("Notification wasn't sent")
+            finally:
+                OUTBOUND_NOTIFICATIONS.inc(
+                    channel=channel, kind=kind, result=result
+                )
+                self._queue.task_done()
+
+
+def get_outbound() -> OutboundQueue:
+    """Get process-wide outbound queue."""
+    global _queue
+
+    with _queue_lock:
+        if _queue is None:
+            cfg = get_config().get("outbound") or {}
+            _queue = OutboundQueue(cfg.get("workers", DEFAULT_WORKERS))
+    return _queue
@@ -0,0 +1,253 @@
+"""Opt-in profiling of ticks and handlers by cProfile and tracemalloc.
+
+Profiling is configured by `profiling` section of config.yml, the
+`CLINIC_PROFILING` environment variable (`1` or `0`) overrides its
+`enabled` flag. A call is profiled if it's every `every_n`-th call of
+its target or, when `slow_seconds` is set, every call is profiled and
+kept if it took longer. Reports of top functions and allocation sites
+are written to `<directory>/<target>-<time>.txt` next to raw `.prof`
+stats, only `keep` latest reports of every target are kept.
+
+When profiling is disabled, `profile` only checks a flag.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator, Optional, TypeVar
+
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+ENV_VARIABLE = "CLINIC_PROFILING"
+DEFAULT_DIRECTORY = "profiles"
+DEFAULT_EVERY_N = 0
+DEFAULT_SLOW_SECONDS = 0
+DEFAULT_TOP = 30
+DEFAULT_KEEP = 20
+# Frames of allocation tracebacks, only the top one is reported
+TRACEMALLOC_FRAMES = 1
+
+T = TypeVar("T")
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+class Profiler:
+    """Sampled cProfile and tracemalloc sessions of named targets.
+
+    Only one session runs at a time, cProfile profiles the whole thread,
+    so handlers running while a tick is profiled are in its report.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Profile anything, by default False.
+    directory : str, optional
+        Directory of reports, by default `DEFAULT_DIRECTORY`.
+    every_n : int, optional
+        Profile every Nth call of target, 0 is off,
+        by default `DEFAULT_EVERY_N`.
+    slow_seconds : float, optional
+        Keep profiles of calls slower than it, 0 is off,
+        by default `DEFAULT_SLOW_SECONDS`.
+    top : int, optional
+        Count of reported functions and allocation sites,
+        by default `DEFAULT_TOP`.
+    keep : int, optional
+        Reports kept per target, by default `DEFAULT_KEEP`.
+    memory : bool, optional
+        Trace allocations by tracemalloc, by default False.
+    handlers : Optional[list[str]], optional
+        Names of handlers to profile, by default none.
+
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        directory: str = DEFAULT_DIRECTORY,
+        every_n: int = DEFAULT_EVERY_N,
+        slow_seconds: float = DEFAULT_SLOW_SECONDS,
+        top: int = DEFAULT_TOP,
+        keep: int = DEFAULT_KEEP,
+        memory: bool = False,
+        handlers: Optional[list[str]] = None,
+    ) -> None:
+        self.enabled = enabled and (every_n > 0 or slow_seconds > 0)
+        self.directory = Path(directory)
+        self.every_n = every_n
+        self.slow_seconds = slow_seconds
+        self.top = top
+        self.keep = keep
+        self.memory = memory
+        self.handlers = set(handlers or ())
+        self._lock = threading.Lock()
+        self._calls: dict[str, int] = {}
+        self._active = False
+
+    def wants_handler(self, name: str) -> bool:
+        """Return True if handler with the name is profiled."""
+        return self.enabled and name in self.handlers
+
+    def _begin(self, target: str) -> Optional[bool]:
+        """Start session, return if call is sampled or None to skip it."""
+        with self._lock:
+            calls = self._calls[target] = self._calls.get(target, 0) + 1
+            if self._active:
+                return None
+            sampled = self.every_n > 0 and calls % self.every_n == 0
+            if not sampled and self.slow_seconds <= 0:
+                return None
+            self._active = True
+            return sampled
+
+    @contextmanager
+    def profile(self, target: str) -> Iterator[None]:
+        """Profile the block as a call of `target` if it's selected.
+
+        Parameters
+        ----------
+        target : str
+            Name of profiled code, prefix of report files,
+            e.g. `telegram-tick`.
+        """
+        sampled = self._begin(target) if self.enabled else None
+        if sampled is None:
+            yield
+            return
+
+        started_tracing = False
+        before = None
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracing = True
+            before = tracemalloc.take_snapshot()
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - started
+            after = None if before is None else tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            with self._lock:
+                self._active = False
+
+            if sampled or 0 < self.slow_seconds <= duration:
+                try:
+                    self._write(target, duration, profiler, before, after)
+                except OSError as e:
+                    logger.warning(f"Profile of {target} isn't written: {e}")
+
+    def _write(
+        self,
+        target: str,
+        duration: float,
+        profiler: cProfile.Profile,
+        before: Optional[tracemalloc.Snapshot],
+        after: Optional[tracemalloc.Snapshot],
+    ) -> Path:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = self.directory / f"{target}-{stamp}.txt"
+
+        report = io.StringIO()
+        report.write(f"{target}: {duration:.3f} s\n\n")
+        stats = pstats.Stats(profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        if before is not None and after is not None:
+            report.write(f"Top {self.top} allocation sites:\n")
+            diff = after.compare_to(before, "lineno")
+            for stat in diff[: self.top]:
+                report.write(f"{stat}\n")
+
+        path.write_text(report.getvalue())
+        stats.dump_stats(path.with_suffix(".prof"))
+        self._rotate(target)
+        logger.info(f"Profile of {target} ({duration:.1f} s): {path}")
+        return path
+
+    def _rotate(self, target: str) -> None:
+        reports = sorted(self.directory.glob(f"{target}-*.txt"))
+        for report in reports[: max(len(reports) - self.keep, 0)]:
+            report.unlink(missing_ok=True)
+            report.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def _env_enabled() -> Optional[bool]:
+    value = os.environ.get(ENV_VARIABLE, "").strip().lower()
+    if not value:
+        return None
+    return value not in ("0", "false", "no", "off")
+
+
+def get_profiler() -> Profiler:
+    """Get process-wide profiler configured by config.yml."""
+    global _profiler
+
+    with _profiler_lock:
+        if _profiler is None:
+            cfg: dict[str, Any] = get_config().get("profiling") or {}
+            enabled = _env_enabled()
+            if enabled is None:
+                enabled = bool(cfg.get("enabled", False))
+            _profiler = Profiler(
+                enabled=enabled,
+                directory=cfg.get("directory") or DEFAULT_DIRECTORY,
+                every_n=cfg.get("every_n", DEFAULT_EVERY_N) or 0,
+                slow_seconds=cfg.get("slow_seconds", DEFAULT_SLOW_SECONDS)
+                or 0,
+                top=cfg.get("top", DEFAULT_TOP),
+                keep=cfg.get("keep", DEFAULT_KEEP),
+                memory=bool(cfg.get("memory", False)),
+                handlers=cfg.get("handlers") or [],
+            )
+    return _profiler
+
+
+def profiled(
+    channel: str,
+) -> Callable[
+    [Callable[..., Awaitable[T]]], Callable[..., Awaitable[T]]
+]:
+    """Profile handler if its name is in `profiling.handlers`.
+
+    Parameters
+    ----------
+    channel : str
+        `telegram` or `whatsapp`, prefix of report files.
+    """
+
+    def decorator(
+        f: Callable[..., Awaitable[T]],
+    ) -> Callable[..., Awaitable[T]]:
+        name = f.__name__
+
+        @wraps(f)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            profiler = get_profiler()
+            if not profiler.wants_handler(name):
+                return await f(*args, **kwargs)
+            with profiler.profile(f"{channel}-{name}"):
+                return await f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
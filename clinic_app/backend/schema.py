@@ -0,0 +1,129 @@
+"""Declared schemas of appointment csv files.
+
+Schemas are set in `csv_schemas` section of config.yml by keys of
+`CSVS`. Reads by schema parse only declared columns with declared dtypes
+by the pyarrow engine, or stream the file by chunks. They are used by
+lookups, writes still read and save the whole file as it is.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+from clinic_app.backend.utils import PHONE_KEY, parse_starts
+from clinic_app.shared import CSVS
+from clinic_app.shared.config import get_config
+
+DEFAULT_ENGINE = "pyarrow"
+# Version of reads by schema, change it when they return other frames
+SCHEMA_VERSION = 1
+
+_schemas: Optional[dict[str, CSVSchema]] = None
+
+
+@dataclass(frozen=True, slots=True)
+class CSVSchema:
+    """Columns and dtypes of a csv file.
+
+    Parameters
+    ----------
+    dtypes : dict[str, str]
+        column name to pandas dtype mapping.
+    datetimes : tuple[str, ...]
+        columns parsed by `parse_starts`.
+    engine : str
+        parser of `pd.read_csv`, by default `DEFAULT_ENGINE`.
+    chunksize : int
+        rows per chunk of `iter_chunks`, 0 reads the whole file.
+
+    """
+
+    dtypes: dict[str, str]
+    datetimes: tuple[str, ...] = ()
+    engine: str = DEFAULT_ENGINE
+    chunksize: int = 0
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of what reads by the schema return, see `SCHEMA_VERSION`."""
+        raw = json.dumps(
+            [SCHEMA_VERSION, self.dtypes, self.datetimes, self.engine],
+            sort_keys=True,
+        )
+        return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+    def _usecols(self, columns: pd.Index) -> list[str]:
+        # `usecols` fails on missing columns, so take the present ones
+        wanted = [*self.dtypes, *self.datetimes, PHONE_KEY]
+        return [column for column in wanted if column in columns]
+
+    def _dtype(self, usecols: list[str]) -> dict[str, str]:
+        # Dates are parsed after read, exports mix ISO and `dd.mm.yyyy`
+        dtype = {}
+        for column in usecols:
+            if column in self.datetimes:
+                dtype[column] = "string"
+            else:
+                dtype[column] = self.dtypes.get(column, "string")
+        return dtype
+
+    def _read_kwargs(self, path: str) -> dict:
+        usecols = self._usecols(pd.read_csv(path, nrows=0).columns)
+        return {"usecols": usecols, "dtype": self._dtype(usecols)}
+
+    def _parse(self, df: pd.DataFrame) -> pd.DataFrame:
+        for column in self.datetimes:
+            if column in df.columns:
+                df[column] = parse_starts(df[column])
+        return df
+
+    def read(self, path: str) -> pd.DataFrame:
+        """Read declared columns of csv file."""
+        df = pd.read_csv(path, engine=self.engine, **self._read_kwargs(path))
+        return self._parse(df)
+
+    def select(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Take declared columns of loaded dataframe and cast them."""
+        usecols = self._usecols(df.columns)
+        return self._parse(df[usecols].astype(self._dtype(usecols)))
+
+    def iter_chunks(self, path: str) -> Iterator[pd.DataFrame]:
+        """Read declared columns of csv file by `chunksize` rows.
+
+        The whole file is read at once if `chunksize` is 0. Index of rows
+        continues between chunks, so it's the row index in the file.
+        """
+        if not self.chunksize:
+            yield self.read(path)
+            return
+
+        # The pyarrow engine can't stream, the C engine is used
+        chunks = pd.read_csv(
+            path, chunksize=self.chunksize, **self._read_kwargs(path)
+        )
+        with chunks:
+            for chunk in chunks:
+                yield self._parse(chunk)
+
+
+def get_schema(path: str) -> Optional[CSVSchema]:
+    """Get declared schema of csv file, None if it isn't declared."""
+    global _schemas
+
+    if _schemas is None:
+        _schemas = {}
+        for kind, cfg in (get_config().get("csv_schemas") or {}).items():
+            if kind not in CSVS:
+                raise ValueError(f"Unknown csv file in csv_schemas: {kind}")
+            _schemas[str(Path(CSVS[kind]))] = CSVSchema(
+                dtypes=dict(cfg.get("dtypes") or {}),
+                datetimes=tuple(cfg.get("datetimes") or ()),
+                engine=cfg.get("engine", DEFAULT_ENGINE),
+                chunksize=cfg.get("chunksize", 0),
+            )
+    return _schemas.get(str(Path(path)))
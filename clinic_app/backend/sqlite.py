@@ -0,0 +1,559 @@
+"""SQLite storage with the same interface as `CSVFile` and `Database`.
+
+Every csv file is imported into a table of one SQLite database in WAL
+mode, so both bots can read and update rows concurrently and single row
+operations use indexes. Tables are written back to csv files only by
+`export_csv`, e.g. `python -m clinic_app.backend.sqlite export`.
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import pandas as pd
+from clinic_app.backend.locks import save_csv
+from clinic_app.backend.metrics import DB_LOOKUP_SECONDS, DB_LOOKUPS
+from clinic_app.backend.schema import get_schema
+from clinic_app.backend.utils import (
+    PHONE_KEY,
+    appointment_keys,
+    fill_phone_keys,
+    format_phone,
+)
+from clinic_app.shared import CSVS
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+DEFAULT_SQLITE_PATH = "src_csvs/clinic.sqlite3"
+ROW_COLUMN = "_row"
+# Columns of answers of patients kept between imports
+ANSWER_COLUMNS = ("Подтверждение", "Перезапись", "Отзыв")
+
+_local = threading.local()
+
+
+def _quote(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _to_builtin(value: Any) -> Any:
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _as_text(values: pd.Series) -> pd.Series:
+    # Phones of digits only are read by pandas as numbers
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype("Int64").astype("string")
+    return values
+
+
+def get_sqlite_path() -> str:
+    """Get path of SQLite database from config."""
+    cfg = get_config()["database"].get("sqlite") or {}
+    return cfg.get("path", DEFAULT_SQLITE_PATH)
+
+
+def connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Get connection of the current thread to SQLite database."""
+    # Relative paths of config point to other files in other directories
+    path = str(Path(path or get_sqlite_path()).resolve())
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _sources "
+            "(name TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER)"
+        )
+        connections[path] = conn
+    return conn
+
+
+class SQLiteTable:
+    """Interface to interact with csv file imported into SQLite.
+
+    The table is (re)imported when the source csv file changes, answers
+    of patients in the table are kept for their appointments.
+
+    Parameters
+    ----------
+    path : str
+        Path to source csv file.
+    indexes : tuple[str, ...], optional
+        Columns to index, by default (`PHONE_KEY`,).
+
+    """
+
+    phone_column = "Телефон"
+    reimport = True
+
+    def __init__(
+        self, path: str, indexes: tuple[str, ...] = (PHONE_KEY,)
+    ) -> None:
+        if not path.endswith(".csv"):
+            raise ValueError
+
+        self.path = path
+        self.table = Path(path).stem
+        self.indexes = indexes
+        self.conn = connect()
+        self._import()
+
+    def _signature(self) -> Optional[tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _table_exists(self) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+            (self.table,),
+        ).fetchone()
+        return row is not None
+
+    def _source_df(self) -> pd.DataFrame:
+        if not Path(self.path).exists():
+            raise FileNotFoundError(self.path)
+        return pd.read_csv(self.path)
+
+    def _import(self) -> None:
+        signature = self._signature()
+        exists = self._table_exists()
+        if exists and not self.reimport:
+            return
+
+        saved = self.conn.execute(
+            "SELECT mtime_ns, size FROM _sources WHERE name=?", (self.table,)
+        ).fetchone()
+        if exists and saved == signature:
+            return
+
+        df = self._source_df()
+        if self.phone_column in df.columns:
+            df[self.phone_column] = _as_text(df[self.phone_column])
+            fill_phone_keys(df, self.phone_column)
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Other process could import it while we were reading csv
+            saved = self.conn.execute(
+                "SELECT mtime_ns, size FROM _sources WHERE name=?",
+                (self.table,),
+            ).fetchone()
+            if self._table_exists() and (
+                saved == signature or not self.reimport
+            ):
+                self.conn.execute("ROLLBACK")
+                return
+
+            if self._table_exists():
+                self._keep_answers(df, self.get_df())
+            self._create_table(df)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO _sources VALUES (?, ?, ?)",
+                (self.table, *(signature or (None, None))),
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def _keep_answers(self, df: pd.DataFrame, old: pd.DataFrame) -> None:
+        """Copy answers of the table which isn't exported to new rows.
+
+        Rows are moved by re-export, so they're matched by phone and
+        start of appointment. Answers of the new file are kept where
+        the table has none.
+        """
+        columns = [col for col in ANSWER_COLUMNS if col in old.columns]
+        if not columns:
+            return
+
+        old_keys = appointment_keys(old, self.phone_column)
+        new_keys = appointment_keys(df, self.phone_column)
+        for column in columns:
+            answers = {
+                key: value
+                for key, value in zip(old_keys, old[column])
+                if key is not None and not pd.isna(value)
+            }
+            if not answers:
+                continue
+
+            kept = pd.Series(
+                [answers.get(key) for key in new_keys],
+                index=df.index,
+                dtype=object,
+            )
+            if column in df.columns:
+                kept = kept.where(kept.notna(), df[column])
+            df[column] = kept
+
+    def _create_table(self, df: pd.DataFrame) -> None:
+        table = _quote(self.table)
+        # Phones are compared with strings, TEXT affinity keeps them so
+        text = (self.phone_column, PHONE_KEY)
+        columns = ", ".join(
+            f"{_quote(col)} TEXT" if col in text else _quote(col)
+            for col in df.columns
+        )
+        self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+        self.conn.execute(
+            f"CREATE TABLE {table} ({ROW_COLUMN} INTEGER PRIMARY KEY"
+            + (f", {columns})" if columns else ")")
+        )
+
+        if len(df.columns):
+            placeholders = ", ".join("?" * (len(df.columns) + 1))
+            rows = (
+                tuple(_to_builtin(value) for value in row)
+                for row in df.itertuples(index=True, name=None)
+            )
+            self.conn.executemany(
+                f"INSERT INTO {table} VALUES ({placeholders})", rows
+            )
+
+        for column in self.indexes:
+            if column in df.columns:
+                self._create_index(column)
+
+    def _create_index(self, column: str) -> None:
+        index = _quote(f"ix_{self.table}_{column}")
+        self.conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {index} "
+            f"ON {_quote(self.table)} ({_quote(column)})"
+        )
+
+    def _columns(self) -> list[str]:
+        rows = self.conn.execute(
+            f"PRAGMA table_info({_quote(self.table)})"
+        ).fetchall()
+        return [row[1] for row in rows if row[1] != ROW_COLUMN]
+
+    def _ensure_columns(self, columns: list[str]) -> None:
+        existing = self._columns()
+        for column in columns:
+            if column not in existing:
+                self.create_column(column)
+
+    def _lookup_kv(self, column: str, value: Any) -> tuple[str, Any]:
+        """Replace phone lookup by lookup of normalized phone key."""
+        if column == self.phone_column:
+            key = format_phone(value)
+            if key is not None:
+                return PHONE_KEY, key
+        return column, value
+
+    def create_column(self, column_name: str) -> None:
+        """Create column with empty rows in the table."""
+        self.conn.execute(
+            f"ALTER TABLE {_quote(self.table)} "
+            f"ADD COLUMN {_quote(column_name)}"
+        )
+
+    def get_df(self) -> pd.DataFrame:
+        """Get `pd.DataFrame` from the table.
+
+        Returns
+        -------
+        pd.DataFrame
+            dataframe indexed like the source csv file.
+        """
+        df = pd.read_sql_query(
+            f"SELECT * FROM {_quote(self.table)} ORDER BY {ROW_COLUMN}",
+            self.conn,
+            index_col=ROW_COLUMN,
+        )
+        df.index.name = None
+        return df
+
+    def read(self) -> pd.DataFrame:
+        """Get dataframe of declared columns for lookups.
+
+        Returns
+        -------
+        pd.DataFrame
+            dataframe typed by the schema of the source csv file.
+        """
+        df = self.get_df()
+        schema = get_schema(self.path)
+        if schema is None:
+            return df
+        return schema.select(df)
+
+    def iter_chunks(self) -> Iterator[pd.DataFrame]:
+        """Yield the table as one chunk, it's read by SQLite anyway."""
+        yield self.read()
+
+    def update_cells(
+        self,
+        index: int,
+        values: dict[str, Any],
+        key: Optional[tuple[str, str]] = None,
+    ) -> None:
+        """Update cells of one row.
+
+        Parameters
+        ----------
+        index : int
+            Row index in the source csv file.
+        values : dict[str, Any]
+            Column name to new value mapping.
+        key : Optional[tuple[str, str]], optional
+            `appointment_key` of the row, the row is found by it if the
+            table was imported again since it was read, by default None.
+        """
+        if key is not None:
+            index = self._find_row(index, tuple(key))
+            if index is None:
+                logger.warning(f"Appointment {key} isn't found in {self.path}")
+                return
+
+        self._ensure_columns(list(values))
+        assignments = ", ".join(f"{_quote(col)} = ?" for col in values)
+        self.conn.execute(
+            f"UPDATE {_quote(self.table)} SET {assignments} "
+            f"WHERE {ROW_COLUMN} = ?",
+            (*map(_to_builtin, values.values()), int(index)),
+        )
+
+    def _find_row(self, index: int, key: tuple[str, str]) -> Optional[int]:
+        """Get row of appointment, `index` is taken if it's the row."""
+        if PHONE_KEY not in self._columns():
+            return None
+        df = pd.read_sql_query(
+            f"SELECT * FROM {_quote(self.table)} "
+            f"WHERE {_quote(PHONE_KEY)} = ? ORDER BY {ROW_COLUMN}",
+            self.conn,
+            params=(key[0],),
+            index_col=ROW_COLUMN,
+        )
+        rows = [
+            int(row)
+            for row, row_key in appointment_keys(df).items()
+            if row_key == key
+        ]
+        if int(index) in rows:
+            return int(index)
+        return rows[0] if rows else None
+
+    def flush(self) -> None:
+        """Updates are written immediately, kept for `CSVFile` interface."""
+
+    def ensure_phone_key(
+        self, phone_column: str, df: Optional[pd.DataFrame] = None
+    ) -> pd.DataFrame:
+        """Get dataframe, keys are computed when the table is imported."""
+        if df is None:
+            df = self.get_df()
+        return df
+
+    def value_exists(self, value: Any, column_name: str) -> bool:
+        """Return True if value exists, otherwise False."""
+        column_name, value = self._lookup_kv(column_name, value)
+        row = self.conn.execute(
+            f"SELECT 1 FROM {_quote(self.table)} "
+            f"WHERE {_quote(column_name)} = ? LIMIT 1",
+            (_to_builtin(value),),
+        ).fetchone()
+        return row is not None
+
+    def find_and_replace(
+        self,
+        search_value_column_name: str,
+        search_value: str,
+        new_value_column_name: str,
+        new_value: str,
+        save: bool = False,
+    ) -> pd.DataFrame:
+        """Find value by column name and replace it.
+
+        Unlike `CSVFile.find_and_replace` only the updated row is
+        returned, so the update doesn't read the whole table. Phones are
+        found by `PHONE_KEY`, so they match in any format.
+
+        Parameters
+        ----------
+        search_value_column_name : str
+            column name in which value source are located.
+        search_value : str
+            source value.
+        new_value_column_name : str
+            Name of the column in which the cell should be updated.
+        new_value : str
+            New value.
+        save : bool, optional
+            If True the update will be saved, by default False.
+
+        Returns
+        -------
+        pd.DataFrame
+            Updated row, empty if the value isn't found.
+        """
+        column, value = self._lookup_kv(
+            search_value_column_name, search_value
+        )
+        df = pd.read_sql_query(
+            f"SELECT * FROM {_quote(self.table)} "
+            f"WHERE {_quote(column)} = ? "
+            f"ORDER BY {ROW_COLUMN} LIMIT 1",
+            self.conn,
+            params=(_to_builtin(value),),
+            index_col=ROW_COLUMN,
+        )
+        df.index.name = None
+        if df.empty:
+            logger.warning(
+                f"{search_value_column_name} {search_value!r} isn't found "
+                f"in {self.path}"
+            )
+            return df
+
+        if save:
+            self.update_cells(df.index[0], {new_value_column_name: new_value})
+
+        df[new_value_column_name] = new_value
+        return df
+
+    def export_csv(self, path: Optional[str] = None) -> None:
+        """Write the table to csv file.
+
+        Parameters
+        ----------
+        path : Optional[str], optional
+            Path to csv file, by default source csv file of the table.
+        """
+        path = path or self.path
+        save_csv(self.get_df(), path)
+
+        if path == self.path:
+            # Don't reimport our own export
+            self.conn.execute(
+                "INSERT OR REPLACE INTO _sources VALUES (?, ?, ?)",
+                (self.table, *self._signature()),
+            )
+
+
+class SQLiteDatabase(SQLiteTable):
+    """Interface to interact with database of patients in SQLite.
+
+    db.csv is imported once, after that the table is the source of truth.
+
+    Parameters
+    ----------
+    path : Optional[str], optional
+        Path to database csv file, by default `CSVS["db"]`.
+
+    """
+
+    phone_column = "phone"
+    reimport = False
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(
+            path=path or CSVS["db"],
+            indexes=(PHONE_KEY, "tg_user_id", "wh_user_id"),
+        )
+
+    def _source_df(self) -> pd.DataFrame:
+        if Path(self.path).exists():
+            return pd.read_csv(self.path)
+
+        cfg = get_config()
+        return pd.DataFrame(columns=cfg["database"]["csv"]["columns"])
+
+    def value_exists(self, value: Any, column_name: str) -> bool:
+        with DB_LOOKUP_SECONDS.time(column=column_name):
+            exists = super().value_exists(value, column_name)
+
+        result = "hit" if exists else "miss"
+        DB_LOOKUPS.inc(column=column_name, result=result)
+        return exists
+
+    def get_value_by_kv(self, kv: tuple[str, Any], column: str) -> Any | None:
+        with DB_LOOKUP_SECONDS.time(column=kv[0]):
+            key, value = self._lookup_kv(*kv)
+            row = self.conn.execute(
+                f"SELECT {_quote(column)} FROM {_quote(self.table)} "
+                f"WHERE {_quote(key)} = ? ORDER BY {ROW_COLUMN} LIMIT 1",
+                (_to_builtin(value),),
+            ).fetchone()
+
+        value = None if row is None else row[0]
+        result = "miss" if value is None else "hit"
+        DB_LOOKUPS.inc(column=kv[0], result=result)
+        return value
+
+    def get_patients(self) -> pd.DataFrame:
+        """Get dataframe of all patients."""
+        return self.get_df()
+
+    def add_row(self, row: dict[str, Any]) -> bool:
+        """Insert row of a patient unless the phone is registered.
+
+        The phone is checked by the insert statement itself, so
+        concurrent registrations in other processes don't duplicate it.
+
+        Parameters
+        ----------
+        row : dict[str, Any]
+            column name to value mapping, missing columns stay empty.
+
+        Returns
+        -------
+        bool
+            True if row is added, False if the phone is registered.
+        """
+        key = None
+        if row.get("phone") is not None:
+            key = format_phone(row["phone"])
+            row = {**row, PHONE_KEY: key}
+
+        self._ensure_columns(list(row))
+        table = _quote(self.table)
+        columns = ", ".join(_quote(col) for col in row)
+        placeholders = ", ".join("?" * len(row))
+        values = tuple(map(_to_builtin, row.values()))
+        if key is None:
+            self.conn.execute(
+                f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                values,
+            )
+            return True
+
+        cursor = self.conn.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {placeholders} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} "
+            f"WHERE {_quote(PHONE_KEY)} = ?)",
+            (*values, key),
+        )
+        return cursor.rowcount == 1
+
+
+def export_all() -> None:
+    """Write all tables from `CSVS` back to csv files."""
+    for name, path in CSVS.items():
+        table = SQLiteDatabase(path) if name == "db" else SQLiteTable(path)
+        table.export_csv()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["export"]:
+        sys.exit("Usage: python -m clinic_app.backend.sqlite export")
+    export_all()
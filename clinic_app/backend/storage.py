@@ -0,0 +1,51 @@
+"""Selection of storage backend by `database.backend` in config.
+
+Backends are imported on first use, both of them import pandas.
+"""
+
+from __future__ import annotations
+
+from functools import cache
+from typing import TYPE_CHECKING, Optional
+
+from clinic_app.shared.config import get_config
+
+if TYPE_CHECKING:
+    from clinic_app.backend.csv_files import CSVFile, Database
+    from clinic_app.backend.sqlite import SQLiteDatabase, SQLiteTable
+
+BACKENDS = ("csv", "sqlite")
+
+
+@cache
+def get_backend() -> str:
+    """Get name of storage backend, `csv` or `sqlite`."""
+    backend = get_config()["database"].get("backend") or "csv"
+    if backend not in BACKENDS:
+        msg = f"Unknown database backend {backend!r}, expected {BACKENDS}"
+        raise ValueError(msg)
+    return backend
+
+
+def open_csv(path: str) -> CSVFile | SQLiteTable:
+    """Get interface of appointment csv file in configured backend."""
+    if get_backend() == "sqlite":
+        from clinic_app.backend.sqlite import SQLiteTable
+
+        return SQLiteTable(path)
+
+    from clinic_app.backend.csv_files import CSVFile
+
+    return CSVFile(path)
+
+
+def get_database(path: Optional[str] = None) -> Database | SQLiteDatabase:
+    """Get interface of patients database in configured backend."""
+    if get_backend() == "sqlite":
+        from clinic_app.backend.sqlite import SQLiteDatabase
+
+        return SQLiteDatabase(path)
+
+    from clinic_app.backend.csv_files import Database
+
+    return Database(path)
@@ -0,0 +1,167 @@
+"""Scheduled checks of csv files shared by channels.
+
+A tick reads and joins every csv file once and fans matched rows out to
+channel adapters, so one process can serve both bots. Each bot passes
+its own adapter when it runs alone.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import TYPE_CHECKING, Awaitable, Callable, Iterable, Mapping
+
+from clinic_app.backend.appointments import load_appointments_by_column
+from clinic_app.backend.ledger import get_ledger
+from clinic_app.backend.metrics import (
+    TICK_FINISHED,
+    TICK_INTERVAL_SECONDS,
+    TICK_LAST_SECONDS,
+    TICK_ROWS,
+    TICK_SECONDS,
+    TICK_STARTED,
+)
+from clinic_app.backend.outbound import get_outbound
+from clinic_app.backend.profiling import get_profiler
+from clinic_app.backend.storage import open_csv
+from clinic_app.backend.watcher import get_fallback_minutes, start_watcher
+from clinic_app.shared import CSVS
+from loguru import logger
+from zoneinfo import ZoneInfo
+
+if TYPE_CHECKING:
+    from clinic_app.backend.appointments import Appointment
+    from clinic_app.backend.csv_files import CSVFile
+    from clinic_app.backend.sqlite import SQLiteTable
+
+    Notify = Callable[[Appointment, CSVFile | SQLiteTable], Awaitable[None]]
+
+CHECK_MINUTES = 5
+
+_tick_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True)
+class ChannelAdapter:
+    """Notifications of matched appointments in one channel.
+
+    Parameters
+    ----------
+    channel : str
+        `telegram` or `whatsapp`, label of metrics.
+    user_column : str
+        column of patients database with user ids of the channel.
+    notifiers : Mapping[str, Notify]
+        keys of csv files in `CSVS` to notification senders.
+
+    """
+
+    channel: str
+    user_column: str
+    notifiers: Mapping[str, Notify]
+
+
+def get_kinds(adapters: Iterable[ChannelAdapter]) -> list[str]:
+    """Get keys of csv files checked for any of adapters."""
+    kinds: dict[str, None] = {}
+    for adapter in adapters:
+        kinds.update(dict.fromkeys(adapter.notifiers))
+    return list(kinds)
+
+
+async def run_tick(
+    adapters: list[ChannelAdapter], kinds: Iterable[str]
+) -> None:
+    """Queue notifications of csv files and wait until they're sent.
+
+    Parameters
+    ----------
+    adapters : list[ChannelAdapter]
+        channels notified of matched appointments.
+    kinds : Iterable[str]
+        keys of csv files in `CSVS`.
+    """
+    target = "-".join(adapter.channel for adapter in adapters)
+    async with _tick_lock:
+        with get_profiler().profile(f"{target}-tick"):
+            started = time.monotonic()
+            for adapter in adapters:
+                TICK_STARTED.set(time.time(), channel=adapter.channel)
+
+            # Drop expired entries and pick up entries of other processes
+            get_ledger().load()
+            queue = get_outbound()
+
+            for kind in kinds:
+                notified = [a for a in adapters if kind in a.notifiers]
+                if not notified:
+                    continue
+                csv = open_csv(CSVS[kind])
+                matched = load_appointments_by_column(
+                    csv, [adapter.user_column for adapter in notified]
+                )
+                for adapter in notified:
+                    appointments = matched[adapter.user_column]
+                    notify = adapter.notifiers[kind]
+                    TICK_ROWS.inc(
+                        len(appointments), channel=adapter.channel, kind=kind
+                    )
+                    for appointment in appointments:
+                        queue.put(
+                            adapter.channel,
+                            kind,
+                            appointment.start,
+                            partial(notify, appointment, csv),
+                        )
+
+            await queue.join()
+            logger.info(f"Outbound queue: {queue.stats()}")
+
+            duration = time.monotonic() - started
+            for adapter in adapters:
+                TICK_SECONDS.observe(duration, channel=adapter.channel)
+                TICK_LAST_SECONDS.set(duration, channel=adapter.channel)
+                TICK_FINISHED.set(time.time(), channel=adapter.channel)
+
+
+async def schedule_ticks(adapters: list[ChannelAdapter]) -> None:
+    """Check csv files at once and start scheduler of further checks.
+
+    Changed csv files are checked at once if the watcher is enabled, the
+    interval job checks all of them rarely then.
+
+    Parameters
+    ----------
+    adapters : list[ChannelAdapter]
+        channels notified by every tick.
+    """
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+    kinds = get_kinds(adapters)
+
+    async def check_csv(kind: str) -> None:
+        await run_tick(adapters, [kind])
+
+    async def check_csvs() -> None:
+        await run_tick(adapters, kinds)
+
+    await check_csvs()
+    scheduler = AsyncIOScheduler()
+
+    minutes = CHECK_MINUTES
+    files = {kind: CSVS[kind] for kind in kinds}
+    if start_watcher(files, check_csv) is not None:
+        minutes = get_fallback_minutes()
+    for adapter in adapters:
+        TICK_INTERVAL_SECONDS.set(minutes * 60, channel=adapter.channel)
+
+    scheduler.add_job(
+        check_csvs,
+        "interval",
+        timezone=ZoneInfo("Europe/Moscow"),
+        minutes=minutes,
+        max_instances=1,
+    )
+    scheduler.start()
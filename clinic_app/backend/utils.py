@@ -1,4 +1,28 @@
+"""Phone and date normalization of csv values.
+
+pandas is imported by the functions which need it, so regular
+expressions of phones are available without it.
+"""
+
+from __future__ import annotations
+
 import re
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+PHONE_KEY = "phone_key"
+START_COLUMN = "ДатаНачала"
+# Format of start in identities of appointments
+START_KEY_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+_BRACKETS_RE = re.compile(r"[\(\)]")
+_PHONE_RE = re.compile(r"\+*(7|8)\-*(\d{3})\-*(\d{3})\-*(\d{2})\-*(\d{2})")
+_PHONE_REPL = r"7-\2-\3-\4-\5"
+# Same as `_PHONE_RE` without groups for `str.contains`
+_PHONE_MATCH = r"\+*[78]\-*\d{3}\-*\d{3}\-*\d{2}\-*\d{2}"
 
 
 def format_phone(phone: str) -> str:
@@ -7,22 +31,189 @@ def format_phone(phone: str) -> str:
     Parameters
     ----------
     phone : str
-        source phone string.
+        source phone string, numbers are allowed.
 
     Returns
     -------
     str
         formatted phone.
     """
-    phone = re.sub(r"[\(\)]", r"", phone)
+    # Phones of a column with empty cells are read from csv as floats
+    if isinstance(phone, float) and phone.is_integer():
+        phone = int(phone)
+    phone = _BRACKETS_RE.sub("", str(phone))
 
-    pattern = r"\+*(7|8)\-*(\d{3})\-*(\d{3})\-*(\d{2})\-*(\d{2})"
-    if not re.findall(pattern, phone):
+    if not _PHONE_RE.search(phone):
         return
 
-    return re.sub(
-        r"\+*(7|8)\-*(\d{3})\-*(\d{3})\-*(\d{2})\-*(\d{2})",
-        r"7-\2-\3-\4-\5",
-        phone,
+    return _PHONE_RE.sub(_PHONE_REPL, phone)
+
+
+def format_phones(phones: pd.Series) -> pd.Series:
+    """Format every phone of series like `format_phone` does.
+
+    Parameters
+    ----------
+    phones : pd.Series
+        source phones, numbers are allowed.
+
+    Returns
+    -------
+    pd.Series
+        formatted phones, None where phone is invalid.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(phones):
+        phones = phones.astype("Int64")
+
+    phones = phones.astype("string").str.replace(
+        _BRACKETS_RE.pattern, "", regex=True
     )
+    valid = phones.str.contains(_PHONE_MATCH, regex=True, na=False)
+    formatted = phones.str.replace(_PHONE_RE.pattern, _PHONE_REPL, regex=True)
+    return formatted.astype(object).where(valid, None)
+
+
+def fill_phone_keys(df: pd.DataFrame, phone_column: str) -> bool:
+    """Compute missing values of `PHONE_KEY` column in place.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe of csv file.
+    phone_column : str
+        column with source phones.
+
+    Returns
+    -------
+    bool
+        True if dataframe was changed.
+    """
+    if PHONE_KEY not in df.columns:
+        df[PHONE_KEY] = format_phones(df[phone_column])
+        return True
+
+    missing = df[PHONE_KEY].isna() & df[phone_column].notna()
+    if not missing.any():
+        return False
+
+    keys = format_phones(df.loc[missing, phone_column])
+    # Invalid phones have no key, don't report them as a change forever
+    if keys.isna().all():
+        return False
+
+    df[PHONE_KEY] = df[PHONE_KEY].astype(object)
+    df.loc[missing, PHONE_KEY] = keys
+    return True
+
+
+def parse_start(start: Any) -> Optional[datetime]:
+    """Parse `ДатаНачала` value, None if it isn't a date.
+
+    Parameters
+    ----------
+    start : Any
+        ISO 8601 or `dd.mm.yyyy hh:mm` date as in exported csv files.
+
+    Returns
+    -------
+    Optional[datetime]
+        naive datetime of appointment start.
+    """
+    import pandas as pd
+
+    dt = pd.to_datetime(start, format="ISO8601", errors="coerce")
+    if pd.isnull(dt):
+        dt = pd.to_datetime(start, dayfirst=True, errors="coerce")
+    if pd.isnull(dt):
+        return None
+    return dt.to_pydatetime()
+
+
+def parse_starts(starts: pd.Series) -> pd.Series:
+    """Parse every `ДатаНачала` value like `parse_start` does.
+
+    Parameters
+    ----------
+    starts : pd.Series
+        ISO 8601 or `dd.mm.yyyy hh:mm` dates.
+
+    Returns
+    -------
+    pd.Series
+        naive datetimes, NaT where value isn't a date.
+    """
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(starts):
+        return starts
+    parsed = pd.to_datetime(starts, format="ISO8601", errors="coerce")
+    missing = parsed.isna() & starts.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(
+            starts[missing], dayfirst=True, errors="coerce"
+        )
+    return parsed
+
+
+def appointment_key(phone: Any, start: Any) -> Optional[tuple[str, str]]:
+    """Get identity of appointment which doesn't depend on its row.
+
+    Parameters
+    ----------
+    phone : Any
+        `Телефон` value in any format.
+    start : Any
+        `ДатаНачала` value, parsed or as it is in csv file.
+
+    Returns
+    -------
+    Optional[tuple[str, str]]
+        normalized phone and start, None if any of them is invalid.
+    """
+    key = format_phone(phone)
+    start = parse_start(start)
+    if key is None or start is None:
+        return None
+    return key, start.strftime(START_KEY_FORMAT)
+
+
+def appointment_keys(
+    df: pd.DataFrame, phone_column: str = "Телефон"
+) -> pd.Series:
+    """Get identities of every row like `appointment_key` does.
+
+    `PHONE_KEY` column is used when dataframe has it.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        dataframe of appointment csv file.
+    phone_column : str, optional
+        column with source phones, by default `Телефон`.
+
+    Returns
+    -------
+    pd.Series
+        identities indexed like dataframe, None where they're invalid.
+    """
+    import pandas as pd
+
+    if PHONE_KEY in df.columns:
+        phones = df[PHONE_KEY]
+    elif phone_column in df.columns:
+        phones = format_phones(df[phone_column])
+    else:
+        phones = [None] * len(df)
+
+    if START_COLUMN in df.columns:
+        starts = parse_starts(df[START_COLUMN]).dt.strftime(START_KEY_FORMAT)
+    else:
+        starts = [None] * len(df)
 
+    keys = [
+        None if pd.isna(phone) or pd.isna(start) else (phone, start)
+        for phone, start in zip(phones, starts)
+    ]
+    return pd.Series(keys, index=df.index, dtype=object)
@@ -0,0 +1,230 @@
+"""Event-driven trigger of csv files changes by Linux inotify.
+
+Directories of watched files are watched for `IN_CLOSE_WRITE` (file was
+written and closed) and `IN_MOVED_TO` (file was renamed into place, as
+atomic writes do). Events are debounced per file, then the callback is
+called with the key of the changed file. Renames of temporary files of
+`write_atomic` are writes of the bots themselves, e.g. flushed answers,
+they don't trigger the callback.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from clinic_app.backend.locks import is_atomic_temp
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_FALLBACK_MINUTES = 30
+
+_EVENT = struct.Struct("iIII")
+
+Callback = Callable[[str], Awaitable[None]]
+
+_libc: Optional[ctypes.CDLL] = None
+_libc_lock = threading.Lock()
+
+
+def _get_libc() -> Optional[ctypes.CDLL]:
+    global _libc
+
+    with _libc_lock:
+        if _libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            if not hasattr(libc, "inotify_init1"):
+                return None
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            _libc = libc
+    return _libc
+
+
+class CSVWatcher:
+    """Call `callback` with key of csv file after it was changed.
+
+    Files are resolved, so symbolic links in `src_csvs/` are watched by
+    directories of their targets.
+
+    Parameters
+    ----------
+    files : dict[str, str]
+        key to path mapping, e.g. items of `CSVS`.
+    callback : Callback
+        coroutine function called with key of changed file.
+    debounce : float, optional
+        Seconds without events before callback is called,
+        by default `DEFAULT_DEBOUNCE`.
+
+    """
+
+    def __init__(
+        self,
+        files: dict[str, str],
+        callback: Callback,
+        debounce: float = DEFAULT_DEBOUNCE,
+    ) -> None:
+        self.callback = callback
+        self.debounce = debounce
+        self._files: dict[tuple[int, str], str] = {}
+        self._pending: dict[str, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._fd = -1
+
+        libc = _get_libc()
+        if libc is None:
+            raise OSError("inotify isn't supported by the platform")
+
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+
+        watches: dict[Path, int] = {}
+        for key, path in files.items():
+            resolved = Path(path).resolve()
+            directory = resolved.parent
+            if directory not in watches:
+                wd = libc.inotify_add_watch(
+                    fd,
+                    bytes(directory),
+                    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO,
+                )
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    self.close()
+                    raise OSError(errno, f"Can't watch {directory}")
+                watches[directory] = wd
+            self._files[(watches[directory], resolved.name)] = key
+
+    def start(self) -> None:
+        """Start reading events in the running event loop."""
+        asyncio.get_running_loop().add_reader(self._fd, self._read)
+
+    def close(self) -> None:
+        """Stop reading events and close inotify descriptor."""
+        if self._fd < 0:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._fd)
+        except RuntimeError:
+            pass
+        for handle in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+        os.close(self._fd)
+        self._fd = -1
+
+    def _read(self) -> None:
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+
+        # Cookies of renames of our temporary files. Both events of a
+        # rename are queued together, a cookie without IN_MOVED_TO (the
+        # file was moved out of the directory) is forgotten with the batch
+        own_moves: set[int] = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, cookie, length = _EVENT.unpack_from(buffer, offset)
+            offset += _EVENT.size
+            # Names which aren't UTF-8 are kept as `Path` keeps them
+            name = os.fsdecode(buffer[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, every file could change
+                for key in set(self._files.values()):
+                    self._schedule(key)
+                continue
+
+            if mask & IN_MOVED_FROM:
+                if self._is_own_temp(wd, name):
+                    own_moves.add(cookie)
+                continue
+            if mask & IN_MOVED_TO and cookie in own_moves:
+                own_moves.discard(cookie)
+                continue
+
+            key = self._files.get((wd, name))
+            if key is not None:
+                self._schedule(key)
+
+    def _is_own_temp(self, wd: int, name: str) -> bool:
+        return any(
+            is_atomic_temp(name, target)
+            for watch, target in self._files
+            if watch == wd
+        )
+
+    def _schedule(self, key: str) -> None:
+        handle = self._pending.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._pending[key] = loop.call_later(self.debounce, self._fire, key)
+
+    def _fire(self, key: str) -> None:
+        self._pending.pop(key, None)
+        logger.info(f"Csv file {key} was changed")
+        task = asyncio.create_task(self.callback(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).error(
+                "Tick of changed csv file failed"
+            )
+
+
+def start_watcher(
+    files: dict[str, str], callback: Callback
+) -> Optional[CSVWatcher]:
+    """Start watcher configured by `watcher` section of config.yml.
+
+    Returns
+    -------
+    Optional[CSVWatcher]
+        started watcher, None if it's disabled or isn't supported.
+    """
+    cfg = get_config().get("watcher") or {}
+    if not cfg.get("enabled", False):
+        return None
+
+    try:
+        watcher = CSVWatcher(
+            files, callback, debounce=cfg.get("debounce", DEFAULT_DEBOUNCE)
+        )
+    except OSError as e:
+        logger.warning(f"Csv files aren't watched: {e}")
+        return None
+
+    watcher.start()
+    return watcher
+
+
+def get_fallback_minutes() -> int:
+    """Get interval of full checks when watcher is running."""
+    cfg = get_config().get("watcher") or {}
+    return cfg.get("fallback_minutes", DEFAULT_FALLBACK_MINUTES)
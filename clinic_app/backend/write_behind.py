@@ -0,0 +1,320 @@
+"""Write-behind engine for cell updates of csv files.
+
+Updates are appended to a journal next to the csv file and fsynced, then
+merged in memory and applied to the csv file by a single locked atomic
+rewrite. Updates of appointments keep their identity, so they're applied
+to the same appointment after the file is exported again with other rows.
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import pandas as pd
+from clinic_app.backend.locks import bump_version, file_lock, write_csv_atomic
+from clinic_app.backend.utils import appointment_keys
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+DEFAULT_FLUSH_INTERVAL_MS = 500
+DEFAULT_FLUSH_MAX_UPDATES = 100
+# Max seconds between retries of a failed flush
+MAX_RETRY_DELAY = 60
+
+_engines: dict[str, WriteBehindEngine] = {}
+_engines_lock = threading.Lock()
+
+# Row index, identity of appointment of `appointment_key` and column
+Cell = tuple[int, Optional[tuple[str, str]], str]
+
+
+def _to_builtin(value: Any) -> Any:
+    """Convert numpy scalar to builtin python type for json."""
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+class WriteBehindEngine:
+    """Coalescing write-behind layer for one csv file.
+
+    Parameters
+    ----------
+    path : str
+        Path to csv file.
+    flush_interval_ms : int, optional
+        Max time between first pending update and rewrite of the file,
+        by default `DEFAULT_FLUSH_INTERVAL_MS`.
+    flush_max_updates : int, optional
+        Count of pending updates that triggers rewrite immediately,
+        by default `DEFAULT_FLUSH_MAX_UPDATES`.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS,
+        flush_max_updates: int = DEFAULT_FLUSH_MAX_UPDATES,
+    ) -> None:
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_updates = flush_max_updates
+
+        self._lock = threading.RLock()
+        self._pending: dict[Cell, Any] = {}
+        self._updates_count = 0
+        self._timer: Optional[threading.Timer] = None
+        self._failures = 0
+
+        self.replay()
+
+    @property
+    def pending(self) -> int:
+        """Count of merged cell updates that are not in csv file yet."""
+        return len(self._pending)
+
+    def update(
+        self,
+        index: int,
+        values: dict[str, Any],
+        key: Optional[tuple[str, str]] = None,
+    ) -> None:
+        """Log cell updates of one row and schedule rewrite.
+
+        Parameters
+        ----------
+        index : int
+            Row index in the csv file when it was read.
+        values : dict[str, Any]
+            Column name to new value mapping.
+        key : Optional[tuple[str, str]], optional
+            `appointment_key` of the row. If it's set, the update is
+            applied to the row of the appointment wherever it's in the
+            file and dropped when the file hasn't it, by default the row
+            is found by index.
+        """
+        index = int(index)
+        key = None if key is None else tuple(key)
+        values = {col: _to_builtin(value) for col, value in values.items()}
+
+        with self._lock:
+            self._append_journal(index, key, values)
+            for column, value in values.items():
+                self._pending[(index, key, column)] = value
+            self._updates_count += 1
+
+            if self._updates_count >= self.flush_max_updates:
+                self.flush()
+            elif self._timer is None:
+                self._schedule(self.flush_interval)
+
+    def apply(
+        self,
+        df: pd.DataFrame,
+        updates: Optional[dict[Cell, Any]] = None,
+    ) -> pd.DataFrame:
+        """Return dataframe with updates applied.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            dataframe read from the csv file, or a chunk of it.
+        updates : Optional[dict[Cell, Any]], optional
+            (row index, appointment key, column) to value mapping, by
+            default pending updates of this process.
+
+        Returns
+        -------
+        pd.DataFrame
+            dataframe with updates applied.
+        """
+        if updates is None:
+            with self._lock:
+                updates = dict(self._pending)
+
+        if not updates:
+            return df
+
+        rows = _Rows(df)
+        for (index, key, column), value in updates.items():
+            index = rows.find(index, key)
+            if index is None:
+                continue
+            try:
+                df.at[index, column] = value
+            except (TypeError, ValueError):
+                # Column dtype can't hold the value (e.g. text in float)
+                df[column] = df[column].astype(object)
+                df.at[index, column] = value
+        return df
+
+    def flush(self, force: bool = False) -> None:
+        """Apply journaled updates to csv file by a single rewrite.
+
+        The journal is shared by all processes working with the file, so
+        the rewrite applies updates of other processes too.
+
+        Parameters
+        ----------
+        force : bool, optional
+            Flush journal even if this process has no pending updates,
+            by default False.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._pending and not force:
+                return
+
+            try:
+                with file_lock(self.path):
+                    updates = self._read_journal()
+                    if updates:
+                        df = self.apply(pd.read_csv(self.path), updates)
+                        write_csv_atomic(df, self.path)
+                        bump_version(self.path)
+                        self._truncate_journal()
+            except Exception as e:
+                # Updates stay in the journal until a retry succeeds
+                self._failures += 1
+                delay = min(
+                    self.flush_interval * 2**self._failures, MAX_RETRY_DELAY
+                )
+                logger.opt(exception=e).error(
+                    f"Updates of {self.path} weren't written, "
+                    f"retry in {delay}s"
+                )
+                self._schedule(delay, force)
+                return
+
+            self._pending.clear()
+            self._updates_count = 0
+            self._failures = 0
+
+    def _schedule(self, delay: float, force: bool = False) -> None:
+        self._timer = threading.Timer(delay, self.flush, (force,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def replay(self) -> None:
+        """Apply updates from journal left by previous run."""
+        journal = Path(self.journal_path)
+        if not journal.exists() or not journal.stat().st_size:
+            return
+
+        logger.info(f"Replaying updates from {self.journal_path}")
+        self.flush(force=True)
+
+    def _read_journal(self) -> dict[Cell, Any]:
+        updates = {}
+        if not Path(self.journal_path).exists():
+            return updates
+
+        with open(self.journal_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn write of the last line
+                    break
+                # Journals of old versions have no keys
+                key = entry.get("key")
+                if key is not None:
+                    key = tuple(key)
+                for column, value in entry["values"].items():
+                    updates[(entry["index"], key, column)] = value
+        return updates
+
+    def _append_journal(
+        self,
+        index: int,
+        key: Optional[tuple[str, str]],
+        values: dict[str, Any],
+    ) -> None:
+        entry = {"index": index, "key": key, "values": values}
+        line = json.dumps(entry, ensure_ascii=False)
+        with (
+            file_lock(self.path),
+            open(self.journal_path, "a", encoding="utf-8") as f,
+        ):
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_journal(self) -> None:
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class _Rows:
+    """Finder of rows of updates in dataframe.
+
+    Identities of all rows are computed once, only if some row at index
+    of an update isn't its appointment.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+        self._positions: Optional[dict[tuple[str, str], int]] = None
+
+    def find(
+        self, index: int, key: Optional[tuple[str, str]]
+    ) -> Optional[int]:
+        """Get index of row of update, None if dataframe hasn't it."""
+        if key is None:
+            return index if index in self.df.index else None
+
+        if index in self.df.index:
+            if appointment_keys(self.df.loc[[index]]).iloc[0] == key:
+                return index
+
+        if self._positions is None:
+            self._positions = {
+                row_key: row
+                for row, row_key in appointment_keys(self.df).items()
+                if row_key is not None
+            }
+        return self._positions.get(key)
+
+
+def _get_settings() -> dict[str, int]:
+    try:
+        cfg = get_config()["database"]["csv"].get("write_behind") or {}
+    except Exception:
+        cfg = {}
+
+    return {
+        "flush_interval_ms": cfg.get(
+            "flush_interval_ms", DEFAULT_FLUSH_INTERVAL_MS
+        ),
+        "flush_max_updates": cfg.get(
+            "flush_max_updates", DEFAULT_FLUSH_MAX_UPDATES
+        ),
+    }
+
+
+def get_engine(path: str) -> WriteBehindEngine:
+    """Get process-wide write-behind engine for csv file."""
+    key = str(Path(path).resolve())
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = WriteBehindEngine(path, **_get_settings())
+    return engine
+
+
+@atexit.register
+def flush_all() -> None:
+    """Flush pending updates of all engines."""
+    for engine in list(_engines.values()):
+        engine.flush()
@@ -0,0 +1 @@
+"""Package for work with telegram and whatsapp bots in one process."""
@@ -0,0 +1,75 @@
+"""Telegram and whatsapp bots in one process.
+
+Every tick reads and joins csv files once for both channels, storages,
+the outbound queue, the ledger of sent notifications and metrics are
+shared. The bots can still run as separate processes by their own
+`main` modules.
+"""
+
+import asyncio
+import logging
+
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.backend.metrics import FSM_STATES, start_metrics_server
+from clinic_app.backend.ticks import schedule_ticks
+from clinic_app.frontend.telegram_bot import app as telegram_app
+from clinic_app.frontend.telegram_bot import main as telegram_main
+from clinic_app.frontend.whatsapp_bot import app as whatsapp_app
+from clinic_app.frontend.whatsapp_bot import main as whatsapp_main
+from clinic_app.frontend.whatsapp_bot.states import get_fsm
+from clinic_app.shared.config import get_config
+
+
+async def main() -> None:
+    """Entrypoint of both bots."""
+    from clinic_app.frontend.telegram_bot import scheduler as telegram
+    from clinic_app.frontend.whatsapp_bot import scheduler as whatsapp
+
+    logging.basicConfig(level=logging.INFO)
+    config = get_config()
+    tg = telegram_app.create_app(config)
+    wa = whatsapp_app.create_app(config)
+    FSM_STATES.add_collector(telegram_main.fsm_state_counts)
+    FSM_STATES.add_collector(whatsapp_main.fsm_state_counts)
+    metrics = await start_metrics_server("combined")
+
+    fsm = get_fsm()
+    fsm.load()
+    snapshots = asyncio.create_task(whatsapp_main.snapshot_fsm())
+
+    deferred = get_deferred()
+    # Workers of the telegram bot send deferred messages of their users
+    if not tg.workers:
+        deferred.register("telegram", telegram_main.send_deferred)
+    deferred.register("whatsapp", wa.client.send_message)
+    deferred.start()
+
+    # The first tick lasts until reminders of both channels are sent,
+    # whatsapp replies mustn't wait for the rate limit of telegram
+    await whatsapp_main.prepare_bot()
+    receivers = [
+        asyncio.create_task(telegram_main.receive_updates(tg)),
+        asyncio.create_task(whatsapp_main.keep_alive()),
+    ]
+    try:
+        await schedule_ticks([telegram.ADAPTER, whatsapp.ADAPTER])
+        # Telegram stops on SIGINT and SIGTERM, then whatsapp stops too
+        done, _ = await asyncio.wait(
+            receivers, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            task.result()
+    finally:
+        for task in receivers:
+            task.cancel()
+        await asyncio.gather(*receivers, return_exceptions=True)
+        snapshots.cancel()
+        fsm.snapshot()
+        await deferred.stop()
+        await wa.client.close()
+        if metrics is not None:
+            await metrics.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Factory of the telegram bot application.
+
+Nothing is created on import: `create_app` builds the bot, its FSM
+storage and dispatcher from config, aiogram and handlers are imported by
+it. Schedulers and FSM helpers get the current application by
+`get_app`. Worker processes of the supervisor create the same
+application, then FSM storage and rate limit are shared by processes.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+from clinic_app.shared.config import get_config
+
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
+    from clinic_app.frontend.telegram_bot.fsm_storage import SQLiteStorage
+
+_app: Optional[TelegramApp] = None
+_app_lock = threading.Lock()
+
+
+@dataclass
+class TelegramApp:
+    """Objects of running telegram bot.
+
+    Parameters
+    ----------
+    config : Mapping[str, Any]
+        Config the application was created from.
+    bot : Bot
+        Bot with rate limited session.
+    dp : Dispatcher
+        Dispatcher with registered handlers.
+    storage : SQLiteStorage
+        FSM storage of the dispatcher.
+    workers : int, optional
+        Worker processes handling updates, 0 if they're handled by the
+        dispatcher of this process, by default 0.
+
+    """
+
+    config: Mapping[str, Any]
+    bot: Bot
+    dp: Dispatcher
+    storage: SQLiteStorage
+    workers: int = 0
+
+
+def _build_app(config: Mapping[str, Any]) -> TelegramApp:
+    from aiogram import Bot, Dispatcher
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.fsm.storage.memory import SimpleEventIsolation
+    from clinic_app.frontend.telegram_bot.fsm_storage import (
+        DEFAULT_CACHE_SIZE,
+        DEFAULT_FSM_PATH,
+        DEFAULT_TTL_HOURS,
+        SQLiteStorage,
+    )
+    from clinic_app.frontend.telegram_bot.handlers import register_handlers
+    from clinic_app.frontend.telegram_bot.middlewares import (
+        ProfilingMiddleware,
+    )
+    from clinic_app.frontend.telegram_bot.supervisor import DEFAULT_WORKERS
+    from clinic_app.frontend.telegram_bot.throttling import (
+        DEFAULT_CHAT_BURST,
+        DEFAULT_CHAT_RATE,
+        DEFAULT_GLOBAL_RATE,
+        DEFAULT_MAX_RETRIES,
+        DEFAULT_RETRY_BACKOFF,
+        DEFAULT_SHARED_PATH,
+        RateLimitMiddleware,
+    )
+
+    cfg = config["telegram_bot"]
+    supervisor = cfg.get("supervisor") or {}
+    workers = supervisor.get("workers", DEFAULT_WORKERS)
+
+    # Bot API server, e.g. a local stand-in in load tests
+    api_url = cfg.get("api_url")
+    session = None
+    if api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+
+    bot = Bot(
+        token=cfg["token"],
+        session=session,
+        default=DefaultBotProperties(parse_mode="MarkdownV2"),
+    )
+
+    rate_limit = cfg.get("rate_limit") or {}
+    bot.session.middleware(
+        RateLimitMiddleware(
+            global_rate=rate_limit.get("global_rate", DEFAULT_GLOBAL_RATE),
+            chat_rate=rate_limit.get("chat_rate", DEFAULT_CHAT_RATE),
+            chat_burst=rate_limit.get("chat_burst", DEFAULT_CHAT_BURST),
+            max_retries=rate_limit.get("max_retries", DEFAULT_MAX_RETRIES),
+            retry_backoff=rate_limit.get(
+                "retry_backoff", DEFAULT_RETRY_BACKOFF
+            ),
+            # The supervisor and workers send messages of one bot
+            shared_path=(
+                rate_limit.get("shared_path", DEFAULT_SHARED_PATH)
+                if workers
+                else None
+            ),
+        )
+    )
+
+    fsm = cfg.get("fsm") or {}
+    storage = SQLiteStorage(
+        path=fsm.get("path", DEFAULT_FSM_PATH),
+        ttl=fsm.get("ttl_hours", DEFAULT_TTL_HOURS) * 3600,
+        cache_size=fsm.get("cache_size", DEFAULT_CACHE_SIZE),
+        shared=workers > 0,
+    )
+    # Updates of one chat are handled one by one, a handler could clear
+    # the state between the state and data reads of another one otherwise
+    dp = Dispatcher(storage=storage, events_isolation=SimpleEventIsolation())
+    dp.message.middleware(ProfilingMiddleware())
+    register_handlers(dp)
+
+    return TelegramApp(
+        config=config, bot=bot, dp=dp, storage=storage, workers=workers
+    )
+
+
+def create_app(config: Optional[Mapping[str, Any]] = None) -> TelegramApp:
+    """Create telegram bot application and make it the current one.
+
+    Parameters
+    ----------
+    config : Optional[Mapping[str, Any]], optional
+        Parsed config.yml, by default `get_config()`.
+
+    Returns
+    -------
+    TelegramApp
+        created application.
+    """
+    global _app
+
+    app = _build_app(get_config() if config is None else config)
+    with _app_lock:
+        _app = app
+    return app
+
+
+def get_app() -> TelegramApp:
+    """Get current application, it's created from config.yml if none."""
+    global _app
+
+    with _app_lock:
+        if _app is None:
+            _app = _build_app(get_config())
+        return _app
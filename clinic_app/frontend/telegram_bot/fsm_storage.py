@@ -0,0 +1,221 @@
+"""SQLite storage of FSM states and data of the telegram bot.
+
+Records are kept in a SQLite table, so conversations survive restarts,
+and recently used records are cached in memory. Records which weren't
+updated for `ttl` seconds are treated as missing and purged. A storage
+shared by processes, e.g. by worker processes of the supervisor, reads
+every record from the table and changes it in a transaction.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Iterator, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+DEFAULT_FSM_PATH = "src_csvs/telegram_fsm.sqlite3"
+DEFAULT_TTL_HOURS = 72
+DEFAULT_CACHE_SIZE = 1024
+# Seconds between purges of expired records
+PURGE_INTERVAL = 3600
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram storage backed by SQLite with LRU cache in front.
+
+    Data must be json serializable, so handlers keep compact keys in it
+    (kind of csv file and appointment values) instead of objects.
+
+    Parameters
+    ----------
+    path : str
+        Path to SQLite database.
+    ttl : float, optional
+        Seconds after last update when record expires,
+        by default `DEFAULT_TTL_HOURS` hours.
+    cache_size : int, optional
+        Max count of cached records, by default `DEFAULT_CACHE_SIZE`.
+    shared : bool, optional
+        Records are changed by other processes too, so nothing is cached,
+        by default False.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = DEFAULT_TTL_HOURS * 3600,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        shared: bool = False,
+    ) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.shared = shared
+        self.cache_size = 0 if shared else cache_size
+        self._cache: OrderedDict[str, tuple[Optional[str], str, float]] = (
+            OrderedDict()
+        )
+        self._purged = 0.0
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated)"
+        )
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return (
+            f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:"
+            f"{key.business_connection_id}:{key.destiny}"
+        )
+
+    def _read(self, key: str) -> tuple[Optional[str], str]:
+        now = time.time()
+        record = self._cache.get(key)
+        if record is None:
+            record = self._conn.execute(
+                "SELECT state, data, updated FROM fsm WHERE key = ?", (key,)
+            ).fetchone()
+            if record is None:
+                return None, "{}"
+            self._remember(key, record)
+        else:
+            self._cache.move_to_end(key)
+
+        state, data, updated = record
+        if now - updated > self.ttl:
+            self._write(key, None, "{}")
+            return None, "{}"
+        return state, data
+
+    def _write(self, key: str, state: Optional[str], data: str) -> None:
+        now = time.time()
+        if state is None and data == "{}":
+            self._cache.pop(key, None)
+            self._conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            self._remember(key, (state, data, now))
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, data, updated) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "state = excluded.state, data = excluded.data, "
+                "updated = excluded.updated",
+                (key, state, data, now),
+            )
+
+        if now - self._purged > PURGE_INTERVAL:
+            self.purge()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """Make read and write of a record atomic for other processes."""
+        if not self.shared:
+            yield
+            return
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def _remember(
+        self, key: str, record: tuple[Optional[str], str, float]
+    ) -> None:
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def purge(self) -> int:
+        """Delete expired records and return their count."""
+        self._purged = now = time.time()
+        expired = [
+            key
+            for key, (_, _, updated) in self._cache.items()
+            if now - updated > self.ttl
+        ]
+        for key in expired:
+            del self._cache[key]
+        cursor = self._conn.execute(
+            "DELETE FROM fsm WHERE updated < ?", (now - self.ttl,)
+        )
+        return cursor.rowcount
+
+    def state_counts(self) -> dict[str, int]:
+        """Get count of live records by state."""
+        rows = self._conn.execute(
+            "SELECT state, COUNT(*) FROM fsm "
+            "WHERE state IS NOT NULL AND updated >= ? GROUP BY state",
+            (time.time() - self.ttl,),
+        ).fetchall()
+        return dict(rows)
+
+    def count(self) -> int:
+        """Get count of stored records.
+
+        It isn't `__len__`, an empty storage would be falsy and aiogram
+        replaces falsy storage of `Dispatcher` by `MemoryStorage`.
+        """
+        return self._conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+
+    async def set_state(
+        self, key: StorageKey, state: StateType = None
+    ) -> None:
+        if isinstance(state, State):
+            state = state.state
+        storage_key = self._key(key)
+        with self._transaction():
+            _, data = self._read(storage_key)
+            self._write(storage_key, state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = self._read(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                "Data must be a dict or dict-like object, "
+                f"got {type(data).__name__}"
+            )
+        storage_key = self._key(key)
+        data = json.dumps(data, ensure_ascii=False)
+        with self._transaction():
+            state, _ = self._read(storage_key)
+            self._write(storage_key, state, data)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = self._read(self._key(key))
+        return json.loads(data)
+
+    async def update_data(
+        self, key: StorageKey, data: Mapping[str, Any]
+    ) -> dict[str, Any]:
+        storage_key = self._key(key)
+        with self._transaction():
+            state, current = self._read(storage_key)
+            current = {**json.loads(current), **data}
+            self._write(
+                storage_key, state, json.dumps(current, ensure_ascii=False)
+            )
+        return current
+
+    async def close(self) -> None:
+        self._conn.close()
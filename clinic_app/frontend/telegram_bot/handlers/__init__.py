@@ -1,17 +1,15 @@
 """Handlers for telegram bot."""
 
-import asyncio
-from datetime import datetime, timedelta
-from typing import TYPE_CHECKING
+from datetime import datetime
 
-from aiogram import Bot
+from aiogram import Bot, Dispatcher
 from aiogram.filters.command import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardRemove
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from clinic_app.backend.csv_files import CSVFile, Database
+from clinic_app.backend.appointments import Appointment
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.backend.storage import get_database, open_csv
 from clinic_app.backend.utils import format_phone
-from clinic_app.frontend.telegram_bot.constants import dp
 from clinic_app.frontend.telegram_bot.keyboard.reply import yes_no
 from clinic_app.frontend.telegram_bot.keyboard.reply.phone import (
     get_phone_markup,
@@ -21,22 +19,27 @@ from clinic_app.shared import CSVS
 from loguru import logger
 from zoneinfo import ZoneInfo
 
-if TYPE_CHECKING:
-    import pandas as pd
-
 
 MANAGER_ID = 195305791
-
-
-def register_handlers() -> None:
-    """View handlers and report it into log message."""
+# Delays of deferred messages in seconds
+RESCHEDULING_DELAY = 15 * 60
+REVIEW_DELAY = 2
+
+
+def register_handlers(dp: Dispatcher) -> None:
+    """Register handlers in dispatcher and report it into log message."""
+    dp.message.register(on_start, CommandStart())
+    dp.message.register(get_phone, UserStates.get_phone)
+    dp.message.register(notify_tommorow_dialog, UserStates.notify_tommorow)
+    dp.message.register(reschedule, UserStates.rescheduling)
+    dp.message.register(review, UserStates.review)
+    dp.message.register(get_review, UserStates.get_review)
     logger.info("Handlers have been successfully registered!")
 
 
-@dp.message(CommandStart())
 async def on_start(msg: Message, state: FSMContext) -> None:
     """Entrypoint of the bot."""
-    db = Database()
+    db = get_database()
     if db.value_exists(msg.from_user.id, "tg_user_id"):
         await msg.answer(
             "Вы уже зарегистрированы в системе. Мы вам напомним о вашей "
@@ -54,25 +57,19 @@ async def on_start(msg: Message, state: FSMContext) -> None:
     )
 
 
-@dp.message(UserStates.get_phone)
 async def get_phone(msg: Message, state: FSMContext) -> None:
     """Get phone from user."""
     if not msg.contact:
         await msg.answer("Вы не отправили свой номер телефона")
         return
 
-    phone = msg.contact.phone_number
-    db = Database()
-
-    if not db.value_exists(phone, "phone"):
-        df = db.get_df()
-        row = {
-            "phone": format_phone(phone),
-            "tg_user_id": msg.from_user.id,
-            "tg_username": msg.from_user.username,
-        }
-        df.loc[len(df)] = row
-        df.to_csv(db.path, index=False)
+    row = {
+        "phone": format_phone(msg.contact.phone_number),
+        "tg_user_id": msg.from_user.id,
+        "tg_username": msg.from_user.username,
+    }
+    # Nothing is added if the phone is registered
+    get_database().add_row(row)
 
     await msg.answer(
         r"Ваш номер телефона сохранен\. Мы вам напомним о вашей записи",
@@ -81,7 +78,6 @@ async def get_phone(msg: Message, state: FSMContext) -> None:
     await state.clear()
 
 
-@dp.message(UserStates.notify_tommorow)
 async def notify_tommorow_dialog(msg: Message, state: FSMContext) -> None:
     """Remind me the day before your appointment."""
     if msg.text not in ["Да", "Нет"]:
@@ -89,25 +85,21 @@ async def notify_tommorow_dialog(msg: Message, state: FSMContext) -> None:
         return
 
     data = await state.get_data()
-    info: pd.Series = data["info_data"]
-    csv: CSVFile = data["csv"]
+    info = Appointment.from_list(data["info_data"])
+    csv = open_csv(CSVS[data["kind"]])
 
     if msg.text == "Да":
-        df = csv.get_df()
-        df.loc[info.name, "Подтверждение"] = 1
-        df.to_csv(csv.path, index=False)
+        csv.update_cells(info.index, {"Подтверждение": 1}, info.key)
 
         await msg.answer(
-            f"Отлично! Ждем вас в <b>{info["ДатаНачала"]}</b>",
+            f"Отлично! Ждем вас в <b>{info.start_text}</b>",
             parse_mode="HTML",
             reply_markup=ReplyKeyboardRemove(),
         )
         await state.clear()
 
     elif msg.text == "Нет":
-        df = csv.get_df()
-        df.loc[info.name, "Подтверждение"] = -1
-        df.to_csv(csv.path, index=False)
+        csv.update_cells(info.index, {"Подтверждение": -1}, info.key)
 
         reply_markup = yes_no().as_markup(resize_keyboard=True)
 
@@ -119,12 +111,6 @@ async def notify_tommorow_dialog(msg: Message, state: FSMContext) -> None:
         await state.set_state(UserStates.rescheduling)
 
 
-async def notify_rescheduling(msg: Message, text: str) -> None:
-    """Call this function by the scheduler."""
-    await msg.answer(text, parse_mode=None)
-
-
-@dp.message(UserStates.rescheduling)
 async def reschedule(msg: Message, state: FSMContext, bot: Bot) -> None:
     """
     Conversation with the user about rescheduling an appointment with
@@ -135,14 +121,13 @@ async def reschedule(msg: Message, state: FSMContext, bot: Bot) -> None:
         return
 
     data = await state.get_data()
-    info: pd.Series = data["info_data"]
-    csv: CSVFile = data["csv"]
+    info = Appointment.from_list(data["info_data"])
+    csv = open_csv(CSVS[data["kind"]])
 
     if msg.text == "Да":
-        df = csv.get_df()
-        df.loc[info.name, "Перезапись"] = 1
-        df.loc[info.name, "Подтверждение"] = -1
-        df.to_csv(csv.path, index=False)
+        csv.update_cells(
+            info.index, {"Перезапись": 1, "Подтверждение": -1}, info.key
+        )
 
         await msg.answer("Скоро вам позвонит менеджер для перезаписи")
 
@@ -156,8 +141,8 @@ async def reschedule(msg: Message, state: FSMContext, bot: Bot) -> None:
         await bot.send_message(MANAGER_ID, text, parse_mode="HTML")
 
         client_id = "1377cb96-cf0b-4599-a213-67315c8c1966"
-        doctor_id = info["ИДВрач"]
-        clinic_id = info["ИДФилиал"]
+        doctor_id = info.doctor_id
+        clinic_id = info.clinic_id
         url = (
             "https://medapi.1cbit.ru/online_record"
             f"/client/{client_id}/doctor/{doctor_id}?clinic={clinic_id}"
@@ -168,24 +153,15 @@ async def reschedule(msg: Message, state: FSMContext, bot: Bot) -> None:
             reply_markup=ReplyKeyboardRemove(),
         )
 
-        schedule_date = datetime.now() + timedelta(minutes=15)
-        sch = AsyncIOScheduler()
-        text = (
-            "Если у вас не получилось записаться онлайн вы можете "
-            "записаться по номеру телефона: 123456"
+        get_deferred().schedule(
+            "telegram",
+            msg.chat.id,
+            "rescheduling_phone",
+            delay=RESCHEDULING_DELAY,
         )
-        sch.add_job(
-            notify_rescheduling,
-            "date",
-            run_date=schedule_date,
-            args=(msg, text),
-        )
-        sch.start()
 
     elif msg.text == "Нет":
-        df = csv.get_df()
-        df.loc[info.name, "Перезапись"] = -1
-        df.to_csv(csv.path, index=False)
+        csv.update_cells(info.index, {"Перезапись": -1}, info.key)
 
         await msg.answer(
             "Спасибо, что предупредили, будем вас ждать!",
@@ -196,7 +172,6 @@ async def reschedule(msg: Message, state: FSMContext, bot: Bot) -> None:
     await state.clear()
 
 
-@dp.message(UserStates.review)
 async def review(msg: Message, state: FSMContext) -> None:
     """Converstation with user about his feedback and review."""
     if msg.text not in list(map(str, range(1, 5 + 1))):
@@ -211,19 +186,14 @@ async def review(msg: Message, state: FSMContext) -> None:
         )
 
         data = await state.get_data()
-        reviews = CSVFile(CSVS["reviews"])
-
-        row: pd.Series = data["row"]
-        reviews.find_and_replace(
-            search_value_column_name="Телефон",
-            search_value=row["Телефон"],
-            new_value_column_name="Отзыв",
-            new_value=msg.text,
-            save=True,
-        )
+        reviews = open_csv(CSVS["reviews"])
 
-        await asyncio.sleep(2)
-        await msg.answer("Спасибо вам большое за отзыв!", parse_mode=None)
+        row = Appointment.from_list(data["row"])
+        reviews.update_cells(row.index, {"Отзыв": msg.text}, row.key)
+
+        get_deferred().schedule(
+            "telegram", msg.chat.id, "review_thanks", delay=REVIEW_DELAY
+        )
         await state.clear()
 
     else:
@@ -236,12 +206,11 @@ async def review(msg: Message, state: FSMContext) -> None:
         await state.set_state(UserStates.get_review)
 
 
-@dp.message(UserStates.get_review)
 async def get_review(msg: Message, state: FSMContext, bot: Bot) -> None:
     """Get full negative review from user and write it to csv file."""
     data = await state.get_data()
-    db = Database()
-    reviews = CSVFile(CSVS["reviews"])
+    db = get_database()
+    reviews = open_csv(CSVS["reviews"])
 
     date = datetime.now().astimezone(ZoneInfo("Europe/Moscow")).date()
     phone = db.get_value_by_kv(
@@ -259,15 +228,11 @@ async def get_review(msg: Message, state: FSMContext, bot: Bot) -> None:
     )
     await bot.send_message(MANAGER_ID, text, parse_mode="HTML")
 
-    row: pd.Series = data["row"]
-    reviews.find_and_replace(
-        search_value_column_name="Телефон",
-        search_value=row["Телефон"],
-        new_value_column_name="Отзыв",
-        new_value=review,
-        save=True,
-    )
+    row = Appointment.from_list(data["row"])
+    reviews.update_cells(row.index, {"Отзыв": review}, row.key)
 
-    await asyncio.sleep(1.5)
-    await msg.answer("Спасибо вам большое за отзыв!", parse_mode=None)
+    get_deferred().schedule(
+        "telegram", msg.chat.id, "review_thanks", delay=REVIEW_DELAY
+    )
     await state.clear()
+
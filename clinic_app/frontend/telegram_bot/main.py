@@ -1,21 +1,105 @@
+from __future__ import annotations
+
+import asyncio
 import logging
+from typing import TYPE_CHECKING
+
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.backend.metrics import FSM_STATES, start_metrics_server
+from clinic_app.frontend.telegram_bot.app import (
+    TelegramApp,
+    create_app,
+    get_app,
+)
+from clinic_app.shared.config import get_config
+
+if TYPE_CHECKING:
+    from aiogram import Dispatcher
+
+
+async def send_deferred(chat_id: str, text: str) -> None:
+    """Send deferred message, called by the deferred service."""
+    await get_app().bot.send_message(int(chat_id), text, parse_mode=None)
+
+
+def fsm_state_counts() -> dict[tuple[str, str], int]:
+    """Collect dialogs by FSM state for metrics."""
+    counts = get_app().storage.state_counts()
+    return {("telegram", state): count for state, count in counts.items()}
+
+
+async def receive_updates(app: TelegramApp) -> None:
+    """Handle updates until SIGINT or SIGTERM.
+
+    Updates are posted to the webhook server if `telegram_bot.webhook`
+    has an url, polled otherwise. If `telegram_bot.supervisor` has
+    workers, they handle updates routed by the supervisor.
+    """
+    if not app.workers:
+        await _receive(app, app.dp)
+        return
 
-from clinic_app.frontend.telegram_bot.constants import bot, dp
-from clinic_app.frontend.telegram_bot.handlers import register_handlers
-from clinic_app.frontend.telegram_bot.scheduler import start_scheduler
+    from clinic_app.frontend.telegram_bot.supervisor import (
+        WorkerPool,
+        create_router,
+    )
+
+    pool = WorkerPool(app.config["telegram_bot"]["supervisor"])
+    await pool.start()
+    try:
+        # Updates are routed one by one to keep their order
+        await _receive(app, create_router(pool), handle_as_tasks=False)
+    finally:
+        await pool.stop()
+
+
+async def _receive(
+    app: TelegramApp, dp: Dispatcher, handle_as_tasks: bool = True
+) -> None:
+    from clinic_app.frontend.telegram_bot.webhook import run_webhook
+
+    # Updates of types handled by the application
+    allowed_updates = app.dp.resolve_used_update_types()
+    webhook = app.config["telegram_bot"].get("webhook") or {}
+    if webhook.get("url"):
+        await run_webhook(dp, app.bot, webhook, allowed_updates)
+        return
+
+    # Telegram refuses `getUpdates` while a webhook of a previous run is
+    # set, its pending updates are kept
+    await app.bot.delete_webhook()
+    await dp.start_polling(
+        app.bot,
+        handle_as_tasks=handle_as_tasks,
+        allowed_updates=allowed_updates,
+    )
 
 
 async def main() -> None:
     """Entrypoint in telegram bot."""
-    logging.basicConfig(level=logging.INFO)
-    await start_scheduler()
-    register_handlers()
+    from clinic_app.frontend.telegram_bot.scheduler import start_scheduler
 
     logging.basicConfig(level=logging.INFO)
-    await dp.start_polling(bot)
+    app = create_app(get_config())
+    FSM_STATES.add_collector(fsm_state_counts)
+    metrics = await start_metrics_server("telegram")
 
+    deferred = get_deferred()
+    # Workers send deferred messages of their users
+    if not app.workers:
+        deferred.register("telegram", send_deferred)
+    deferred.start()
 
-if __name__ == "__main__":
-    import asyncio
+    # Replies mustn't wait for reminders of the first tick
+    receiver = asyncio.create_task(receive_updates(app))
+    try:
+        await start_scheduler()
+        await receiver
+    finally:
+        receiver.cancel()
+        if metrics is not None:
+            await metrics.cleanup()
 
+
+if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,33 @@
+"""Update middlewares of the telegram bot dispatcher."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from clinic_app.backend.profiling import get_profiler
+
+if TYPE_CHECKING:
+    from aiogram.types import TelegramObject
+
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Profile handlers which are named in `profiling.handlers`.
+
+    It's an inner middleware, so the handler is already selected by
+    filters and its callback name is known.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        profiler = get_profiler()
+        callback = data.get("handler")
+        name = getattr(getattr(callback, "callback", None), "__name__", "")
+        if not profiler.wants_handler(name):
+            return await handler(event, data)
+        with profiler.profile(f"telegram-{name}"):
+            return await handler(event, data)
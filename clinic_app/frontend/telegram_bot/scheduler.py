@@ -1,119 +1,122 @@
 from __future__ import annotations
 
-import asyncio
-from typing import TYPE_CHECKING
+from functools import partial
+from typing import TYPE_CHECKING, Iterable
 
 from aiogram.types import ReplyKeyboardRemove
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-import pandas as pd
-from clinic_app.backend.csv_files import CSVFile, Database
-from clinic_app.backend.utils import format_phone
-from clinic_app.frontend.telegram_bot.constants import bot
+from clinic_app.backend.ledger import send_once
+from clinic_app.backend.ticks import ChannelAdapter, run_tick, schedule_ticks
+from clinic_app.frontend.telegram_bot.app import get_app
 from clinic_app.frontend.telegram_bot.keyboard.reply import yes_no
 from clinic_app.frontend.telegram_bot.states import UserStates, get_fsm
-from clinic_app.shared import CSVS
-from zoneinfo import ZoneInfo
 
 if TYPE_CHECKING:
-    from pandas import Series
+    from clinic_app.backend.appointments import Appointment
+    from clinic_app.backend.csv_files import CSVFile
 
 
-def get_user_id(row: Series) -> int | None:
-    """Get user id from database csv file by phone."""
-    db = Database()
-    phone = format_phone(row["Телефон"])
-    return db.get_value_by_kv(("phone", phone), "tg_user_id")
+CHANNEL = "telegram"
+USER_COLUMN = "tg_user_id"
 
 
-async def check_csvs() -> None:
-    """Check csv and start work with users."""
-    tasks = []
+async def tick(kinds: Iterable[str]) -> None:
+    """Queue notifications of csv files and wait until they're sent.
 
-    tommorow = CSVFile(CSVS["tommorow"])
-    two_hours = CSVFile(CSVS["2hours"])
-    reviews = CSVFile(CSVS["reviews"])
+    Parameters
+    ----------
+    kinds : Iterable[str]
+        keys of csv files in `CSVS`.
+    """
+    await run_tick([ADAPTER], kinds)
 
-    for index, row in tommorow.get_df().iterrows():
-        tasks.append(notify_before_day(row=row, csv=tommorow))
 
-    for index, row in two_hours.get_df().iterrows():
-        tasks.append(notify_before_2hours(row=row, csv=two_hours))
+async def check_csv(kind: str) -> None:
+    """Check one changed csv file, called by the watcher."""
+    await tick([kind])
 
-    for index, row in reviews.get_df().iterrows():
-        tasks.append(notify_review(row=row, csv=reviews))
 
-    await asyncio.gather(*tasks)
+async def check_csvs() -> None:
+    """Check csv and start work with users."""
+    await tick(NOTIFIERS)
 
 
-async def notify_before_day(row: Series, csv: CSVFile) -> None:
+async def notify_before_day(
+    appointment: Appointment, csv: CSVFile
+) -> None:
     """Notify before day work.
 
     Interact with `tomorrow.csv` file
     """
-    user_id = get_user_id(row=row)
-    if not user_id or pd.isnull(user_id):
-        return
-
-    reply_markup = yes_no().as_markup(resize_keyboard=True)
-    await bot.send_message(
+    bot = get_app().bot
+    user_id = appointment.user_id
+    send = partial(
+        bot.send_message,
         user_id,
-        f"Вы записались на <b>{row["ДатаНачала"]}</b>, подтверждаете запись?",
-        reply_markup=reply_markup,
+        f"Вы записались на <b>{appointment.start_text}</b>, "
+        "подтверждаете запись?",
+        reply_markup=yes_no().as_markup(resize_keyboard=True),
         parse_mode="HTML",
     )
+    if not await send_once(CHANNEL, "tommorow", appointment, send):
+        return
 
     state = get_fsm(bot_id=bot.id, user_id=user_id, chat_id=user_id)
     await state.set_state(UserStates.notify_tommorow)
-    await state.update_data(info_data=row, csv=csv)
+    await state.update_data(kind="tommorow", info_data=appointment.to_list())
 
 
-async def notify_before_2hours(row: Series, csv: CSVFile) -> None:
+async def notify_before_2hours(
+    appointment: Appointment, csv: CSVFile
+) -> None:
     """Notify before 2 hours work.
 
     Interact with `2hours.csv` file
     """
-    user_id = get_user_id(row=row)
-    if not user_id or pd.isnull(user_id):
-        return
-
-    await bot.send_message(
-        user_id,
+    send = partial(
+        get_app().bot.send_message,
+        appointment.user_id,
         "Ждем вас сегодня в время по адресу! Будем рады вас видеть",
         parse_mode=None,
         reply_markup=ReplyKeyboardRemove(),
     )
+    await send_once(CHANNEL, "2hours", appointment, send)
 
 
-async def notify_review(row: Series, csv: CSVFile) -> None:
+async def notify_review(
+    appointment: Appointment, csv: CSVFile
+) -> None:
     """Notify add review work.
 
     Interact with `Reviews.csv` file
     """
-    user_id = get_user_id(row=row)
-    if not user_id or pd.isnull(user_id):
-        return
-
-    await bot.send_message(
+    bot = get_app().bot
+    user_id = appointment.user_id
+    send = partial(
+        bot.send_message,
         user_id,
         "Вчера вы были у нас, спасибо!\nОцените пожалуйста от 1-5 нас!",
         parse_mode=None,
     )
+    if not await send_once(CHANNEL, "reviews", appointment, send):
+        return
 
     state = get_fsm(bot_id=bot.id, user_id=user_id, chat_id=user_id)
-    await state.update_data(row=row)
+    await state.update_data(kind="reviews", row=appointment.to_list())
     await state.set_state(UserStates.review)
 
 
+NOTIFIERS = {
+    "tommorow": notify_before_day,
+    "2hours": notify_before_2hours,
+    "reviews": notify_review,
+}
+ADAPTER = ChannelAdapter(CHANNEL, USER_COLUMN, NOTIFIERS)
+
+
 async def start_scheduler() -> None:
-    """Start scheduler for work with csv."""
-    await check_csvs()
-    scheduler = AsyncIOScheduler()
-
-    scheduler.add_job(
-        check_csvs,
-        "interval",
-        timezone=ZoneInfo("Europe/Moscow"),
-        minutes=5,
-        max_instances=1,
-    )
-    scheduler.start()
+    """Start scheduler for work with csv.
+
+    Changed csv files are checked at once if the watcher is enabled, the
+    interval job checks all of them rarely then.
+    """
+    await schedule_ticks([ADAPTER])
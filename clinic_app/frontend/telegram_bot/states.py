@@ -1,7 +1,7 @@
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.base import StorageKey
-from clinic_app.frontend.telegram_bot.constants import storage
+from clinic_app.frontend.telegram_bot.app import get_app
 
 
 class UserStates(StatesGroup):
@@ -17,7 +17,7 @@ class UserStates(StatesGroup):
 def get_fsm(bot_id: int, user_id: int, chat_id: int) -> FSMContext:
     """Get aiogram bot FSMContext from dialog."""
     return FSMContext(
-        storage=storage,
+        storage=get_app().storage,
         key=StorageKey(
             bot_id=bot_id,
             user_id=user_id,
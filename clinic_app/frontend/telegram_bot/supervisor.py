@@ -0,0 +1,251 @@
+"""Supervisor of worker processes handling telegram updates.
+
+The bot process receives updates by polling or webhook and routes every
+update by consistent hash of its user id to one of worker processes, so
+handlers with their synchronous csv reads use all cores while updates of
+one user are handled in order by one worker. Workers run the handlers of
+`telegram_bot.handlers` and share the FSM storage and the global rate
+limit with the bot process through files. An exited worker is restarted
+at the same points of the hash ring.
+
+A worker handles a limited number of updates at once and leaves the next
+ones in its pipe. Routing waits while the pipe is full, so a slow worker
+slows down receiving of updates instead of buffering them without a
+bound.
+Updates which a worker has read or which are in its pipe when it crashes
+are lost: they were already confirmed to Telegram by polling or by the
+response to the webhook, so they aren't delivered again. Updates routed
+while the worker is restarted wait in its backlog.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import sys
+from collections import deque
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Hashable,
+    Iterable,
+    Mapping,
+)
+
+from aiogram import BaseMiddleware, Dispatcher
+from clinic_app.backend.metrics import WORKER_RESTARTS, WORKER_UPDATES
+from loguru import logger
+
+if TYPE_CHECKING:
+    from aiogram.types import TelegramObject, Update
+
+DEFAULT_WORKERS = 0
+DEFAULT_REPLICAS = 64
+DEFAULT_SHUTDOWN_TIMEOUT = 30
+WORKER_MODULE = "clinic_app.frontend.telegram_bot.worker"
+# Updates kept for a worker until it's restarted
+BACKLOG_SIZE = 10_000
+# Seconds before restart of an exited worker
+RESTART_DELAY = 1
+
+
+def _hash(value: str) -> int:
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    """Consistent hash ring of worker indexes.
+
+    Every worker has `replicas` points on the ring, a key belongs to the
+    worker of the first point after hash of the key, so a worker added
+    or removed moves only keys of its points. Hashes don't depend on the
+    process, workers find their keys the same way as the supervisor.
+
+    Parameters
+    ----------
+    nodes : Iterable[int]
+        Indexes of workers.
+    replicas : int, optional
+        Points of every worker, by default `DEFAULT_REPLICAS`.
+
+    """
+
+    def __init__(
+        self, nodes: Iterable[int], replicas: int = DEFAULT_REPLICAS
+    ) -> None:
+        points = sorted(
+            (_hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get(self, key: Hashable) -> int:
+        """Get index of worker of the key."""
+        position = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._nodes[position % len(self._nodes)]
+
+
+def get_ring(cfg: Mapping[str, Any]) -> HashRing:
+    """Get hash ring of workers of `telegram_bot.supervisor` section."""
+    return HashRing(
+        range(cfg.get("workers", DEFAULT_WORKERS)),
+        cfg.get("replicas", DEFAULT_REPLICAS),
+    )
+
+
+class WorkerPool:
+    """Worker processes reading json updates from stdin, one per line.
+
+    Parameters
+    ----------
+    cfg : Mapping[str, Any]
+        `telegram_bot.supervisor` section of config.
+
+    """
+
+    def __init__(self, cfg: Mapping[str, Any]) -> None:
+        self.ring = get_ring(cfg)
+        self.workers = cfg.get("workers", DEFAULT_WORKERS)
+        self.shutdown_timeout = cfg.get(
+            "shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT
+        )
+        self._processes: dict[int, asyncio.subprocess.Process] = {}
+        self._backlogs: dict[int, deque[bytes]] = {
+            index: deque(maxlen=BACKLOG_SIZE) for index in range(self.workers)
+        }
+        self._watchers: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """Start workers and restart them when they exit."""
+        for index in range(self.workers):
+            await self._spawn(index)
+            self._watchers.append(asyncio.create_task(self._watch(index)))
+
+    async def stop(self) -> None:
+        """Let workers handle received updates, kill them after timeout."""
+        for task in self._watchers:
+            task.cancel()
+        await asyncio.gather(*self._watchers, return_exceptions=True)
+        self._watchers.clear()
+
+        processes = list(self._processes.values())
+        for process in processes:
+            # Workers exit at the end of input
+            if process.returncode is None:
+                process.stdin.close()
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(process.wait(), self.shutdown_timeout)
+                for process in processes
+            ),
+            return_exceptions=True,
+        )
+        for process, result in zip(processes, results):
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(f"Telegram worker {process.pid} is killed")
+                process.kill()
+                await process.wait()
+        self._processes.clear()
+
+    async def route(self, key: Hashable, update: bytes) -> None:
+        """Send json update to the worker of key.
+
+        Waits until the pipe of the worker has room for more updates.
+
+        Parameters
+        ----------
+        key : Hashable
+            user id, updates of one key are handled in order.
+        update : bytes
+            json of update ended by newline.
+        """
+        index = self.ring.get(key)
+        WORKER_UPDATES.inc(worker=str(index))
+        process = self._processes.get(index)
+        if (
+            process is None
+            or process.returncode is not None
+            or process.stdin.is_closing()
+        ):
+            self._backlogs[index].append(update)
+            return
+        process.stdin.write(update)
+        try:
+            await process.stdin.drain()
+        except ConnectionError:
+            # The worker exited, the update may be lost with its pipe
+            logger.warning(f"Telegram worker {index} didn't get an update")
+
+    async def _spawn(self, index: int) -> None:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            WORKER_MODULE,
+            str(index),
+            stdin=asyncio.subprocess.PIPE,
+            # SIGINT of a terminal stops the supervisor, it stops workers
+            start_new_session=True,
+        )
+        # Updates routed while the backlog is written are appended to it,
+        # so the worker gets them in order
+        backlog = self._backlogs[index]
+        try:
+            while backlog:
+                process.stdin.write(backlog.popleft())
+                await process.stdin.drain()
+        except ConnectionError:
+            logger.warning(f"Telegram worker {index} didn't get its backlog")
+        self._processes[index] = process
+        logger.info(f"Telegram worker {index} is started, pid {process.pid}")
+
+    async def _watch(self, index: int) -> None:
+        while True:
+            code = await self._processes[index].wait()
+            logger.error(
+                f"Telegram worker {index} exited with code {code}, "
+                f"restart in {RESTART_DELAY}s"
+            )
+            WORKER_RESTARTS.inc(worker=str(index))
+            await asyncio.sleep(RESTART_DELAY)
+            await self._spawn(index)
+
+
+class RoutingMiddleware(BaseMiddleware):
+    """Outer update middleware sending updates to workers.
+
+    Handlers aren't called, user of the update is resolved by the
+    dispatcher before this middleware.
+    """
+
+    def __init__(self, pool: WorkerPool) -> None:
+        self.pool = pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is not None:
+            key = user.id
+        elif chat is not None:
+            key = chat.id
+        else:
+            key = event.update_id
+        update = event.model_dump_json(by_alias=True, exclude_unset=True)
+        await self.pool.route(key, update.encode() + b"\n")
+
+
+def create_router(pool: WorkerPool) -> Dispatcher:
+    """Create dispatcher which routes every update to workers of pool."""
+    dp = Dispatcher()
+    dp.update.outer_middleware(RoutingMiddleware(pool))
+    return dp
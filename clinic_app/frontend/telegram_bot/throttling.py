@@ -0,0 +1,272 @@
+"""Flood control of requests of the telegram bot.
+
+`RateLimitMiddleware` is a request middleware of the bot session, so
+every message sent by the scheduler or by handlers (`msg.answer` too)
+passes through the global and per-chat token buckets and is retried
+after `TelegramRetryAfter` and network errors. Processes of one bot,
+e.g. the supervisor and its workers, share the global bucket in a file.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Iterator, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from clinic_app.backend.metrics import SEND_ERRORS, SEND_RETRIES, SEND_SECONDS
+from loguru import logger
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+    from aiogram.client.session.middlewares.base import (
+        NextRequestMiddlewareType,
+    )
+    from aiogram.methods import Response, TelegramMethod
+    from aiogram.methods.base import TelegramType
+
+# Limits from https://core.telegram.org/bots/faq
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_RATE = 1
+DEFAULT_CHAT_BURST = 3
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1
+DEFAULT_SHARED_PATH = "src_csvs/telegram_rate.bucket"
+# Count of per-chat buckets which triggers removal of idle ones
+MAX_CHAT_BUCKETS = 10_000
+
+RETRY_ERRORS = (TelegramRetryAfter, TelegramNetworkError, TelegramServerError)
+
+
+class TokenBucket:
+    """Token bucket which hands out reservations.
+
+    Tokens may go below zero, then every caller waits for its own slot,
+    so concurrent senders are served in order without locks.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second.
+    capacity : float
+        Max count of tokens, i.e. size of burst.
+
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token and get seconds to wait before using it."""
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Make the next reservation wait at least `seconds`."""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+    def is_idle(self) -> bool:
+        """Return True if bucket is full, so it can be recreated."""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket kept in a file and shared by processes.
+
+    Every operation takes `flock` of the file and reads tokens and time
+    of the last refill from it. Time is monotonic, it's common for
+    processes of one host.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file of the bucket.
+    rate : float
+        Tokens added per second.
+    capacity : float
+        Max count of tokens, i.e. size of burst.
+
+    """
+
+    __slots__ = ("path", "_fd")
+
+    _format = struct.Struct("dd")
+
+    def __init__(self, path: str, rate: float, capacity: float) -> None:
+        super().__init__(rate, capacity)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            state = os.pread(self._fd, self._format.size, 0)
+            if len(state) == self._format.size:
+                self.tokens, self.updated = self._format.unpack(state)
+                # The file outlived a reboot
+                self.updated = min(self.updated, time.monotonic())
+            yield
+            os.pwrite(
+                self._fd, self._format.pack(self.tokens, self.updated), 0
+            )
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def reserve(self) -> float:
+        with self._locked():
+            return super().reserve()
+
+    def pause(self, seconds: float) -> None:
+        with self._locked():
+            super().pause(seconds)
+
+    def is_idle(self) -> bool:
+        with self._locked():
+            return super().is_idle()
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Throttle requests to chats and retry failed ones.
+
+    Parameters
+    ----------
+    global_rate : float, optional
+        Requests per second to all chats,
+        by default `DEFAULT_GLOBAL_RATE`.
+    chat_rate : float, optional
+        Requests per second to one chat, by default `DEFAULT_CHAT_RATE`.
+    chat_burst : float, optional
+        Requests to one chat sent without waiting,
+        by default `DEFAULT_CHAT_BURST`.
+    max_retries : int, optional
+        Retries of one request, by default `DEFAULT_MAX_RETRIES`.
+    retry_backoff : float, optional
+        First delay in seconds before retry after network or server
+        error, doubled on every retry, by default `DEFAULT_RETRY_BACKOFF`.
+    shared_path : Optional[str], optional
+        File of the global bucket shared by processes of the bot,
+        by default the bucket is private.
+
+    """
+
+    def __init__(
+        self,
+        global_rate: float = DEFAULT_GLOBAL_RATE,
+        chat_rate: float = DEFAULT_CHAT_RATE,
+        chat_burst: float = DEFAULT_CHAT_BURST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        retry_backoff: float = DEFAULT_RETRY_BACKOFF,
+        shared_path: Optional[str] = None,
+    ) -> None:
+        if shared_path:
+            self.global_bucket: TokenBucket = SharedTokenBucket(
+                shared_path, global_rate, global_rate
+            )
+        else:
+            self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.chat_buckets: dict[Any, TokenBucket] = {}
+
+        self.retried = 0
+        self.failed = 0
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                self.chat_buckets = {
+                    key: value
+                    for key, value in self.chat_buckets.items()
+                    if not value.is_idle()
+                }
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_bucket: TokenBucket) -> None:
+        # The chat slot is taken first, so a chat waiting for its own
+        # slot doesn't hold a global one
+        delay = chat_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        delay = self.global_bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            await self._acquire(chat_bucket)
+            try:
+                response = await make_request(bot, method)
+            except RETRY_ERRORS as e:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    SEND_ERRORS.inc(channel="telegram")
+                    raise
+                attempt += 1
+                self.retried += 1
+                SEND_RETRIES.inc(channel="telegram")
+                if isinstance(e, TelegramRetryAfter):
+                    # Flood control applies to the bot token, so the
+                    # global bucket makes other chats wait too and the
+                    # chat bucket makes the retry wait
+                    delay = e.retry_after
+                    chat_bucket.pause(delay)
+                    self.global_bucket.pause(delay)
+                else:
+                    delay = self.retry_backoff * 2 ** (attempt - 1)
+                logger.warning(
+                    f"{type(method).__name__} to chat {chat_id} failed, "
+                    f"retry {attempt}/{self.max_retries} in {delay}s"
+                )
+                if not isinstance(e, TelegramRetryAfter):
+                    await asyncio.sleep(delay)
+            except Exception:
+                SEND_ERRORS.inc(channel="telegram")
+                raise
+            else:
+                elapsed = time.monotonic() - started
+                SEND_SECONDS.observe(elapsed, channel="telegram")
+                return response
@@ -0,0 +1,115 @@
+"""Webhook runtime of the telegram bot.
+
+Telegram posts updates to an aiohttp server instead of the bot polling
+`getUpdates`, so an update is handled as soon as it's sent and several
+instances can serve one bot behind a load balancer. Requests without
+the secret token of `setWebhook` are rejected.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import secrets
+import signal
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_PATH = "/telegram/webhook"
+DEFAULT_SHUTDOWN_TIMEOUT = 30
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    cfg: Mapping[str, Any],
+    allowed_updates: Optional[list[str]] = None,
+    stop: Optional[asyncio.Event] = None,
+) -> None:
+    """Serve updates posted by Telegram until stopped.
+
+    The webhook is set once the server listens. On stop the server
+    accepts no more updates and waits for handlers of received ones,
+    updates which aren't answered in time are delivered again by
+    Telegram. The webhook is left set, so updates wait for the next
+    start or the other instances.
+
+    Parameters
+    ----------
+    dp : Dispatcher
+        dispatcher of posted updates.
+    bot : Bot
+        bot the webhook is set for.
+    cfg : Mapping[str, Any]
+        `telegram_bot.webhook` section of config.
+    allowed_updates : Optional[list[str]], optional
+        types of updates posted by Telegram, by default types handled by
+        the dispatcher.
+    stop : Optional[asyncio.Event], optional
+        event which stops the server, by default SIGINT and SIGTERM.
+    """
+    from aiogram.webhook.aiohttp_server import (
+        SimpleRequestHandler,
+        setup_application,
+    )
+    from aiohttp import web
+
+    path = cfg.get("path") or DEFAULT_PATH
+    url = cfg["url"].rstrip("/") + path
+    # Instances behind a load balancer must share the secret of config
+    secret_token = cfg.get("secret_token") or secrets.token_urlsafe(32)
+
+    app = web.Application()
+    # Telegram gets the response after the update is handled, so the
+    # graceful shutdown of aiohttp waits for handlers of received ones
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=secret_token,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(
+        app,
+        handle_signals=False,
+        shutdown_timeout=cfg.get(
+            "shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT
+        ),
+    )
+    await runner.setup()
+
+    loop = asyncio.get_running_loop()
+    signals = []
+    if stop is None:
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+            signals.append(signum)
+
+    try:
+        host = cfg.get("host") or DEFAULT_HOST
+        port = cfg.get("port", DEFAULT_PORT)
+        await web.TCPSite(runner, host, port).start()
+        await bot.set_webhook(
+            url,
+            secret_token=secret_token,
+            allowed_updates=(
+                dp.resolve_used_update_types()
+                if allowed_updates is None
+                else allowed_updates
+            ),
+            drop_pending_updates=cfg.get("drop_pending_updates", False),
+        )
+        logger.info(f"Webhook {url} is served on {host}:{port}")
+        await stop.wait()
+    finally:
+        for signum in signals:
+            loop.remove_signal_handler(signum)
+        logger.info("Webhook server is stopping")
+        await runner.cleanup()
@@ -0,0 +1,80 @@
+"""Worker process of the telegram bot supervisor.
+
+It reads json updates routed by the supervisor from stdin, one per line,
+and feeds them to the dispatcher with handlers. Deferred messages of
+users routed to the worker are sent by it. The worker exits at the end
+of input once received updates are handled.
+
+Usage: python -m clinic_app.frontend.telegram_bot.worker INDEX
+"""
+
+import asyncio
+import logging
+import sys
+
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.frontend.telegram_bot.app import TelegramApp, create_app
+from clinic_app.frontend.telegram_bot.main import send_deferred
+from clinic_app.frontend.telegram_bot.supervisor import get_ring
+from clinic_app.shared.config import get_config
+from loguru import logger
+
+# Max size of json of one update in bytes
+LINE_LIMIT = 2**20
+# Updates handled at once, next ones wait in the pipe of the supervisor
+PENDING_LIMIT = 1000
+
+
+async def feed_update(
+    app: TelegramApp, line: bytes, pending: asyncio.Semaphore
+) -> None:
+    """Handle json update by the dispatcher of the application."""
+    from aiogram.types import Update
+
+    try:
+        update = Update.model_validate_json(line, context={"bot": app.bot})
+        await app.dp.feed_update(app.bot, update)
+    except Exception as e:
+        logger.opt(exception=e).error("Update wasn't handled")
+    finally:
+        pending.release()
+
+
+async def main(index: int) -> None:
+    """Entrypoint of worker `index` of the supervisor."""
+    logging.basicConfig(level=logging.INFO)
+    app = create_app(get_config())
+    ring = get_ring(app.config["telegram_bot"]["supervisor"])
+
+    deferred = get_deferred()
+    deferred.register("telegram", send_deferred)
+    deferred.start(owns=lambda chat_id: ring.get(chat_id) == index)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=LINE_LIMIT)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+    )
+    logger.info(f"Telegram worker {index} is ready")
+
+    tasks: set[asyncio.Task] = set()
+    pending = asyncio.Semaphore(PENDING_LIMIT)
+    try:
+        # Updates of one chat wait for each other in the dispatcher
+        while True:
+            await pending.acquire()
+            line = await reader.readline()
+            if not line:
+                break
+            task = asyncio.create_task(feed_update(app, line, pending))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        await deferred.stop()
+        await app.bot.session.close()
+        await app.storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1])))
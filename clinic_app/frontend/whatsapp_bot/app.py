@@ -0,0 +1,90 @@
+"""Factory of the whatsapp bot application.
+
+Nothing is created on import: `create_app` builds the Green API client
+from config. Handlers and schedulers get the current application by
+`get_app`.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Mapping, Optional
+
+from clinic_app.shared.config import get_config
+
+if TYPE_CHECKING:
+    from clinic_app.frontend.whatsapp_bot.client import AsyncGreenApi
+
+_app: Optional[WhatsappApp] = None
+_app_lock = threading.Lock()
+
+
+@dataclass
+class WhatsappApp:
+    """Objects of running whatsapp bot.
+
+    Parameters
+    ----------
+    config : Mapping[str, Any]
+        `whatsapp_bot` section of config the application was created
+        from.
+    client : AsyncGreenApi
+        Green API client of the instance.
+
+    """
+
+    config: Mapping[str, Any]
+    client: AsyncGreenApi
+
+
+def _build_app(config: Mapping[str, Any]) -> WhatsappApp:
+    from clinic_app.frontend.whatsapp_bot.client import (
+        DEFAULT_HOST,
+        DEFAULT_MAX_CONCURRENCY,
+        DEFAULT_MAX_CONNECTIONS,
+        DEFAULT_TIMEOUT,
+        AsyncGreenApi,
+    )
+
+    cfg = config["whatsapp_bot"]
+    client = AsyncGreenApi(
+        id_instance=str(cfg["id_instance"]),
+        token_instance=cfg["token_instance"],
+        host=cfg.get("api_url") or DEFAULT_HOST,
+        timeout=cfg.get("timeout", DEFAULT_TIMEOUT),
+        max_connections=cfg.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+        max_concurrency=cfg.get("max_concurrency", DEFAULT_MAX_CONCURRENCY),
+    )
+    return WhatsappApp(config=cfg, client=client)
+
+
+def create_app(config: Optional[Mapping[str, Any]] = None) -> WhatsappApp:
+    """Create whatsapp bot application and make it the current one.
+
+    Parameters
+    ----------
+    config : Optional[Mapping[str, Any]], optional
+        Parsed config.yml, by default `get_config()`.
+
+    Returns
+    -------
+    WhatsappApp
+        created application.
+    """
+    global _app
+
+    app = _build_app(get_config() if config is None else config)
+    with _app_lock:
+        _app = app
+    return app
+
+
+def get_app() -> WhatsappApp:
+    """Get current application, it's created from config.yml if none."""
+    global _app
+
+    with _app_lock:
+        if _app is None:
+            _app = _build_app(get_config())
+        return _app
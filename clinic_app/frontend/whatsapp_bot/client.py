@@ -0,0 +1,183 @@
+"""Asyncio client of Green API with pooled keep-alive connections."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Optional
+
+import aiohttp
+from clinic_app.backend.metrics import SEND_ERRORS, SEND_SECONDS
+
+DEFAULT_HOST = "https://api.green-api.com"
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_CONCURRENCY = 50
+DEFAULT_RECEIVE_TIMEOUT = 5
+
+
+class GreenApiError(Exception):
+    """Green API responded with error status."""
+
+    def __init__(self, status: int, text: str) -> None:
+        super().__init__(f"Green API error {status}: {text}")
+        self.status = status
+        self.text = text
+
+
+class AsyncGreenApi:
+    """Green API client for send, receive and delete of notifications.
+
+    One `aiohttp.ClientSession` is shared by all requests, so connections
+    are reused, and count of requests in flight is limited.
+
+    Parameters
+    ----------
+    id_instance : str
+        Green API instance id.
+    token_instance : str
+        Green API instance token.
+    host : str, optional
+        API url, a local stub server can be used in tests,
+        by default `DEFAULT_HOST`.
+    timeout : float, optional
+        Total timeout of one request in seconds,
+        by default `DEFAULT_TIMEOUT`.
+    max_connections : int, optional
+        Size of connection pool, by default `DEFAULT_MAX_CONNECTIONS`.
+    max_concurrency : int, optional
+        Max count of requests in flight,
+        by default `DEFAULT_MAX_CONCURRENCY`.
+
+    """
+
+    def __init__(
+        self,
+        id_instance: str,
+        token_instance: str,
+        host: str = DEFAULT_HOST,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ) -> None:
+        self.id_instance = str(id_instance)
+        self.token_instance = token_instance
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _url(self, method: str, suffix: str = "") -> str:
+        url = (
+            f"{self.host}/waInstance{self.id_instance}/"
+            f"{method}/{self.token_instance}"
+        )
+        if suffix:
+            url = f"{url}/{suffix}"
+        return url
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def request(
+        self,
+        http_method: str,
+        method: str,
+        payload: Optional[dict[str, Any]] = None,
+        suffix: str = "",
+        params: Optional[dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """Call Green API method and return decoded json.
+
+        Parameters
+        ----------
+        http_method : str
+            HTTP method.
+        method : str
+            Green API method, e.g. `sendMessage`.
+        payload : Optional[dict[str, Any]], optional
+            json body, by default None.
+        suffix : str, optional
+            url part after token, by default "".
+        params : Optional[dict[str, Any]], optional
+            query parameters, by default None.
+        timeout : Optional[float], optional
+            total timeout of the request, by default `self.timeout`.
+
+        Returns
+        -------
+        Any
+            decoded json of response.
+
+        Raises
+        ------
+        GreenApiError
+            If response status isn't 2xx.
+        """
+        session = self._get_session()
+        request_timeout = None
+        if timeout is not None:
+            request_timeout = aiohttp.ClientTimeout(total=timeout)
+
+        async with self._semaphore:
+            async with session.request(
+                http_method,
+                self._url(method, suffix),
+                json=payload,
+                params=params,
+                timeout=request_timeout,
+            ) as response:
+                if response.status >= 400:
+                    raise GreenApiError(response.status, await response.text())
+                return await response.json(content_type=None)
+
+    async def send_message(self, chat_id: str, message: str) -> dict[str, Any]:
+        """Send text message to chat."""
+        started = time.monotonic()
+        try:
+            response = await self.request(
+                "POST", "sendMessage", {"chatId": chat_id, "message": message}
+            )
+        except Exception:
+            SEND_ERRORS.inc(channel="whatsapp")
+            raise
+        SEND_SECONDS.observe(time.monotonic() - started, channel="whatsapp")
+        return response
+
+    async def receive_notification(
+        self, receive_timeout: int = DEFAULT_RECEIVE_TIMEOUT
+    ) -> Optional[dict[str, Any]]:
+        """Receive one notification, None if queue is empty."""
+        return await self.request(
+            "GET",
+            "receiveNotification",
+            params={"receiveTimeout": receive_timeout},
+            timeout=self.timeout + receive_timeout,
+        )
+
+    async def delete_notification(self, receipt_id: int) -> dict[str, Any]:
+        """Delete received notification from the queue."""
+        return await self.request(
+            "DELETE", "deleteNotification", suffix=str(receipt_id)
+        )
+
+    async def set_settings(self, settings: dict[str, Any]) -> dict[str, Any]:
+        """Set settings of the instance."""
+        return await self.request("POST", "setSettings", settings)
+
+    async def close(self) -> None:
+        """Close connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -1,14 +1,22 @@
-"""Handlers for whatsapp bot."""
+"""Handlers for whatsapp bot.
 
-import time
-from datetime import datetime, timedelta
+Reads and writes of csv files block, so handlers run them in threads by
+`asyncio.to_thread` and a slow write doesn't stall other chats of the
+inbound pipeline.
+"""
+
+import asyncio
+import inspect
+from datetime import datetime
 from types import FunctionType
-from typing import TYPE_CHECKING, Any
+from typing import Any
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from clinic_app.backend.csv_files import CSVFile, Database
+from clinic_app.backend.appointments import Appointment
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.backend.profiling import profiled
+from clinic_app.backend.storage import get_database, open_csv
 from clinic_app.backend.utils import format_phone
-from clinic_app.frontend.whatsapp_bot.constants import bot
+from clinic_app.frontend.whatsapp_bot.app import get_app
 from clinic_app.frontend.whatsapp_bot.states import (
     MainFSM,
     WhatsappFSMContext,
@@ -18,14 +26,23 @@ from clinic_app.shared import CSVS
 from loguru import logger
 from zoneinfo import ZoneInfo
 
-if TYPE_CHECKING:
-    import pandas as pd
-
 MANAGER_ID = "972549102077@c.us"
+# Delays of deferred messages in seconds
+RESCHEDULING_DELAY = 15 * 60
+REVIEW_DELAY = 2
 
 
 def error_handler(f: FunctionType) -> Any:
-    """Error handler."""
+    """Error handler, works with sync and async functions."""
+    if inspect.iscoroutinefunction(f):
+
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await f(*args, **kwargs)
+            except Exception as e:
+                logger.exception(e)
+
+        return async_wrapper
 
     def wrapper(*args, **kwargs):
         try:
@@ -37,7 +54,7 @@ def error_handler(f: FunctionType) -> Any:
 
 
 @error_handler
-def middleware(type_webhook: str, body: dict) -> None:
+async def middleware(type_webhook: str, body: dict) -> None:
     """FSM middleware."""
     if type_webhook == "incomingMessageReceived":
         msg = body.get("messageData")
@@ -46,7 +63,7 @@ def middleware(type_webhook: str, body: dict) -> None:
             return
 
         if msg["textMessageData"]["textMessage"] == "/start":
-            return on_start(body)
+            return await on_start(body)
         
         fsm_context = get_fsm()
         fsm_state = fsm_context.get_state(sender["chatId"])
@@ -55,13 +72,13 @@ def middleware(type_webhook: str, body: dict) -> None:
             return
 
         if fsm_state == MainFSM.get_review:
-            return get_review(body, fsm_context)
+            return await get_review(body, fsm_context)
         if fsm_state == MainFSM.notify_tommorow:
-            return notify_tomorrow(body, fsm_context)
+            return await notify_tomorrow(body, fsm_context)
         if fsm_state == MainFSM.rescheduling:
-            return rescheduling(body, fsm_context)
+            return await rescheduling(body, fsm_context)
         if fsm_state == MainFSM.review:
-            return on_review(body, fsm_context)
+            return await on_review(body, fsm_context)
 
 
 def resolve_chat_id(body_message: dict) -> int:
@@ -82,49 +99,55 @@ def get_phone_from_msg(body_message: dict) -> str:
     return body_message["senderData"]["sender"].split("@")[0]
 
 
-def on_start(body_msg: str) -> None:
+def update_appointment(
+    kind: str, appointment: Appointment, values: dict[str, Any]
+) -> None:
+    """Update cells of appointment in csv file of `kind`, it blocks."""
+    csv = open_csv(CSVS[kind])
+    csv.update_cells(appointment.index, values, appointment.key)
+
+
+@profiled("whatsapp")
+async def on_start(body_msg: str) -> None:
     """Entrypoint of the bot."""
-    db = Database()
+    client = get_app().client
+    db = await asyncio.to_thread(get_database)
     chat_id = resolve_chat_id(body_msg)
-    if db.value_exists(chat_id, "wh_user_id"):
-        bot.sending.sendMessage(
+    if await asyncio.to_thread(db.value_exists, chat_id, "wh_user_id"):
+        await client.send_message(
             chat_id,
             "Вы уже зарегистрированы в системе. Мы вам напомним о вашей "
             "записи",
         )
         return
 
-    chat_id = resolve_chat_id(body_msg)
-    phone = format_phone(get_phone_from_msg(body_msg))
-
-    db = Database()
-
-    if not db.value_exists(phone, "phone"):
-        df = db.get_df()
-        row = {
-            "phone": format_phone(phone),
-            "wh_user_id": resolve_chat_id(body_msg),
-        }
-        df.loc[len(df)] = row
-        df.to_csv(db.path, index=False)
+    row = {
+        "phone": format_phone(get_phone_from_msg(body_msg)),
+        "wh_user_id": chat_id,
+    }
+    # Nothing is added if the phone is registered
+    await asyncio.to_thread(db.add_row, row)
 
-    bot.sending.sendMessage(
-        resolve_chat_id(body_msg),
+    await client.send_message(
+        chat_id,
         "Ваш номер телефона сохранен. Мы вам напомним о вашей записи",
     )
 
 
-def get_review(body_msg: dict, state: WhatsappFSMContext) -> None:
+@profiled("whatsapp")
+async def get_review(body_msg: dict, state: WhatsappFSMContext) -> None:
     """Get full negative review from user and write it to csv file."""
+    client = get_app().client
     msg_text = resolve_text_msg(body_msg)
     chat_id = resolve_chat_id(body_msg)
 
     data = state.get_data(chat_id)
-    db = Database()
-    reviews = CSVFile(CSVS["reviews"])
+    db = await asyncio.to_thread(get_database)
 
     date = datetime.now().astimezone(ZoneInfo("Europe/Moscow")).date()
-    phone = db.get_value_by_kv(kv=("wh_user_id", chat_id), column="phone")
+    phone = await asyncio.to_thread(
+        db.get_value_by_kv, kv=("wh_user_id", chat_id), column="phone"
+    )
 
     review = f"{date}:{data["review"]}:{msg_text}:{phone}"
     dt = datetime.now().astimezone(ZoneInfo("Europe/Moscow"))
@@ -135,82 +158,83 @@ def get_review(body_msg: dict, state: WhatsappFSMContext) -> None:
         f"Время по МСК: {dt}\n"
         f"Сообщение:\n{resolve_text_msg(body_msg)}"
     )
-    bot.sending.sendMessage(MANAGER_ID, text)
-
-    row: pd.Series = data["row"]
-    reviews.find_and_replace(
-        search_value_column_name="Телефон",
-        search_value=row["Телефон"],
-        new_value_column_name="Отзыв",
-        new_value=review,
-        save=True,
+    await client.send_message(MANAGER_ID, text)
+
+    row = Appointment.from_list(data["row"])
+    await asyncio.to_thread(
+        update_appointment, "reviews", row, {"Отзыв": review}
     )
 
-    time.sleep(1.5)
-    bot.sending.sendMessage(chat_id, "Спасибо вам большое за отзыв!")
+    get_deferred().schedule(
+        "whatsapp", chat_id, "review_thanks", delay=REVIEW_DELAY
+    )
     state.clear(chat_id)
 
 
-def notify_tomorrow(body_msg: dict, state: WhatsappFSMContext) -> None:
+@profiled("whatsapp")
+async def notify_tomorrow(body_msg: dict, state: WhatsappFSMContext) -> None:
     """Remind me the day before your appointment."""
+    client = get_app().client
     chat_id = resolve_chat_id(body_msg)
     msg_text = resolve_text_msg(body_msg)
     if msg_text.lower() not in ["да", "нет"]:
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
             "Нет такого варианта ответа, напишите пожалуйста `да` или `нет`"
         )
         return
 
     data = state.get_data(chat_id)
-    info: pd.Series = data["info_data"]
-    csv: CSVFile = data["csv"]
+    info = Appointment.from_list(data["info_data"])
 
     if msg_text.lower() == "да":
-        df = csv.get_df()
-        df.loc[info.name, "Подтверждение"] = 1
-        df.to_csv(csv.path, index=False)
+        await asyncio.to_thread(
+            update_appointment, data["kind"], info, {"Подтверждение": 1}
+        )
 
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
-            f"Отлично! Ждем вас в {info["ДатаНачала"]}",
+            f"Отлично! Ждем вас в {info.start_text}",
         )
         state.clear(chat_id)
 
     elif msg_text.lower() == "нет":
-        df = csv.get_df()
-        df.loc[info.name, "Подтверждение"] = -1
-        df.to_csv(csv.path, index=False)
+        await asyncio.to_thread(
+            update_appointment, data["kind"], info, {"Подтверждение": -1}
+        )
 
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
             "Перезаписать вас на другое время? Отвечайте `да` или `нет`",
         )
         state.set_state(MainFSM.rescheduling, chat_id)
 
 
-def rescheduling(body_msg: dict, state: WhatsappFSMContext) -> None:
+@profiled("whatsapp")
+async def rescheduling(body_msg: dict, state: WhatsappFSMContext) -> None:
     """
     Conversation with the user about rescheduling an appointment with
     a doctor.
     """
+    client = get_app().client
     msg_text = resolve_text_msg(body_msg)
     chat_id = resolve_chat_id(body_msg)
     if msg_text.lower() not in ["да", "нет"]:
-        bot.sending.sendMessage(chat_id, "Нет такого варианта ответа")
+        await client.send_message(chat_id, "Нет такого варианта ответа")
         return
 
     data = state.get_data(chat_id)
-    info: pd.Series = data["info_data"]
-    csv: CSVFile = data["csv"]
+    info = Appointment.from_list(data["info_data"])
 
     if msg_text.lower() == "да":
-        df = csv.get_df()
-        df.loc[info.name, "Перезапись"] = 1
-        df.loc[info.name, "Подтверждение"] = -1
-        df.to_csv(csv.path, index=False)
+        await asyncio.to_thread(
+            update_appointment,
+            data["kind"],
+            info,
+            {"Перезапись": 1, "Подтверждение": -1},
+        )
 
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id, "Скоро вам позвонит менеджер для перезаписи"
         )
 
@@ -222,89 +246,74 @@ def rescheduling(body_msg: dict, state: WhatsappFSMContext) -> None:
             f"Время по МСК: {time}\n"
             f"Сообщение:\n{resolve_text_msg(body_msg)}"
         )
-        bot.sending.sendMessage(MANAGER_ID, text)
+        await client.send_message(MANAGER_ID, text)
 
         client_id = "1377cb96-cf0b-4599-a213-67315c8c1966"
-        doctor_id = info["ИДВрач"]
-        clinic_id = info["ИДФилиал"]
+        doctor_id = info.doctor_id
+        clinic_id = info.clinic_id
         url = (
             "https://medapi.1cbit.ru/online_record"
             f"/client/{client_id}/doctor/{doctor_id}?clinic={clinic_id}"
         )
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
             "Спасибо, что предупредили! Пожалуйста, перезапишитесь по "
             f"этой ссылке: {url}",
         )
 
-        schedule_date = datetime.now() + timedelta(minutes=15)
-        sch = AsyncIOScheduler()
-        text = (
-            "Если у вас не получилось записаться онлайн вы можете "
-            "записаться по номеру телефона: 123456"
-        )
-        sch.add_job(
-            notify_rescheduling,
-            "date",
-            run_date=schedule_date,
-            args=(msg_text, chat_id),
+        get_deferred().schedule(
+            "whatsapp",
+            chat_id,
+            "rescheduling_phone",
+            delay=RESCHEDULING_DELAY,
         )
-        sch.start()
 
     elif msg_text.lower() == "нет":
-        df = csv.get_df()
-        df.loc[info.name, "Перезапись"] = -1
-        df.to_csv(csv.path, index=False)
+        await asyncio.to_thread(
+            update_appointment, data["kind"], info, {"Перезапись": -1}
+        )
 
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id, "Спасибо, что предупредили, будем вас ждать!"
         )
 
     state.clear(chat_id)
 
 
-def on_review(body_msg: dict, state: WhatsappFSMContext) -> None:
+@profiled("whatsapp")
+async def on_review(body_msg: dict, state: WhatsappFSMContext) -> None:
     """Converstation with user about his feedback and review."""
+    client = get_app().client
     chat_id = resolve_chat_id(body_msg)
     msg_text = resolve_text_msg(body_msg)
     if msg_text not in list(map(str, range(1, 5 + 1))):
-        bot.sending.sendMessage(chat_id, "Оцените нас пожалуйста от 1 до 5!")
+        await client.send_message(chat_id, "Оцените нас пожалуйста от 1 до 5!")
         return
 
     if msg_text == "5":
         url = "https://yandex.ru"
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
             f"Отлично, оцените нас на Яндекс.Картах {url} на карточку "
             "компании",
         )
 
         data = state.get_data(chat_id)
-        reviews = CSVFile(CSVS["reviews"])
-
-        row: pd.Series = data["row"]
-        reviews.find_and_replace(
-            search_value_column_name="Телефон",
-            search_value=row["Телефон"],
-            new_value_column_name="Отзыв",
-            new_value=msg_text,
-            save=True,
+        row = Appointment.from_list(data["row"])
+        await asyncio.to_thread(
+            update_appointment, "reviews", row, {"Отзыв": msg_text}
         )
 
-        time.sleep(2)
-        bot.sending.sendMessage(chat_id, "Спасибо вам большое за отзыв!")
+        get_deferred().schedule(
+            "whatsapp", chat_id, "review_thanks", delay=REVIEW_DELAY
+        )
         state.clear(chat_id)
 
     else:
-        bot.sending.sendMessage(
+        await client.send_message(
             chat_id,
             "Ого! Мы сожалеем! Расскажите нам, что мы можем улучшить! "
             "Мы примем меры!",
         )
         state.update_data(chat_id, review=msg_text)
         state.set_state(MainFSM.get_review, chat_id)
-
-
-def notify_rescheduling(text: str, chat_id: int) -> None:
-    """Call this function by the scheduler."""
-    bot.sending.sendMessage(chat_id, text)
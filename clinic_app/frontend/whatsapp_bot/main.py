@@ -1,30 +1,47 @@
 import asyncio
 
-from clinic_app.frontend.whatsapp_bot.constants import bot
-from clinic_app.frontend.whatsapp_bot.handlers import error_handler, middleware
+from clinic_app.backend.deferred import get_deferred
+from clinic_app.backend.metrics import FSM_STATES, start_metrics_server
+from clinic_app.frontend.whatsapp_bot.app import create_app, get_app
+from clinic_app.frontend.whatsapp_bot.handlers import middleware
+from clinic_app.frontend.whatsapp_bot.pipeline import (
+    DEFAULT_QUEUE_SIZE,
+    DEFAULT_STATS_INTERVAL,
+    DEFAULT_WORKERS,
+    InboundPipeline,
+)
 from clinic_app.frontend.whatsapp_bot.scheduler import start_scheduler
+from clinic_app.frontend.whatsapp_bot.states import (
+    DEFAULT_SNAPSHOT_INTERVAL,
+    get_fsm,
+)
+from clinic_app.shared.config import get_config
+from loguru import logger
 
 
-@error_handler
 async def keep_alive():
+    app = get_app()
+    inbound = app.config.get("inbound") or {}
+    pipeline = InboundPipeline(
+        app.client,
+        middleware,
+        workers=inbound.get("workers", DEFAULT_WORKERS),
+        queue_size=inbound.get("queue_size", DEFAULT_QUEUE_SIZE),
+        stats_interval=inbound.get("stats_interval", DEFAULT_STATS_INTERVAL),
+    )
+    await pipeline.run()
+
+
+async def snapshot_fsm():
+    """Save FSM snapshot and log its stats periodically."""
+    fsm = get_fsm()
+    interval = (get_app().config.get("fsm") or {}).get(
+        "snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL
+    )
     while True:
-        notification = await asyncio.to_thread(
-            bot.webhooks.api.receiving.receiveNotification
-        )
-        if (
-            notification.data
-            and notification.data["body"]["typeWebhook"]
-            == "incomingMessageReceived"
-        ):
-            notification_id = notification.data["receiptId"]
-            
-            type_webhook = notification.data["body"]["typeWebhook"]
-            body = notification.data["body"]
-            middleware(type_webhook, body)
-            
-            await asyncio.to_thread(
-                bot.webhooks.api.receiving.deleteNotification, notification_id
-            )
+        await asyncio.sleep(interval)
+        fsm.snapshot()
+        logger.info(f"WhatsApp FSM: {fsm.stats()}")
 
 
 async def prepare_bot():
@@ -38,14 +55,43 @@ async def prepare_bot():
     # get_settings = bot.account.getSettings
     # settings = await asyncio.to_thread(get_settings)
     # if settings != set_settings_body:
-    await asyncio.to_thread(bot.account.setSettings, set_settings_body)
+    await get_app().client.set_settings(set_settings_body)
+
+
+def fsm_state_counts() -> dict[tuple[str, str], int]:
+    """Collect dialogs by FSM state for metrics."""
+    counts = get_fsm().state_counts()
+    return {("whatsapp", state): count for state, count in counts.items()}
 
 
 async def main():
-    await start_scheduler()
+    app = create_app(get_config())
+    FSM_STATES.add_collector(fsm_state_counts)
+    metrics = await start_metrics_server("whatsapp")
+
+    fsm = get_fsm()
+    fsm.load()
+    snapshots = asyncio.create_task(snapshot_fsm())
+
+    deferred = get_deferred()
+    deferred.register("whatsapp", app.client.send_message)
+    deferred.start()
 
+    # Replies mustn't wait for reminders of the first tick
     await prepare_bot()
-    await keep_alive()
+    receiver = asyncio.create_task(keep_alive())
+    try:
+        await start_scheduler()
+        await receiver
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        snapshots.cancel()
+        fsm.snapshot()
+        await deferred.stop()
+        await app.client.close()
+        if metrics is not None:
+            await metrics.cleanup()
 
     # bot.webhooks.startReceivingNotifications(middleware)
 
@@ -0,0 +1,163 @@
+"""Inbound pipeline of the WhatsApp bot.
+
+A receiver task takes notifications from Green API and puts them into
+queues sharded by `chatId`. Every shard has its own worker, so messages
+of one chat are handled in order while different chats are handled in
+parallel.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from clinic_app.backend.metrics import INBOUND_LAG_SECONDS, INBOUND_QUEUE_DEPTH
+from loguru import logger
+
+if TYPE_CHECKING:
+    from clinic_app.frontend.whatsapp_bot.client import AsyncGreenApi
+
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_STATS_INTERVAL = 60
+
+Handler = Callable[[str, dict], Awaitable[Any]]
+
+
+@dataclass(slots=True)
+class InboundMessage:
+    """Notification waiting for a worker."""
+
+    type_webhook: str
+    body: dict
+    received_at: float = field(default_factory=time.monotonic)
+
+
+class InboundPipeline:
+    """Receive notifications and handle them by sharded workers.
+
+    Green API returns the head of its queue until it's deleted, so a
+    notification is acknowledged right after it's put into a shard queue
+    and the receiver never waits for handlers.
+
+    Parameters
+    ----------
+    client : AsyncGreenApi
+        Green API client.
+    handler : Handler
+        coroutine function called with type of webhook and its body.
+    workers : int, optional
+        Count of shards and workers, by default `DEFAULT_WORKERS`.
+    queue_size : int, optional
+        Max size of shard queue, by default `DEFAULT_QUEUE_SIZE`.
+    stats_interval : float, optional
+        Seconds between stats log records, 0 disables them,
+        by default `DEFAULT_STATS_INTERVAL`.
+
+    """
+
+    def __init__(
+        self,
+        client: AsyncGreenApi,
+        handler: Handler,
+        workers: int = DEFAULT_WORKERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        stats_interval: float = DEFAULT_STATS_INTERVAL,
+    ) -> None:
+        self.client = client
+        self.handler = handler
+        self.stats_interval = stats_interval
+        self.queues: list[asyncio.Queue[InboundMessage]] = [
+            asyncio.Queue(maxsize=queue_size) for _ in range(workers)
+        ]
+
+        self.received = 0
+        self.processed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def shard(self, chat_id: str) -> int:
+        """Get index of shard queue for chat."""
+        return zlib.crc32(str(chat_id).encode()) % len(self.queues)
+
+    def depth(self) -> int:
+        """Get count of messages waiting in shard queues."""
+        return sum(queue.qsize() for queue in self.queues)
+
+    def stats(self) -> dict[str, Any]:
+        """Get queue depth, processing lag and counters."""
+        return {
+            "queue_depth": self.depth(),
+            "shard_depths": [queue.qsize() for queue in self.queues],
+            "received": self.received,
+            "processed": self.processed,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
+    async def run(self) -> None:
+        """Run receiver, workers and stats reporter until cancelled."""
+        tasks = [asyncio.create_task(self._receive())]
+        tasks += [
+            asyncio.create_task(self._work(queue)) for queue in self.queues
+        ]
+        if self.stats_interval:
+            tasks.append(asyncio.create_task(self._report()))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _receive(self) -> None:
+        while True:
+            try:
+                notification = await self.client.receive_notification()
+            except Exception as e:
+                logger.exception(e)
+                await asyncio.sleep(1)
+                continue
+
+            if not notification:
+                continue
+
+            body = notification["body"]
+            type_webhook = body["typeWebhook"]
+            sender = body.get("senderData")
+            if type_webhook == "incomingMessageReceived" and sender:
+                self.received += 1
+                queue = self.queues[self.shard(sender["chatId"])]
+                await queue.put(InboundMessage(type_webhook, body))
+                INBOUND_QUEUE_DEPTH.set(self.depth(), channel="whatsapp")
+
+            try:
+                await self.client.delete_notification(
+                    notification["receiptId"]
+                )
+            except Exception as e:
+                logger.exception(e)
+
+    async def _work(self, queue: asyncio.Queue[InboundMessage]) -> None:
+        while True:
+            message = await queue.get()
+            self.last_lag = time.monotonic() - message.received_at
+            self.max_lag = max(self.max_lag, self.last_lag)
+            INBOUND_LAG_SECONDS.observe(self.last_lag, channel="whatsapp")
+            INBOUND_QUEUE_DEPTH.set(self.depth(), channel="whatsapp")
+            try:
+                await self.handler(message.type_webhook, message.body)
+            except Exception as e:
+                logger.exception(e)
+            finally:
+                self.processed += 1
+                queue.task_done()
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logger.info(f"WhatsApp inbound pipeline: {self.stats()}")
+            self.max_lag = 0.0
@@ -1,7 +1,20 @@
-from collections import defaultdict
-from dataclasses import dataclass, field
+import json
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
 from typing import Any, Dict, Optional, Self, Tuple, Type
 
+from clinic_app.backend.locks import write_atomic
+from clinic_app.shared.config import get_config
+
+DEFAULT_TTL_HOURS = 72
+DEFAULT_MAX_SIZE = 10_000
+DEFAULT_SNAPSHOT_INTERVAL = 60
+
+# Names of states of all groups, to restore states from snapshot
+_STATES: Dict[str, "StateWhatsapp"] = {}
+
 
 class StateWhatsapp:
     def __init__(self) -> None:
@@ -43,6 +56,7 @@ class MetaFSM(type):
                 states.append(arg)
 
         cls.__states__ = tuple(states)
+        _STATES.update((state.state, state) for state in states)
         cls.__state_names__ = tuple(state.state for state in states)
 
         return cls
@@ -67,42 +81,178 @@ class WhatsappFSMGroup(metaclass=MetaFSM):
         return f"StatesGroup {type(self).__name__}"
 
 
-@dataclass
-class MemoryStorageRecord:
-    data: Dict[str, Any] = field(default_factory=dict)
-    state: Optional[str] = None
-
-
-class WhatsappFSMContext:
-    def __init__(self) -> None:
-        self.storage = defaultdict(MemoryStorageRecord)
-
-    def set_state(self, state: StateWhatsapp, user_id: int):
-        self.storage[user_id].state = state
-
-    def get_state(self, user_id: int) -> Optional[StateWhatsapp]:
-        return self.storage[user_id].state
+class FSMRecord:
+    """State and data of one chat."""
 
-    def update_data(self, user_id: int, **kwargs):
-        data = self.storage[user_id].data
-        if data is None:
-            data = kwargs
+    __slots__ = ("state", "data", "touched")
 
-        data.update(kwargs)
+    def __init__(
+        self,
+        state: Optional[str] = None,
+        data: Optional[Dict[str, Any]] = None,
+        touched: float = 0.0,
+    ) -> None:
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched or time.time()
 
-    def set_data(self, user_id: int, **kwargs):
-        self.storage[user_id].data = kwargs
-    
-    def get_data(self, user_id: int):
-        return self.storage[user_id].data
 
-    def clear(self, user_id: int):
-        self.set_state(None, user_id)
-        self.set_data(user_id)
+class WhatsappFSMContext:
+    """Bounded storage of FSM records of chats.
+
+    Lookups don't create records. Records are kept in order of last use
+    and evicted when they are idle for `ttl` seconds or when there are
+    more than `max_size` of them. States are kept as names, so records
+    can be saved to json snapshot and loaded after restart.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds of idle time before record is evicted,
+        by default `DEFAULT_TTL_HOURS` hours.
+    max_size : int, optional
+        Max count of records, by default `DEFAULT_MAX_SIZE`.
+    snapshot_path : Optional[str], optional
+        Path to json snapshot, None disables snapshots,
+        by default None.
+
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_TTL_HOURS * 3600,
+        max_size: int = DEFAULT_MAX_SIZE,
+        snapshot_path: Optional[str] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self.snapshot_path = snapshot_path
+        self.storage: OrderedDict[Any, FSMRecord] = OrderedDict()
+
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    def _get(self, user_id: Any) -> Optional[FSMRecord]:
+        record = self.storage.get(user_id)
+        if record is None:
+            return None
+        if time.time() - record.touched > self.ttl:
+            del self.storage[user_id]
+            self.evicted_idle += 1
+            return None
+        return record
+
+    def _touch(self, user_id: Any) -> FSMRecord:
+        record = self._get(user_id)
+        if record is None:
+            record = self.storage[user_id] = FSMRecord()
+        record.touched = time.time()
+        self.storage.move_to_end(user_id)
+        self._evict()
+        return record
+
+    def _evict(self) -> None:
+        expires = time.time() - self.ttl
+        while self.storage:
+            record = next(iter(self.storage.values()))
+            if record.touched >= expires:
+                break
+            self.storage.popitem(last=False)
+            self.evicted_idle += 1
+        while len(self.storage) > self.max_size:
+            self.storage.popitem(last=False)
+            self.evicted_lru += 1
+
+    def _drop_empty(self, user_id: Any, record: FSMRecord) -> None:
+        if record.state is None and not record.data:
+            self.storage.pop(user_id, None)
+
+    def set_state(self, state: Optional[StateWhatsapp], user_id: Any):
+        if state is None:
+            record = self._get(user_id)
+            if record is not None:
+                record.state = None
+                self._drop_empty(user_id, record)
+            return
+        self._touch(user_id).state = state.state
+
+    def get_state(self, user_id: Any) -> Optional[StateWhatsapp]:
+        record = self._get(user_id)
+        if record is None or record.state is None:
+            return None
+        return _STATES.get(record.state)
+
+    def update_data(self, user_id: Any, **kwargs):
+        self._touch(user_id).data.update(kwargs)
+
+    def set_data(self, user_id: Any, **kwargs):
+        if not kwargs:
+            record = self._get(user_id)
+            if record is not None:
+                record.data = {}
+                self._drop_empty(user_id, record)
+            return
+        self._touch(user_id).data = kwargs
+
+    def get_data(self, user_id: Any) -> Dict[str, Any]:
+        record = self._get(user_id)
+        if record is None:
+            return {}
+        return record.data
+
+    def clear(self, user_id: Any):
+        self.storage.pop(user_id, None)
 
     def get_users_id(self):
         return list(self.storage.keys())
 
+    def state_counts(self) -> Dict[str, int]:
+        """Get count of live records by state."""
+        expires = time.time() - self.ttl
+        counts: Dict[str, int] = {}
+        for record in self.storage.values():
+            if record.state is not None and record.touched >= expires:
+                counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+
+    def stats(self) -> Dict[str, Any]:
+        """Get count of records, evictions and approximate size."""
+        size = sys.getsizeof(self.storage)
+        for user_id, record in self.storage.items():
+            size += sys.getsizeof(user_id) + sys.getsizeof(record)
+            size += sys.getsizeof(record.data)
+            size += sum(sys.getsizeof(v) for v in record.data.values())
+        return {
+            "records": len(self.storage),
+            "max_size": self.max_size,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+            "approx_bytes": size,
+        }
+
+    def snapshot(self) -> None:
+        """Save records to json snapshot if it's enabled."""
+        if not self.snapshot_path:
+            return
+        self._evict()
+        records = [
+            [user_id, record.state, record.data, record.touched]
+            for user_id, record in self.storage.items()
+        ]
+        write_atomic(
+            self.snapshot_path, json.dumps(records, ensure_ascii=False)
+        )
+
+    def load(self) -> None:
+        """Load records from json snapshot if it exists."""
+        if not self.snapshot_path or not Path(self.snapshot_path).exists():
+            return
+        with open(self.snapshot_path) as f:
+            records = json.load(f)
+        for user_id, state, data, touched in records:
+            self.storage[user_id] = FSMRecord(state, data, touched)
+        self._evict()
+
 
 class MainFSM(WhatsappFSMGroup):
     notify_tommorow = StateWhatsapp()
@@ -111,9 +261,18 @@ class MainFSM(WhatsappFSMGroup):
     get_review = StateWhatsapp()
 
 
-_state = WhatsappFSMContext()
+_state: Optional[WhatsappFSMContext] = None
 
 
 def get_fsm() -> WhatsappFSMContext:
     """Get whatsapp bot FSMContext."""
+    global _state
+
+    if _state is None:
+        cfg = get_config()["whatsapp_bot"].get("fsm") or {}
+        _state = WhatsappFSMContext(
+            ttl=cfg.get("ttl_hours", DEFAULT_TTL_HOURS) * 3600,
+            max_size=cfg.get("max_size", DEFAULT_MAX_SIZE),
+            snapshot_path=cfg.get("snapshot_path"),
+        )
     return _state
@@ -0,0 +1,85 @@
+"""Fixtures of tests: generated data and isolated working directories.
+
+Applications of bots and storages read config.yml and .env of the
+working directory, so they're created by fixtures after the working
+directory is prepared.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from benchmarks.generate import Scale
+from benchmarks.load import ROOT, prepare_workdir
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("clinic", "generated clinic data")
+    group.addoption(
+        "--patients",
+        type=int,
+        default=Scale.patients,
+        help="rows of generated db.csv",
+    )
+    group.addoption(
+        "--appointments",
+        type=int,
+        default=Scale.appointments,
+        help="rows of generated appointment files",
+    )
+
+
+@pytest.fixture(scope="session")
+def scale(pytestconfig: pytest.Config) -> Scale:
+    return Scale(
+        patients=pytestconfig.getoption("patients"),
+        appointments=pytestconfig.getoption("appointments"),
+    )
+
+
+@pytest.fixture(scope="session")
+def workdir(
+    tmp_path_factory: pytest.TempPathFactory, scale: Scale
+) -> Path:
+    """Working directory with config.yml, .env and generated csv files."""
+    path = tmp_path_factory.mktemp("clinic")
+    prepare_workdir(path, scale)
+
+    cwd = os.getcwd()
+    os.chdir(path)
+    yield path
+
+    # Paths of pending writes are relative to the working directory
+    from clinic_app.backend.write_behind import flush_all
+
+    flush_all()
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def clinic_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Working directory with config.yml of the repository and no data."""
+    shutil.copy(ROOT / "config.yml", tmp_path / "config.yml")
+    shutil.copy(ROOT / ".env-example", tmp_path / ".env")
+    (tmp_path / "src_csvs" / "01").mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(scope="session")
+def loop(workdir: Path) -> asyncio.AbstractEventLoop:
+    """Event loop of the session, queues and locks of bots are bound to it."""
+    loop = asyncio.new_event_loop()
+    yield loop
+
+    # Workers of queues run until they're cancelled
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.wait(tasks))
+    loop.close()
@@ -0,0 +1,494 @@
+"""Benchmarks of hot paths on generated data.
+
+Run `pytest tests --benchmark-autosave` to save results as JSON into
+`.benchmarks/` and `pytest-benchmark compare` to compare saved runs.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import subprocess
+import sys
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+import pandas as pd
+import pytest
+from benchmarks.generate import Scale, raw_phone
+from benchmarks.load import ROOT
+from clinic_app.backend.utils import format_phone, format_phones
+
+# Messages fed to handlers in one round
+HANDLER_MESSAGES = 200
+# Seconds of imports of startup paths, by `-X importtime`
+IMPORT_BUDGET = 1.0
+# Statement, modules which mustn't be imported by it and budget of it.
+# aiogram builds its models at import, the telegram bot can't start
+# faster than that, so only lazy imports of its application are checked
+STARTUP_PATHS = [
+    (
+        "import clinic_app.frontend.telegram_bot.main",
+        ("pandas", "aiogram", "apscheduler"),
+        IMPORT_BUDGET,
+    ),
+    (
+        "import clinic_app.frontend.whatsapp_bot.main",
+        ("pandas", "aiogram", "apscheduler"),
+        IMPORT_BUDGET,
+    ),
+    (
+        "import clinic_app.frontend.combined.main",
+        ("pandas", "aiogram", "apscheduler"),
+        IMPORT_BUDGET,
+    ),
+    (
+        "from clinic_app.frontend.telegram_bot.app import create_app\n"
+        "create_app()",
+        ("pandas", "apscheduler"),
+        None,
+    ),
+    (
+        "from clinic_app.frontend.whatsapp_bot.app import create_app\n"
+        "create_app()",
+        ("pandas", "aiogram", "apscheduler"),
+        IMPORT_BUDGET,
+    ),
+]
+
+
+class FakeSender:
+    """Coroutine function recording sent messages instead of sending."""
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def __call__(self, chat_id: Any, text: str, **kwargs: Any) -> None:
+        self.sent += 1
+
+
+@pytest.fixture(scope="module")
+def phones(scale: Scale) -> list[str]:
+    rnd = random.Random(scale.seed)
+    return [
+        raw_phone(rnd, rnd.randrange(scale.patients * 2)) for _ in range(1000)
+    ]
+
+
+def reset_ledger() -> None:
+    """Forget sent notifications, so the next tick sends them again."""
+    from clinic_app.backend import ledger
+
+    path = ledger.get_ledger().path
+    ledger._ledger = None
+    Path(path).unlink(missing_ok=True)
+
+
+def tick_setup(scheduler):
+    """Get setup of a round of `check_csvs` sending every notification."""
+
+    def setup():
+        reset_ledger()
+        return (scheduler.check_csvs(),), {}
+
+    return setup
+
+
+def import_times(statement: str, cwd: Path) -> tuple[set[str], float]:
+    """Get imported modules and seconds of imports of the statement."""
+    command = [sys.executable, "-X", "importtime", "-c", statement]
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+    # The first run writes bytecode caches of changed modules
+    for _ in range(2):
+        result = subprocess.run(
+            command, cwd=cwd, env=env, capture_output=True, text=True
+        )
+        assert result.returncode == 0, result.stderr
+
+    modules = set()
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip())
+        # Nested imports are included in cumulative time of top-level ones
+        if not name.startswith("  "):
+            total += int(cumulative) / 1e6
+    return modules, total
+
+
+def first_by_user(appointments: list) -> list:
+    """Get appointments of `HANDLER_MESSAGES` distinct users."""
+    by_user = {}
+    for appointment in appointments:
+        by_user.setdefault(appointment.user_id, appointment)
+    return list(by_user.values())[:HANDLER_MESSAGES]
+
+
+def test_format_phone(benchmark, phones: list[str]) -> None:
+    result = benchmark(lambda: [format_phone(phone) for phone in phones])
+    assert None not in result
+
+
+def test_format_phones(benchmark, phones: list[str]) -> None:
+    series = pd.Series(phones)
+    result = benchmark(format_phones, series)
+    assert result.notna().all()
+
+
+def test_database_value_exists(benchmark, workdir, phones) -> None:
+    from clinic_app.backend.storage import get_database
+
+    db = get_database()
+
+    def lookup() -> int:
+        return sum(db.value_exists(phone, "phone") for phone in phones)
+
+    assert 0 < benchmark(lookup) < len(phones)
+
+
+def test_database_get_value_by_kv(benchmark, workdir, scale) -> None:
+    from clinic_app.backend.storage import get_database
+
+    db = get_database()
+    user_ids = [10**8 + number for number in range(0, scale.patients, 10)]
+
+    def lookup() -> list[Any]:
+        return [
+            db.get_value_by_kv(kv=("tg_user_id", user_id), column="phone")
+            for user_id in user_ids
+        ]
+
+    result = benchmark(lookup)
+    assert any(phone is not None for phone in result)
+
+
+def test_find_and_replace(benchmark, workdir) -> None:
+    from clinic_app.backend.storage import open_csv
+    from clinic_app.shared import CSVS
+
+    reviews = open_csv(CSVS["reviews"])
+    phone = reviews.read()["Телефон"].iloc[0]
+
+    benchmark(
+        reviews.find_and_replace,
+        search_value_column_name="Телефон",
+        search_value=phone,
+        new_value_column_name="Отзыв",
+        new_value="5",
+        save=True,
+    )
+    assert (reviews.read()["Отзыв"] == "5").any()
+
+
+@pytest.mark.parametrize(("statement", "lazy", "budget"), STARTUP_PATHS)
+def test_startup_imports(
+    workdir, statement: str, lazy: tuple[str, ...], budget: Optional[float]
+) -> None:
+    modules, total = import_times(statement, workdir)
+
+    assert not set(lazy) & modules
+    if budget is not None:
+        assert total < budget
+
+
+@pytest.fixture(scope="module")
+def telegram(workdir, loop):
+    """Telegram scheduler and dispatcher with fake sending of messages."""
+    from clinic_app.frontend.telegram_bot import handlers, scheduler
+    from clinic_app.frontend.telegram_bot.app import create_app
+
+    app = create_app()
+    sender = FakeSender()
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(app.bot, "send_message", sender)
+        yield scheduler, handlers, sender
+
+
+@pytest.fixture(scope="module")
+def whatsapp(workdir, loop):
+    """WhatsApp scheduler and handlers with fake sending of messages."""
+    from clinic_app.frontend.whatsapp_bot import handlers, scheduler
+    from clinic_app.frontend.whatsapp_bot.app import create_app
+
+    app = create_app()
+    sender = FakeSender()
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(app.client, "send_message", sender)
+        yield scheduler, handlers, sender
+
+
+def test_telegram_tick(benchmark, telegram, loop) -> None:
+    scheduler, _, sender = telegram
+
+    benchmark.pedantic(
+        loop.run_until_complete,
+        setup=tick_setup(scheduler),
+        rounds=3,
+    )
+    assert sender.sent > 0
+
+
+def test_whatsapp_tick(benchmark, whatsapp, loop) -> None:
+    scheduler, _, sender = whatsapp
+
+    benchmark.pedantic(
+        loop.run_until_complete,
+        setup=tick_setup(scheduler),
+        rounds=3,
+    )
+    assert sender.sent > 0
+
+
+def test_combined_tick(benchmark, telegram, whatsapp, loop) -> None:
+    from clinic_app.backend.ticks import get_kinds, run_tick
+
+    adapters = [telegram[0].ADAPTER, whatsapp[0].ADAPTER]
+    senders = [telegram[2], whatsapp[2]]
+
+    def setup():
+        reset_ledger()
+        for sender in senders:
+            sender.sent = 0
+        return (run_tick(adapters, get_kinds(adapters)),), {}
+
+    benchmark.pedantic(loop.run_until_complete, setup=setup, rounds=3)
+    assert all(sender.sent > 0 for sender in senders)
+
+
+def test_combined_tick_reads_once(telegram, whatsapp, loop) -> None:
+    from clinic_app.backend.metrics import CSV_READ_BYTES
+    from clinic_app.backend.ticks import get_kinds, run_tick
+
+    def read_bytes(*runs: list) -> float:
+        before = sum(CSV_READ_BYTES._values.values())
+        for adapters in runs:
+            reset_ledger()
+            loop.run_until_complete(run_tick(adapters, get_kinds(adapters)))
+        return sum(CSV_READ_BYTES._values.values()) - before
+
+    tg, wa = telegram[0].ADAPTER, whatsapp[0].ADAPTER
+    separate = read_bytes([tg], [wa])
+    combined = read_bytes([tg, wa])
+    assert 0 < combined <= separate / 2
+
+
+def test_whatsapp_handlers(benchmark, whatsapp, loop) -> None:
+    from clinic_app.backend.appointments import load_appointments
+    from clinic_app.backend.storage import open_csv
+    from clinic_app.frontend.whatsapp_bot.states import MainFSM, get_fsm
+    from clinic_app.shared import CSVS
+
+    scheduler, handlers, sender = whatsapp
+    csv = open_csv(CSVS["tommorow"])
+    appointments = first_by_user(
+        load_appointments(csv, scheduler.USER_COLUMN)
+    )
+    fsm = get_fsm()
+
+    def setup() -> None:
+        sender.sent = 0
+        for appointment in appointments:
+            fsm.set_state(MainFSM.notify_tommorow, appointment.user_id)
+            fsm.update_data(
+                appointment.user_id,
+                kind="tommorow",
+                info_data=appointment.to_list(),
+            )
+
+    bodies = [
+        {
+            "messageData": {"textMessageData": {"textMessage": "да"}},
+            "senderData": {
+                "chatId": appointment.user_id,
+                "sender": appointment.user_id,
+            },
+        }
+        for appointment in appointments
+    ]
+
+    async def handle() -> None:
+        for body in bodies:
+            await handlers.middleware("incomingMessageReceived", body)
+
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(handle()), setup=setup, rounds=5
+    )
+    assert sender.sent == len(bodies)
+
+
+def test_telegram_handlers(benchmark, telegram, loop) -> None:
+    from aiogram import Bot
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Chat, Message, Update
+    from clinic_app.backend.appointments import load_appointments
+    from clinic_app.backend.storage import open_csv
+    from clinic_app.frontend.telegram_bot.app import get_app
+    from clinic_app.frontend.telegram_bot.states import UserStates, get_fsm
+    from clinic_app.shared import CSVS
+
+    class FakeSession(BaseSession):
+        """Session answering requests of handlers without Bot API."""
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.requests = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            self.requests += 1
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=self.requests,
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=method.text,
+                )
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self) -> None:
+            pass
+
+    scheduler, _, _ = telegram
+    app = get_app()
+    session = FakeSession()
+    bot = Bot(token=app.bot.token, session=session)
+    csv = open_csv(CSVS["tommorow"])
+    appointments = first_by_user(
+        load_appointments(csv, scheduler.USER_COLUMN)
+    )
+
+    async def set_states() -> None:
+        session.requests = 0
+        for appointment in appointments:
+            user_id = appointment.user_id
+            state = get_fsm(bot_id=bot.id, user_id=user_id, chat_id=user_id)
+            await state.set_state(UserStates.notify_tommorow)
+            await state.update_data(
+                kind="tommorow", info_data=appointment.to_list()
+            )
+
+    updates = [
+        Update.model_validate(
+            {
+                "update_id": number,
+                "message": {
+                    "message_id": number,
+                    "date": 0,
+                    "chat": {"id": appointment.user_id, "type": "private"},
+                    "from": {
+                        "id": appointment.user_id,
+                        "is_bot": False,
+                        "first_name": "Пациент",
+                    },
+                    "text": "Да",
+                },
+            },
+            context={"bot": bot},
+        )
+        for number, appointment in enumerate(appointments)
+    ]
+
+    async def handle() -> None:
+        for update in updates:
+            await app.dp.feed_update(bot, update)
+
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(handle()),
+        setup=lambda: loop.run_until_complete(set_states()),
+        rounds=5,
+    )
+    assert session.requests == len(updates)
+
+
+def test_telegram_webhook(benchmark, telegram, loop) -> None:
+    import aiohttp
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from benchmarks.load import free_port
+    from benchmarks.standins import TelegramStandIn
+    from clinic_app.frontend.telegram_bot.app import get_app
+    from clinic_app.frontend.telegram_bot.webhook import run_webhook
+
+    app = get_app()
+    standin = TelegramStandIn()
+    api_url = loop.run_until_complete(standin.start())
+    bot = Bot(
+        token=app.bot.token,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)),
+    )
+    port = free_port()
+    cfg = {
+        "url": f"http://127.0.0.1:{port}",
+        "host": "127.0.0.1",
+        "port": port,
+        "secret_token": "secret",
+    }
+    stop = asyncio.Event()
+    server = loop.create_task(run_webhook(app.dp, bot, cfg, stop=stop))
+
+    async def wait_webhook() -> None:
+        while not standin.webhook_url:
+            await asyncio.sleep(0.01)
+
+    async def wait_sent(count: int) -> None:
+        while standin.sent < count:
+            await asyncio.sleep(0.001)
+
+    # Patients unknown by the database are asked for phone by /start
+    chat_ids = range(10**12, 10**12 + HANDLER_MESSAGES)
+
+    async def handle() -> None:
+        sent = standin.sent
+        for chat_id in chat_ids:
+            standin.inject(chat_id, "/start")
+        await wait_sent(sent + len(chat_ids))
+
+    async def post_forged() -> int:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                standin.webhook_url,
+                json={"update_id": 0},
+                headers={"X-Telegram-Bot-Api-Secret-Token": "forged"},
+            ) as response:
+                return response.status
+
+    try:
+        loop.run_until_complete(asyncio.wait_for(wait_webhook(), 5))
+        benchmark.pedantic(
+            lambda: loop.run_until_complete(handle()), rounds=5
+        )
+        assert standin.webhook_secret == "secret"
+        assert loop.run_until_complete(post_forged()) == 401
+        assert standin.webhook_errors == 0
+    finally:
+        stop.set()
+        loop.run_until_complete(server)
+        loop.run_until_complete(standin.stop())
+
+
+def test_hash_ring(benchmark) -> None:
+    from clinic_app.frontend.telegram_bot.supervisor import HashRing
+
+    ring = HashRing(range(4))
+    user_ids = range(10**9, 10**9 + 10_000)
+    workers = benchmark(lambda: [ring.get(user_id) for user_id in user_ids])
+
+    # Users are spread evenly and most of them keep their worker when
+    # one more is added
+    assert min(Counter(workers).values()) > len(user_ids) / 4 * 0.8
+    grown = HashRing(range(5))
+    moved = sum(
+        ring.get(user_id) != grown.get(user_id) for user_id in user_ids
+    )
+    assert moved < len(user_ids) * 0.3
@@ -0,0 +1,29 @@
+"""Columnar cache of typed reads of csv files."""
+
+from __future__ import annotations
+
+import pandas as pd
+from clinic_app.backend.columnar import read_cached
+from clinic_app.backend.schema import CSVSchema
+
+ROWS = [
+    {"Телефон": "79990000001", "ИДВрач": 3, "ДатаНачала": "2026-10-18"},
+    {"Телефон": "79990000002", "ИДВрач": 4, "ДатаНачала": "2026-10-19"},
+]
+
+
+def test_cache_follows_changed_schema(tmp_path) -> None:
+    path = str(tmp_path / "tomorrow.csv")
+    pd.DataFrame(ROWS).to_csv(path, index=False)
+    schema = CSVSchema(dtypes={"Телефон": "string"})
+    assert read_cached(path, schema).columns.tolist() == ["Телефон"]
+
+    # Columns and dtypes were changed in config.yml
+    changed = CSVSchema(
+        dtypes={"Телефон": "string", "ИДВрач": "int32"},
+        datetimes=("ДатаНачала",),
+    )
+    df = read_cached(path, changed)
+    assert df.columns.tolist() == ["Телефон", "ИДВрач", "ДатаНачала"]
+    assert str(df["ИДВрач"].dtype) == "int32"
+    assert df.equals(read_cached(path, changed))
@@ -0,0 +1,19 @@
+"""Config of the repository loaded as a deployment loads it."""
+
+from __future__ import annotations
+
+import shutil
+
+from benchmarks.load import ROOT
+from clinic_app.shared.config import get_config
+
+
+def test_config_loads_with_env_example(tmp_path, monkeypatch) -> None:
+    shutil.copy(ROOT / "config.yml", tmp_path / "config.yml")
+    shutil.copy(ROOT / ".env-example", tmp_path / ".env")
+    monkeypatch.chdir(tmp_path)
+
+    config = get_config()
+    assert "telegram_bot" in config
+    assert "whatsapp_bot" in config
+    assert not config["telegram_bot"]["webhook"]["url"]
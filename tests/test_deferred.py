@@ -0,0 +1,80 @@
+"""Persistent service for deferred messages."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from clinic_app.backend.deferred import TEMPLATES, DeferredSender
+
+
+class FlakySender:
+    """Sender failing the first `failures` sends."""
+
+    def __init__(self, failures: int) -> None:
+        self.failures = failures
+        self.calls: list[tuple[str, str]] = []
+
+    async def __call__(self, chat_id: str, text: str) -> None:
+        self.calls.append((chat_id, text))
+        if len(self.calls) <= self.failures:
+            raise ConnectionError("API is unavailable")
+
+
+def jobs(deferred: DeferredSender) -> int:
+    return deferred._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+def run(deferred: DeferredSender, sender: FlakySender, delay: float) -> None:
+    async def main() -> None:
+        deferred.register("telegram", sender)
+        deferred.start()
+        deferred.schedule("telegram", 42, "review_thanks", delay=0)
+        await asyncio.sleep(delay)
+        await deferred.stop()
+
+    asyncio.run(main())
+
+
+def test_job_is_deleted_after_retry_succeeds(tmp_path) -> None:
+    deferred = DeferredSender(str(tmp_path / "jobs.sqlite3"), retry_delay=0.01)
+    sender = FlakySender(failures=2)
+
+    run(deferred, sender, delay=0.3)
+    assert sender.calls == [("42", TEMPLATES["review_thanks"])] * 3
+    assert jobs(deferred) == 0
+
+
+def test_job_is_dropped_after_max_attempts(tmp_path) -> None:
+    deferred = DeferredSender(
+        str(tmp_path / "jobs.sqlite3"), max_attempts=3, retry_delay=0.01
+    )
+    sender = FlakySender(failures=10)
+
+    run(deferred, sender, delay=0.3)
+    assert len(sender.calls) == 3
+    assert jobs(deferred) == 0
+    assert deferred.pending() == 0
+
+
+def test_failed_job_waits_for_retry_after_restart(tmp_path) -> None:
+    path = str(tmp_path / "jobs.sqlite3")
+    sender = FlakySender(failures=1)
+
+    run(DeferredSender(path, retry_delay=60), sender, delay=0.1)
+    assert len(sender.calls) == 1
+
+    restarted = DeferredSender(path)
+    restarted.register("telegram", sender)
+
+    async def main() -> None:
+        restarted.start()
+        await restarted.stop()
+
+    asyncio.run(main())
+    assert restarted.pending() == 1
+    attempts, run_at = restarted._conn.execute(
+        "SELECT attempts, run_at FROM jobs"
+    ).fetchone()
+    assert attempts == 1
+    assert run_at > time.time() + 30
@@ -0,0 +1,53 @@
+"""In-memory index of the patients database csv file."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from clinic_app.backend.csv_files import Database
+from clinic_app.backend.directory import get_directory
+
+
+def test_added_patient_is_found_at_once(clinic_dir) -> None:
+    db = Database()
+    assert not db.value_exists("79990000001", "phone")
+
+    db.add_row({"phone": "+7(999)000-00-01", "tg_user_id": 1})
+    assert db.value_exists("89990000001", "phone")
+    assert db.get_value_by_kv(("phone", "79990000001"), "tg_user_id") == 1
+    assert len(get_directory(db.path)) == 1
+
+
+def test_directory_reloads_changed_file(clinic_dir) -> None:
+    db = Database()
+    db.add_row({"phone": "79990000001", "tg_user_id": 1})
+    assert db.value_exists(1, "tg_user_id")
+
+    # Another process appends a patient without phone key
+    df = pd.read_csv(db.path, dtype={"phone": str})
+    df.loc[len(df)] = {"phone": "79990000002"}
+    df.to_csv(db.path, index=False)
+
+    assert db.value_exists("79990000002", "phone")
+    # Telegram ids of a column with empty cells are read as floats
+    assert db.get_value_by_kv(("tg_user_id", 1), "phone_key") == (
+        "7-999-000-00-01"
+    )
+    assert not db.value_exists("2", "tg_user_id")
+
+
+def test_phone_is_registered_once(clinic_dir) -> None:
+    db = Database()
+    rows = [
+        {"phone": "+7(999)000-00-01", "tg_user_id": 1},
+        {"phone": "89990000001", "wh_user_id": "79990000001@c.us"},
+    ] * 4
+
+    # Every call locks the file by its own descriptor, as processes do
+    with ThreadPoolExecutor(len(rows)) as pool:
+        added = list(pool.map(Database().add_row, rows))
+
+    assert added.count(True) == 1
+    assert len(pd.read_csv(db.path)) == 1
+    assert not db.add_row({"phone": "79990000001"})
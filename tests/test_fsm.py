@@ -0,0 +1,100 @@
+"""FSM storages of the bots."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from aiogram.fsm.storage.base import StorageKey
+from clinic_app.frontend.telegram_bot.fsm_storage import SQLiteStorage
+from clinic_app.frontend.whatsapp_bot.states import (
+    MainFSM,
+    WhatsappFSMContext,
+)
+
+STATE = "Notify:tommorow"
+
+
+def key(chat_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+
+
+def test_telegram_records_survive_restart(tmp_path) -> None:
+    path = str(tmp_path / "telegram_fsm.sqlite3")
+
+    async def main() -> None:
+        storage = SQLiteStorage(path, cache_size=1)
+        await storage.set_state(key(1), STATE)
+        await storage.update_data(key(1), {"kind": "tommorow"})
+        await storage.set_state(key(2), STATE)
+        assert len(storage._cache) == 1
+        await storage.close()
+
+        storage = SQLiteStorage(path)
+        assert await storage.get_state(key(1)) == STATE
+        assert await storage.get_data(key(1)) == {"kind": "tommorow"}
+        assert storage.state_counts() == {STATE: 2}
+        # Empty records aren't kept
+        await storage.set_state(key(2), None)
+        assert storage.count() == 1
+        await storage.close()
+
+    asyncio.run(main())
+
+
+def test_telegram_records_expire(tmp_path) -> None:
+    path = str(tmp_path / "telegram_fsm.sqlite3")
+
+    async def main() -> None:
+        storage = SQLiteStorage(path, ttl=60)
+        await storage.set_state(key(1), STATE)
+        await storage.set_state(key(2), STATE)
+        storage._conn.execute(
+            "UPDATE fsm SET updated = ? WHERE key = ?",
+            (time.time() - 61, storage._key(key(1))),
+        )
+        await storage.close()
+
+        storage = SQLiteStorage(path, ttl=60)
+        assert storage.state_counts() == {STATE: 1}
+        assert await storage.get_state(key(1)) is None
+        assert await storage.get_state(key(2)) == STATE
+        assert storage.count() == 1
+        await storage.close()
+
+    asyncio.run(main())
+
+
+def test_whatsapp_records_are_bounded() -> None:
+    fsm = WhatsappFSMContext(ttl=60, max_size=2)
+    for user_id in ("1", "2", "3"):
+        fsm.set_state(MainFSM.review, user_id)
+    assert fsm.get_users_id() == ["2", "3"]
+    assert fsm.evicted_lru == 1
+
+    fsm.storage["2"].touched -= 61
+    assert fsm.get_state("2") is None
+    assert fsm.get_state("3") is MainFSM.review
+    assert fsm.evicted_idle == 1
+
+    # Lookups and clearing of missing records don't create them
+    fsm.set_state(None, "4")
+    fsm.set_data("4")
+    assert fsm.get_data("4") == {}
+    assert fsm.get_users_id() == ["3"]
+
+
+def test_whatsapp_snapshot_restores_records(tmp_path) -> None:
+    path = str(tmp_path / "whatsapp_fsm.json")
+    fsm = WhatsappFSMContext(ttl=60, snapshot_path=path)
+    fsm.update_data("2", kind="review")
+    fsm.storage["2"].touched -= 61
+    fsm.set_state(MainFSM.rescheduling, "1")
+    fsm.update_data("1", kind="tommorow")
+    fsm.snapshot()
+
+    restored = WhatsappFSMContext(ttl=60, snapshot_path=path)
+    restored.load()
+    assert restored.get_users_id() == ["1"]
+    assert restored.get_state("1") is MainFSM.rescheduling
+    assert restored.get_data("1") == {"kind": "tommorow"}
@@ -0,0 +1,84 @@
+"""Ledger of sent notifications."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from clinic_app.backend import ledger as ledger_module
+from clinic_app.backend.appointments import Appointment
+from clinic_app.backend.ledger import SentLedger, send_once
+
+APPOINTMENT = ("79990000001", "2099-10-18 10:00")
+
+
+def test_concurrent_senders_send_once(tmp_path) -> None:
+    ledger = SentLedger(str(tmp_path / "sent.ledger"))
+    sent = []
+
+    async def notify() -> None:
+        with ledger.claim("telegram", "tommorow", APPOINTMENT, 1) as claimed:
+            if not claimed:
+                return
+            await asyncio.sleep(0.01)
+            sent.append(1)
+
+    async def main() -> None:
+        await asyncio.gather(*(notify() for _ in range(30)))
+
+    asyncio.run(main())
+    assert sent == [1]
+    assert ledger.was_sent("telegram", "tommorow", APPOINTMENT, 1)
+    assert not ledger.was_sent("whatsapp", "tommorow", APPOINTMENT, 1)
+
+
+def test_failed_send_is_released(tmp_path) -> None:
+    path = str(tmp_path / "sent.ledger")
+    ledger = SentLedger(path)
+    ledger.mark_sent("telegram", "2hours", APPOINTMENT, 2)
+
+    with pytest.raises(ConnectionError):
+        with ledger.claim("telegram", "2hours", APPOINTMENT, 1) as claimed:
+            assert claimed
+            raise ConnectionError
+
+    assert not ledger.was_sent("telegram", "2hours", APPOINTMENT, 1)
+    restarted = SentLedger(path)
+    assert not restarted.was_sent("telegram", "2hours", APPOINTMENT, 1)
+    assert restarted.was_sent("telegram", "2hours", APPOINTMENT, 2)
+    # Released claims are compacted
+    assert len(open(path).readlines()) == 1
+
+
+def test_expired_entries_are_compacted(tmp_path) -> None:
+    path = str(tmp_path / "sent.ledger")
+    ledger = SentLedger(path, keep_days=1)
+    ledger.mark_sent("telegram", "reviews", ("79990000001", "2000-01-01"), 1)
+    ledger.mark_sent("telegram", "reviews", APPOINTMENT, 1)
+
+    ledger.load()
+    assert len(ledger) == 1
+    assert ledger.was_sent("telegram", "reviews", APPOINTMENT, 1)
+    assert len(open(path).readlines()) == 1
+
+
+def test_reexported_appointment_is_sent_once(
+    clinic_dir, monkeypatch
+) -> None:
+    monkeypatch.setattr(ledger_module, "_ledger", None)
+    sent = []
+
+    async def send() -> None:
+        sent.append(1)
+
+    exports = [
+        Appointment(0, 1, "+7(999)000-00-01", "18.10.2099 10:00"),
+        # Phones of a column with empty cells are read as floats
+        Appointment(5, 1, 79990000001.0, "2099-10-18T10:00:00"),
+    ]
+    results = [
+        asyncio.run(send_once("telegram", "tommorow", appointment, send))
+        for appointment in exports
+    ]
+    assert results == [True, False]
+    assert sent == [1]
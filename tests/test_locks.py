@@ -0,0 +1,47 @@
+"""Locked and versioned writes of csv files."""
+
+from __future__ import annotations
+
+import os
+
+import pandas as pd
+import pytest
+from clinic_app.backend.locks import (
+    StaleVersionError,
+    read_version,
+    save_csv,
+    write_atomic,
+)
+
+
+def test_save_csv_bumps_version(tmp_path) -> None:
+    path = str(tmp_path / "db.csv")
+    assert read_version(path) == 0
+
+    assert save_csv(pd.DataFrame({"phone": ["1"]}), path) == 1
+    assert save_csv(pd.DataFrame({"phone": ["2"]}), path, 1) == 2
+    assert pd.read_csv(path, dtype=str)["phone"].tolist() == ["2"]
+
+
+def test_save_csv_rejects_stale_version(tmp_path) -> None:
+    path = str(tmp_path / "db.csv")
+    save_csv(pd.DataFrame({"phone": ["1"]}), path)
+    version = read_version(path)
+    # Another writer saved the file after it was read
+    save_csv(pd.DataFrame({"phone": ["2"]}), path)
+
+    with pytest.raises(StaleVersionError):
+        save_csv(pd.DataFrame({"phone": ["3"]}), path, version)
+    assert pd.read_csv(path, dtype=str)["phone"].tolist() == ["2"]
+    assert read_version(path) == version + 1
+
+
+def test_write_atomic_keeps_mode_and_leaves_no_temp(tmp_path) -> None:
+    path = tmp_path / "db.csv"
+    path.write_text("old")
+    os.chmod(path, 0o600)
+
+    write_atomic(str(path), "new")
+    assert path.read_text() == "new"
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert os.listdir(tmp_path) == ["db.csv"]
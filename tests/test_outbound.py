@@ -0,0 +1,66 @@
+"""Outbound queue of notifications."""
+
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta
+
+from clinic_app.backend.metrics import OUTBOUND_NOTIFICATIONS
+from clinic_app.backend.outbound import OutboundQueue
+from zoneinfo import ZoneInfo
+
+
+def count(kind: str, result: str) -> float:
+    key = ("telegram", kind, result)
+    return OUTBOUND_NOTIFICATIONS._values.get(key, 0)
+
+
+def test_priority_deadline_and_metrics() -> None:
+    now = datetime.now(ZoneInfo("Europe/Moscow")).replace(tzinfo=None)
+    sent: list[str] = []
+    before = {
+        (kind, result): count(kind, result)
+        for kind in ("2hours", "tommorow", "reviews")
+        for result in ("sent", "expired", "failed")
+    }
+
+    def sender(name: str, fail: bool = False):
+        async def send() -> None:
+            if fail:
+                raise ConnectionError
+            sent.append(name)
+
+        return send
+
+    async def main() -> None:
+        # One worker sends in order of the queue
+        queue = OutboundQueue(workers=1)
+        later = now + timedelta(days=1)
+        earlier = later - timedelta(hours=1)
+        past = now - timedelta(hours=1)
+        queue.put("telegram", "reviews", now, sender("review"))
+        queue.put("telegram", "tommorow", later, sender("tomorrow late"))
+        queue.put("telegram", "tommorow", earlier, sender("tomorrow early"))
+        queue.put("telegram", "2hours", later, sender("2hours"))
+        queue.put("telegram", "2hours", past, sender("expired"))
+        queue.put("telegram", "reviews", now, sender("failed", fail=True))
+        await queue.join()
+        await queue.stop()
+        assert queue.stats() == {
+            "queued": 0,
+            "sent": 4,
+            "expired": 1,
+            "failed": 1,
+        }
+
+    asyncio.run(main())
+    assert sent == ["2hours", "tomorrow early", "tomorrow late", "review"]
+
+    def added(kind: str, result: str) -> float:
+        return count(kind, result) - before[(kind, result)]
+
+    assert added("2hours", "sent") == 1
+    assert added("2hours", "expired") == 1
+    assert added("tommorow", "sent") == 2
+    assert added("reviews", "sent") == 1
+    assert added("reviews", "failed") == 1
@@ -0,0 +1,115 @@
+"""SQLite backend of appointment files and the patients database."""
+
+from __future__ import annotations
+
+import pandas as pd
+from clinic_app.backend.sqlite import SQLiteDatabase, SQLiteTable
+from clinic_app.backend.utils import appointment_key
+from clinic_app.shared import CSVS
+
+
+def write_reviews(rows: list[dict]) -> str:
+    path = CSVS["reviews"]
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def test_find_and_replace_phone_of_digits(clinic_dir) -> None:
+    path = write_reviews(
+        [
+            {"Телефон": 79990000001, "ДатаНачала": "2026-10-18 10:00"},
+            {"Телефон": 79990000002, "ДатаНачала": "2026-10-18 11:00"},
+        ]
+    )
+    table = SQLiteTable(path)
+    # Handlers search the phone of a typed read
+    phone = table.read().loc[1, "Телефон"]
+
+    row = table.find_and_replace("Телефон", phone, "Отзыв", "5", save=True)
+    assert row.index.tolist() == [1]
+    assert row["Отзыв"].tolist() == ["5"]
+    assert table.get_df()["Отзыв"].fillna("").tolist() == ["", "5"]
+
+
+def test_find_and_replace_phone_in_other_format(clinic_dir) -> None:
+    path = write_reviews(
+        [{"Телефон": "+7(999)000-00-01", "ДатаНачала": "2026-10-18 10:00"}]
+    )
+    table = SQLiteTable(path)
+
+    table.find_and_replace("Телефон", "89990000001", "Отзыв", "4", save=True)
+    assert table.get_df()["Отзыв"].tolist() == ["4"]
+    assert table.value_exists("79990000001", "Телефон")
+
+
+def test_find_and_replace_missing_value(clinic_dir) -> None:
+    path = write_reviews(
+        [{"Телефон": 79990000001, "ДатаНачала": "2026-10-18 10:00"}]
+    )
+    table = SQLiteTable(path)
+
+    row = table.find_and_replace("Телефон", "79990000009", "Отзыв", "5", True)
+    assert row.empty
+    assert "Отзыв" not in table.get_df().columns
+
+
+def test_database_lookup_by_phone(clinic_dir) -> None:
+    db = SQLiteDatabase()
+    db.add_row({"phone": "+7(999)000-00-01", "tg_user_id": 1})
+
+    assert db.value_exists("79990000001", "phone")
+    assert db.get_value_by_kv(("phone", "8(999)0000001"), "tg_user_id") == 1
+    assert db.get_value_by_kv(("tg_user_id", 2), "phone") is None
+
+    # The phone is registered already
+    assert not db.add_row({"phone": "89990000001", "wh_user_id": "1@c.us"})
+    assert db.get_value_by_kv(("phone", "79990000001"), "wh_user_id") is None
+
+
+def test_reimport_keeps_answers(clinic_dir) -> None:
+    first = {"Телефон": "79990000001", "ДатаНачала": "18.10.2026 10:00"}
+    second = {"Телефон": "79990000002", "ДатаНачала": "18.10.2026 11:00"}
+    path = write_reviews([first, second])
+    table = SQLiteTable(path)
+    table.update_cells(0, {"Подтверждение": 1})
+    table.find_and_replace("Телефон", "79990000002", "Отзыв", "5", True)
+
+    # New export moves rows and writes dates in another format
+    added = {"Телефон": "79990000003", "ДатаНачала": "2026-10-18 09:00"}
+    moved = {**first, "ДатаНачала": "2026-10-18 10:00"}
+    write_reviews([added, second, moved])
+    df = SQLiteTable(path).get_df()
+
+    assert df["Телефон"].tolist() == [
+        "79990000003",
+        "79990000002",
+        "79990000001",
+    ]
+    assert df["Подтверждение"].fillna(0).tolist() == [0, 0, 1]
+    assert df["Отзыв"].fillna("").tolist() == ["", "5", ""]
+
+
+def test_update_cells_follows_appointment_after_reimport(clinic_dir) -> None:
+    first = {"Телефон": "79990000001", "ДатаНачала": "2026-10-18 10:00"}
+    second = {"Телефон": "79990000002", "ДатаНачала": "2026-10-18 11:00"}
+    path = write_reviews([first, second])
+    SQLiteTable(path)
+    key = appointment_key(second["Телефон"], second["ДатаНачала"])
+
+    write_reviews([second, first])
+    table = SQLiteTable(path)
+    table.update_cells(1, {"Подтверждение": 1}, key)
+
+    assert table.get_df()["Подтверждение"].fillna(0).tolist() == [1, 0]
+
+
+def test_review_is_written_to_its_appointment(clinic_dir) -> None:
+    older = {"Телефон": 79990000001, "ДатаНачала": "2026-10-11 10:00"}
+    newer = {"Телефон": 79990000001, "ДатаНачала": "2026-10-18 10:00"}
+    path = write_reviews([older, newer])
+    table = SQLiteTable(path)
+    key = appointment_key(newer["Телефон"], newer["ДатаНачала"])
+
+    # Handlers update the row of the reviewed appointment by its key
+    table.update_cells(1, {"Отзыв": "5"}, key)
+    assert table.get_df()["Отзыв"].fillna("").tolist() == ["", "5"]
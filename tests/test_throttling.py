@@ -0,0 +1,100 @@
+"""Token buckets and retries of requests of the telegram bot."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+from clinic_app.frontend.telegram_bot.throttling import (
+    RateLimitMiddleware,
+    SharedTokenBucket,
+    TokenBucket,
+)
+
+METHOD = SendMessage(chat_id=1, text="Напоминание")
+
+
+def test_bucket_serves_burst_then_rate() -> None:
+    bucket = TokenBucket(rate=10, capacity=3)
+
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # Every next caller waits for its own slot
+    first, second = bucket.reserve(), bucket.reserve()
+    assert first == pytest.approx(0.1, abs=0.01)
+    assert second == pytest.approx(0.2, abs=0.01)
+
+
+def test_shared_bucket_is_common_for_processes(tmp_path) -> None:
+    path = str(tmp_path / "telegram_rate.bucket")
+    first = SharedTokenBucket(path, rate=1, capacity=2)
+    second = SharedTokenBucket(path, rate=1, capacity=2)
+
+    assert first.reserve() == 0.0
+    assert second.reserve() == 0.0
+    assert first.reserve() > 0.5
+
+
+def test_middleware_retries_failed_requests() -> None:
+    middleware = RateLimitMiddleware(
+        global_rate=1000, chat_rate=1000, max_retries=2, retry_backoff=0
+    )
+    errors = [
+        TelegramRetryAfter(METHOD, "Flood control", retry_after=0),
+        TelegramNetworkError(METHOD, "Timeout"),
+    ]
+
+    async def make_request(bot, method):
+        if errors:
+            raise errors.pop(0)
+        return "sent"
+
+    result = asyncio.run(middleware(make_request, None, METHOD))
+    assert result == "sent"
+    assert middleware.retried == 2
+    assert middleware.failed == 0
+
+
+def test_middleware_gives_up_after_max_retries() -> None:
+    middleware = RateLimitMiddleware(
+        global_rate=1000, chat_rate=1000, max_retries=1, retry_backoff=0
+    )
+    attempts = []
+
+    async def make_request(bot, method):
+        attempts.append(method)
+        raise TelegramNetworkError(method, "Timeout")
+
+    with pytest.raises(TelegramNetworkError):
+        asyncio.run(middleware(make_request, None, METHOD))
+    assert len(attempts) == 2
+    assert middleware.failed == 1
+
+
+def test_flood_control_pauses_other_chats() -> None:
+    middleware = RateLimitMiddleware(
+        global_rate=1000, chat_rate=1000, retry_backoff=0
+    )
+    errors = [TelegramRetryAfter(METHOD, "Flood control", retry_after=1)]
+    sent: dict[int, float] = {}
+
+    async def make_request(bot, method):
+        if errors:
+            raise errors.pop(0)
+        sent[method.chat_id] = time.monotonic() - started
+        return "sent"
+
+    async def main() -> None:
+        other = SendMessage(chat_id=2, text="Напоминание")
+        await asyncio.gather(
+            middleware(make_request, None, METHOD),
+            middleware(make_request, None, other),
+        )
+
+    started = time.monotonic()
+    asyncio.run(main())
+    # The second chat is sent after flood control of the first one
+    assert sent[2] >= 0.9
+    assert sent[1] >= 0.9
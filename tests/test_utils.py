@@ -0,0 +1,52 @@
+"""Normalization of phones and starts of appointments."""
+
+from __future__ import annotations
+
+import pandas as pd
+from clinic_app.backend.utils import (
+    appointment_key,
+    appointment_keys,
+    format_phone,
+    format_phones,
+)
+
+PHONES = [
+    "+7(999)000-00-01",
+    "89990000002",
+    "7-999-000-00-03",
+    "+7999-000-0004",
+    "12345",
+    "",
+]
+
+
+def test_format_phones_as_format_phone() -> None:
+    expected = [format_phone(phone) for phone in PHONES]
+    assert format_phones(pd.Series(PHONES)).tolist() == expected
+    assert expected[0] == "7-999-000-00-01"
+    assert expected[-2:] == [None, None]
+
+
+def test_format_phones_of_numbers() -> None:
+    # Phones read from csv without dtype, empty cells make them floats
+    phones = pd.Series([79990000001, None, 89990000002], dtype=float)
+    expected = ["7-999-000-00-01", None, "7-999-000-00-02"]
+    assert format_phones(phones).tolist() == expected
+    assert format_phone(phones[0]) == expected[0]
+    assert format_phone(int(phones[2])) == expected[2]
+
+
+def test_appointment_keys_as_appointment_key() -> None:
+    df = pd.DataFrame(
+        {
+            "Телефон": [79990000001, "89990000002", "12345"],
+            "ДатаНачала": ["18.10.2026 10:00", "2026-10-18 11:00", None],
+        }
+    )
+    expected = [
+        appointment_key(phone, start)
+        for phone, start in zip(df["Телефон"], df["ДатаНачала"])
+    ]
+    assert appointment_keys(df).tolist() == expected
+    assert expected[1] == ("7-999-000-00-02", "2026-10-18T11:00:00")
+    assert expected[2] is None
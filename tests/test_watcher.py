@@ -0,0 +1,75 @@
+"""Inotify watcher of csv files."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+
+from clinic_app.backend.locks import write_atomic
+from clinic_app.backend.watcher import CSVWatcher
+
+DEBOUNCE = 0.05
+
+
+def watch(tmp_path, change) -> list[str]:
+    """Get keys passed to callback after `change` of files."""
+    changed: list[str] = []
+    files = {
+        "tommorow": str(tmp_path / "tomorrow.csv"),
+        "2hours": str(tmp_path / "2hours.csv"),
+    }
+    for path in files.values():
+        with open(path, "w") as f:
+            f.write("Телефон\n")
+
+    async def callback(key: str) -> None:
+        changed.append(key)
+
+    async def main() -> None:
+        watcher = CSVWatcher(files, callback, debounce=DEBOUNCE)
+        watcher.start()
+        try:
+            change()
+            await asyncio.sleep(DEBOUNCE * 4)
+        finally:
+            watcher.close()
+
+    asyncio.run(main())
+    return changed
+
+
+def test_written_file_triggers_callback_once(tmp_path) -> None:
+    def change() -> None:
+        for _ in range(3):
+            with open(tmp_path / "tomorrow.csv", "a") as f:
+                f.write("79990000001\n")
+
+    assert watch(tmp_path, change) == ["tommorow"]
+
+
+def test_renamed_export_triggers_callback(tmp_path) -> None:
+    def change() -> None:
+        with open(tmp_path / "export.part", "w") as f:
+            f.write("Телефон\n79990000001\n")
+        os.replace(tmp_path / "export.part", tmp_path / "2hours.csv")
+
+    assert watch(tmp_path, change) == ["2hours"]
+
+
+def test_atomic_write_of_bots_is_ignored(tmp_path) -> None:
+    def change() -> None:
+        write_atomic(str(tmp_path / "tomorrow.csv"), "Телефон\n")
+        write_atomic(str(tmp_path / "other.csv"), "Телефон\n")
+
+    assert watch(tmp_path, change) == []
+
+
+def test_file_name_not_in_utf8_is_skipped(tmp_path) -> None:
+    def change() -> None:
+        # The export is in the same batch of events as the odd file
+        with open(os.path.join(os.fsencode(tmp_path), b"\xff.csv"), "w"):
+            pass
+        with open(tmp_path / "tomorrow.csv", "a") as f:
+            f.write("79990000001\n")
+
+    assert watch(tmp_path, change) == ["tommorow"]
@@ -0,0 +1,145 @@
+"""Write-behind journal of cell updates of csv files."""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+
+import pandas as pd
+from clinic_app.backend import write_behind
+from clinic_app.backend.csv_files import CSVFile
+from clinic_app.backend.utils import appointment_key
+from clinic_app.backend.write_behind import WriteBehindEngine
+
+FIRST = {"Телефон": "79990000001", "ДатаНачала": "2026-10-18 10:00"}
+SECOND = {"Телефон": "79990000002", "ДатаНачала": "2026-10-18 11:00"}
+THIRD = {"Телефон": "79990000003", "ДатаНачала": "2026-10-18 12:00"}
+
+
+def key(row: dict) -> tuple[str, str]:
+    return appointment_key(row["Телефон"], row["ДатаНачала"])
+
+
+def write(path, rows: list[dict]) -> None:
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def engine(path) -> WriteBehindEngine:
+    # Updates are flushed by tests only
+    return WriteBehindEngine(str(path), flush_interval_ms=60_000)
+
+
+def answers(path) -> list:
+    return pd.read_csv(path)["Подтверждение"].fillna(0).tolist()
+
+
+def test_flush_applies_updates_once(tmp_path) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [FIRST, SECOND])
+    wb = engine(path)
+
+    wb.update(1, {"Подтверждение": 1}, key(SECOND))
+    wb.update(1, {"Подтверждение": -1}, key(SECOND))
+    assert wb.pending == 1
+    assert pd.read_csv(path).columns.tolist() == [*FIRST]
+    assert wb.apply(pd.read_csv(path))["Подтверждение"].tolist()[1] == -1
+
+    wb.flush()
+    assert wb.pending == 0
+    assert answers(path) == [0, -1]
+    assert not (tmp_path / "tomorrow.csv.journal").read_text()
+
+
+def test_update_follows_appointment_after_export(tmp_path) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [FIRST, SECOND])
+    wb = engine(path)
+
+    # Index was read before the file was exported with other rows
+    write(path, [THIRD, SECOND, FIRST])
+    wb.update(1, {"Подтверждение": 1}, key(FIRST))
+    wb.flush()
+
+    assert answers(path) == [0, 0, 1]
+
+
+def test_update_of_removed_appointment_is_dropped(tmp_path) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [FIRST, SECOND])
+    wb = engine(path)
+
+    write(path, [THIRD, SECOND])
+    wb.update(0, {"Подтверждение": 1}, key(FIRST))
+    wb.flush()
+
+    assert "Подтверждение" not in pd.read_csv(path).columns
+    assert wb.pending == 0
+
+
+def test_replay_journal_of_previous_run(tmp_path) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [SECOND, FIRST])
+    entries = [
+        {"index": 0, "key": list(key(FIRST)), "values": {"Подтверждение": 1}},
+        # Entry of a version without keys is applied by index
+        {"index": 0, "values": {"Перезапись": -1}},
+    ]
+    journal = tmp_path / "tomorrow.csv.journal"
+    journal.write_text(
+        "".join(json.dumps(entry) + "\n" for entry in entries)
+        # Torn write of the last line
+        + '{"index": 1, "val'
+    )
+
+    engine(path)
+    df = pd.read_csv(path)
+    assert answers(path) == [0, 1]
+    assert df["Перезапись"].fillna(0).tolist() == [-1, 0]
+    assert not journal.read_text()
+
+
+def test_failed_flush_is_retried(tmp_path, monkeypatch) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [FIRST, SECOND])
+    wb = WriteBehindEngine(str(path), flush_interval_ms=10)
+    write_csv_atomic = write_behind.write_csv_atomic
+    failures = []
+
+    def fail_once(df, path) -> None:
+        monkeypatch.setattr(write_behind, "write_csv_atomic", write_csv_atomic)
+        failures.append(path)
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(write_behind, "write_csv_atomic", fail_once)
+    wb.update(0, {"Подтверждение": 1}, key(FIRST))
+
+    # The retry doesn't wait for another update
+    deadline = time.monotonic() + 5
+    while wb.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(failures) == 1
+    assert wb.pending == 0
+    assert answers(path) == [1, 0]
+
+
+def test_locked_modify_replays_journal(tmp_path) -> None:
+    path = tmp_path / "tomorrow.csv"
+    write(path, [FIRST, SECOND])
+    entry = {"index": 1, "key": list(key(SECOND)), "values": {"Отзыв": 5}}
+    (tmp_path / "tomorrow.csv.journal").write_text(json.dumps(entry) + "\n")
+
+    def modify() -> None:
+        def add(df: pd.DataFrame) -> None:
+            df.loc[len(df)] = THIRD
+
+        # The engine of the file isn't created yet
+        CSVFile(str(path)).modify(add, retries=1)
+
+    thread = threading.Thread(target=modify, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    df = pd.read_csv(path)
+    assert len(df) == 3
+    assert df["Отзыв"].fillna(0).tolist() == [0, 5, 0]